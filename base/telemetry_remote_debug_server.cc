@@ -51,11 +51,13 @@ class TelemetryRemoteDebugServer::Impl : boost::noncopyable {
   struct Message {
     std::string command;
     std::vector<std::string> names;
+    double rate_hz = 0.0;
 
     template <typename Archive>
     void Serialize(Archive* a) {
       a->Visit(MJ_NVP(command));
       a->Visit(MJ_NVP(names));
+      a->Visit(MJ_NVP(rate_hz));
     }
   };
 
@@ -66,6 +68,10 @@ class TelemetryRemoteDebugServer::Impl : boost::noncopyable {
       DoEnumerate(from);
     } else if (message.command == "get") {
       DoGet(message, from);
+    } else if (message.command == "subscribe") {
+      DoSubscribe(message.names, message.rate_hz, from);
+    } else if (message.command == "unsubscribe") {
+      DoSubscribe(message.names, 0.0, from);
     } else {
       std::cerr << "unknown remote debug command: '"
                 << message.command << "'\n";
@@ -112,6 +118,26 @@ class TelemetryRemoteDebugServer::Impl : boost::noncopyable {
     }
   }
 
+  /// Clients are expected to repeat the subscribe command as a
+  /// keepalive, well within the subscription timeout.
+  void DoSubscribe(const std::vector<std::string>& names,
+                   double rate_hz,
+                   const udp::endpoint& from) {
+    const auto expiration =
+        Clock::now() + std::chrono::duration_cast<Clock::duration>(
+            std::chrono::duration<double>(
+                parameters_.subscription_timeout_s));
+    for (const auto& name : names) {
+      auto it = handlers_.find(name);
+      if (it == handlers_.end()) {
+        std::cerr << "subscription to unknown name: '" + name + "'\n";
+        continue;
+      }
+
+      it->second->Subscribe(from, rate_hz, expiration);
+    }
+  }
+
   void HandleWrite(std::shared_ptr<std::string>,
                    mjlib::base::error_code ec) {
     mjlib::base::FailIf(ec);
@@ -148,6 +174,51 @@ void TelemetryRemoteDebugServer::AsyncStart(mjlib::io::ErrorCallback handler) {
       std::bind(std::move(handler), mjlib::base::error_code()));
 }
 
+void TelemetryRemoteDebugServer::Handler::Subscribe(
+    const udp::endpoint& endpoint, double rate_hz,
+    Clock::time_point expiration) {
+  if (rate_hz <= 0.0) {
+    subscriptions_.erase(endpoint);
+    return;
+  }
+
+  const auto period = std::chrono::duration_cast<Clock::duration>(
+      std::chrono::duration<double>(1.0 / rate_hz));
+  auto it = subscriptions_.find(endpoint);
+  if (it == subscriptions_.end()) {
+    subscriptions_.insert(std::make_pair(
+        endpoint, Subscription{period, expiration, Clock::now()}));
+  } else {
+    it->second.period = period;
+    it->second.expiration = expiration;
+  }
+}
+
+void TelemetryRemoteDebugServer::Handler::Publish() {
+  if (subscriptions_.empty()) { return; }
+
+  const auto now = Clock::now();
+  for (auto it = subscriptions_.begin(); it != subscriptions_.end();) {
+    auto& subscription = it->second;
+    if (now >= subscription.expiration) {
+      it = subscriptions_.erase(it);
+      continue;
+    }
+
+    if (now >= subscription.next_send) {
+      Respond(it->first);
+      // Advance on the original schedule, unless updates have been
+      // slower than the requested rate, so the average rate is kept
+      // without sending bursts after a pause.
+      subscription.next_send += subscription.period;
+      if (subscription.next_send < now) {
+        subscription.next_send = now + subscription.period;
+      }
+    }
+    ++it;
+  }
+}
+
 void TelemetryRemoteDebugServer::RegisterHandler(
     const std::string& name,
     std::unique_ptr<Handler> handler) {
@@ -14,6 +14,9 @@
 
 #pragma once
 
+#include <chrono>
+#include <map>
+
 #include <boost/asio/io_context.hpp>
 #include <boost/asio/ip/udp.hpp>
 #include <boost/signals2/signal.hpp>
@@ -34,9 +37,14 @@ class TelemetryRemoteDebugServer : boost::noncopyable {
   struct Parameters {
     int port = 13380;
 
+    /// Subscriptions which are not renewed within this time are
+    /// dropped.
+    double subscription_timeout_s = 5.0;
+
     template <typename Archive>
     void Serialize(Archive* a) {
       a->Visit(MJ_NVP(port));
+      a->Visit(MJ_NVP(subscription_timeout_s));
     }
   };
 
@@ -53,6 +61,8 @@ class TelemetryRemoteDebugServer : boost::noncopyable {
   }
 
  private:
+  typedef std::chrono::steady_clock Clock;
+
   class Handler : boost::noncopyable {
    public:
     virtual ~Handler() {}
@@ -61,6 +71,27 @@ class TelemetryRemoteDebugServer : boost::noncopyable {
     /// to the given UDP endpoint.  If a request is still outstanding,
     /// this will be a noop.
     virtual void Respond(const udp::endpoint&) = 0;
+
+    /// Send the contents of this registration to the given endpoint
+    /// each time it is updated, but no more than rate_hz times a
+    /// second, until the expiration time.  Subscribing again from
+    /// the same endpoint replaces the previous subscription.  A
+    /// rate_hz of zero or less unsubscribes.
+    void Subscribe(const udp::endpoint&, double rate_hz,
+                   Clock::time_point expiration);
+
+   protected:
+    /// Derived classes call this after each update.
+    void Publish();
+
+   private:
+    struct Subscription {
+      Clock::duration period;
+      Clock::time_point expiration;
+      Clock::time_point next_send;
+    };
+
+    std::map<udp::endpoint, Subscription> subscriptions_;
   };
 
   template <typename T>
@@ -123,7 +154,10 @@ class TelemetryRemoteDebugServer : boost::noncopyable {
                             endpoint);
     }
 
-    void HandleData(const T* data) { data_ = *data; }
+    void HandleData(const T* data) {
+      data_ = *data;
+      Publish();
+    }
 
     TelemetryRemoteDebugServer* const parent_;
     const std::string name_;
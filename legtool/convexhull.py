@@ -1,196 +1,109 @@
-#!/usr/bin/env python
+# Copyright 2014 Josh Pieper, jjp@pobox.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Convex hulls of 2D points, and the static stability margin of a
+point within one.'''
+
+import numpy
+
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def convex_hull(points):
+    '''Return the convex hull of an (N, 2) array of points as an (M, 2)
+    array in clockwise order, starting from the point with the lowest
+    x (then y).
+
+    Duplicate points and points lying on an edge are dropped, so a
+    degenerate input results in fewer than 3 points: a single point
+    if all are equal, or the two ends of a segment if all are
+    collinear.'''
+    points = numpy.asarray(points, dtype=numpy.float64).reshape(-1, 2)
+    if len(points) == 0:
+        return points
+
+    order = numpy.lexsort((points[:, 1], points[:, 0]))
+    points = points[order]
+    distinct = numpy.concatenate(
+        [[True], numpy.any(points[1:] != points[:-1], axis=1)])
+    points = points[distinct].tolist()
+    if len(points) < 3:
+        return numpy.array(points)
+
+    # Andrew's monotone chain, keeping only strict right turns.
+    def half(sequence):
+        result = []
+        for p in sequence:
+            while len(result) >= 2 and _cross(result[-2], result[-1], p) >= 0:
+                result.pop()
+            result.append(p)
+        return result
+
+    upper = half(points)
+    lower = half(reversed(points))
+    return numpy.array(upper[:-1] + lower[:-1])
+
+
+def _segment_distances(hull, point):
+    '''Return the distance from point to each edge of hull.'''
+    start = hull
+    end = numpy.roll(hull, -1, axis=0)
+    edge = end - start
+    length_squared = numpy.sum(edge * edge, axis=1)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        t = numpy.sum((point - start) * edge, axis=1) / length_squared
+    t = numpy.clip(numpy.nan_to_num(t), 0.0, 1.0)
+    nearest = start + t[:, numpy.newaxis] * edge
+    return numpy.sqrt(numpy.sum((point - nearest) ** 2, axis=1))
+
+
+def stability_margin(hull, point):
+    '''Return the signed distance from point to the boundary of a hull
+    returned by convex_hull.  It is positive when point is inside and
+    negative when outside.  A hull of fewer than 3 points has no
+    inside, so the result is never positive.  Returns None for an
+    empty hull.'''
+    hull = numpy.asarray(hull, dtype=numpy.float64).reshape(-1, 2)
+    point = numpy.asarray(point, dtype=numpy.float64)
+    if len(hull) == 0:
+        return None
+
+    distances = _segment_distances(hull, point)
+    if len(hull) < 3:
+        return -float(distances.min())
+
+    # The hull is clockwise, so the inside is to the right of every
+    # edge.
+    edge = numpy.roll(hull, -1, axis=0) - hull
+    offset = point - hull
+    inside = numpy.all(edge[:, 0] * offset[:, 1] - edge[:, 1] * offset[:, 0]
+                       <= 0)
+    if inside:
+        return float(distances.min())
+    return -float(distances.min())
+
+
+def support_margin(points, point):
+    '''Return (hull, margin), the convex_hull of points and the
+    stability_margin of point within it.'''
+    hull = convex_hull(points)
+    return hull, stability_margin(hull, point)
 
-"""convexhull.py
-
-Calculate the convex hull of a set of n 2D-points in O(n log n) time.
-Taken from Berg et al., Computational Geometry, Springer-Verlag, 1997.
-Prints output as EPS file.
-
-When run from the command line it generates a random set of points
-inside a square of given length and finds the convex hull for those,
-printing the result as an EPS file.
-
-Usage:
-
-    convexhull.py <numPoints> <squareLength> <outFile>
-
-Dinu C. Gherman
-"""
-
-
-import sys, string, random
-
-
-######################################################################
-# Helpers
-######################################################################
-
-def _myDet(p, q, r):
-    """Calc. determinant of a special matrix with three 2D points.
-
-    The sign, "-" or "+", determines the side, right or left,
-    respectivly, on which the point r lies, when measured against
-    a directed vector from p to q.
-    """
-
-    # We use Sarrus' Rule to calculate the determinant.
-    # (could also use the Numeric package...)
-    sum1 = q[0]*r[1] + p[0]*q[1] + r[0]*p[1]
-    sum2 = q[0]*p[1] + r[0]*q[1] + p[0]*r[1]
-
-    return sum1 - sum2
-
-
-def _isRightTurn((p, q, r)):
-    "Do the vectors pq:qr form a right turn, or not?"
-
-    assert p != q and q != r and p != r
-
-    if _myDet(p, q, r) < 0:
-        return 1
-    else:
-        return 0
-
-
-def _isPointInPolygon(r, P):
-    "Is point r inside a given polygon P?"
-
-    # We assume the polygon is a list of points, listed clockwise!
-    for i in xrange(len(P[:-1])):
-        p, q = P[i], P[i+1]
-        if not _isRightTurn((p, q, r)):
-            return 0 # Out!
-
-    return 1 # It's within!
-
-
-def _makeRandomData(numPoints=10, sqrLength=100, addCornerPoints=0):
-    "Generate a list of random points within a square."
-
-    # Fill a square with random points.
-    min, max = 0, sqrLength
-    P = []
-    for i in xrange(numPoints):
-        rand = random.randint
-        x = rand(min+1, max-1)
-        y = rand(min+1, max-1)
-        P.append((x, y))
-
-    # Add some "outmost" corner points.
-    if addCornerPoints != 0:
-        P = P + [(min, min), (max, max), (min, max), (max, min)]
-
-    return P
-
-
-######################################################################
-# Output
-######################################################################
-
-epsHeader = """%%!PS-Adobe-2.0 EPSF-2.0
-%%%%BoundingBox: %d %d %d %d
-
-/r 2 def                %% radius
-
-/circle                 %% circle, x, y, r --> -
-{
-    0 360 arc           %% draw circle
-} def
-
-/cross                  %% cross, x, y --> -
-{
-    0 360 arc           %% draw cross hair
-} def
-
-1 setlinewidth          %% thin line
-newpath                 %% open page
-0 setgray               %% black color
-
-"""
-
-def saveAsEps(P, H, boxSize, path):
-    "Save some points and their convex hull into an EPS file."
-
-    # Save header.
-    f = open(path, 'w')
-    f.write(epsHeader % (0, 0, boxSize, boxSize))
-
-    format = "%3d %3d"
-
-    # Save the convex hull as a connected path.
-    if H:
-        f.write("%s moveto\n" % format % H[0])
-        for p in H:
-            f.write("%s lineto\n" % format % p)
-        f.write("%s lineto\n" % format % H[0])
-        f.write("stroke\n\n")
-
-    # Save the whole list of points as individual dots.
-    for p in P:
-        f.write("%s r circle\n" % format % p)
-        f.write("stroke\n")
-
-    # Save footer.
-    f.write("\nshowpage\n")
-
-
-######################################################################
-# Public interface
-######################################################################
 
 def convexHull(P):
-    "Calculate the convex hull of a set of points."
-
-    # Get a local list copy of the points and sort them lexically.
-    points = map(None, P)
-    points.sort()
-
-    # Build upper half of the hull.
-    upper = [points[0], points[1]]
-    for p in points[2:]:
-        upper.append(p)
-        while len(upper) > 2 and not _isRightTurn(upper[-3:]):
-            del upper[-2]
-
-    # Build lower half of the hull.
-    points.reverse()
-    lower = [points[0], points[1]]
-    for p in points[2:]:
-        lower.append(p)
-        while len(lower) > 2 and not _isRightTurn(lower[-3:]):
-            del lower[-2]
-
-    # Remove duplicates.
-    del lower[0]
-    del lower[-1]
-
-    # Concatenate both halfs and return.
-    return tuple(upper + lower)
-
-
-######################################################################
-# Test
-######################################################################
-
-def test():
-    a = 200
-    p = _makeRandomData(30, a, 0)
-    c = convexHull(p)
-    saveAsEps(p, c, a, file)
-
-
-######################################################################
-
-if __name__ == '__main__':
-    try:
-        numPoints = string.atoi(sys.argv[1])
-        squareLength = string.atoi(sys.argv[2])
-        path = sys.argv[3]
-    except IndexError:
-        numPoints = 30
-        squareLength = 200
-        path = "sample.eps"
-
-    p = _makeRandomData(numPoints, squareLength, addCornerPoints=0)
-    c = convexHull(p)
-    saveAsEps(p, c, squareLength, path)
+    '''Return the convex hull of a sequence of (x, y) as a tuple of
+    (x, y) in clockwise order.'''
+    return tuple(tuple(x) for x in convex_hull(P).tolist())
@@ -0,0 +1,165 @@
+# Copyright 2014 Josh Pieper, jjp@pobox.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Evaluate ripple gaits in a pool of worker processes.
+
+The _legtool objects cannot be pickled, so a gait is described to the
+workers by a "spec", which is plain python data holding the
+RippleConfig settings and the parameters of each leg's IK solver.
+Each worker keeps the RippleGait built from the most recent spec it
+was given, so that a stream of requests against the same
+configuration only builds it once.'''
+
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+
+import trollius as asyncio
+
+SCRIPT_PATH=os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(SCRIPT_PATH, '../python/build-x86_64'))
+import _legtool
+
+import ik_config_tab
+import phase_table
+
+COMMAND_NAMES = ['translate_x_mm_s',
+                 'translate_y_mm_s',
+                 'rotate_deg_s',
+                 'body_x_mm',
+                 'body_y_mm',
+                 'body_z_mm',
+                 'body_pitch_deg',
+                 'body_roll_deg',
+                 'body_yaw_deg',]
+
+(ALLOWABLE_VALID,
+ ALLOWABLE_CLAMPED,
+ ALLOWABLE_INVALID) = range(3)
+
+
+def make_spec(ripple_config, leg_ik_params):
+    '''Describe a RippleConfig, and the IK parameters of each of its
+    legs as returned by IkConfigTab.get_leg_ik_params.'''
+    ripple = {}
+    ripple_config.write_settings(ripple)
+    return {'ripple': ripple, 'leg_ik': list(leg_ik_params)}
+
+
+def spec_key(spec):
+    '''Return a short string which is equal for equal specs.'''
+    return hashlib.sha1(json.dumps(spec, sort_keys=True)).hexdigest()
+
+
+def make_ripple_config(spec):
+    result = _legtool.RippleConfig.read_settings(spec['ripple'])
+    for leg_config, params in zip(result.mechanical.leg_config,
+                                  spec['leg_ik']):
+        leg_config.leg_ik = ik_config_tab.make_leg_ik(params)
+    return result
+
+
+def command_values(command):
+    '''Return a Command as a plain dictionary.'''
+    return dict((name, getattr(command, name)) for name in COMMAND_NAMES)
+
+
+def make_command(values):
+    result = _legtool.Command()
+    for name, value in values.iteritems():
+        setattr(result, name, value)
+    return result
+
+
+# The (key, RippleConfig, RippleGait) most recently used by this
+# worker process.
+_current_gait = (None, None, None)
+
+
+def get_gait(spec):
+    '''Return a (RippleConfig, RippleGait) for spec, reusing the one
+    from the previous call if the spec has not changed.'''
+    global _current_gait
+
+    key = spec_key(spec)
+    if _current_gait[0] != key:
+        config = make_ripple_config(spec)
+        _current_gait = (key, config, _legtool.RippleGait(config))
+    return _current_gait[1:]
+
+
+def evaluate_commands(spec, command, x_name, y_name, cells):
+    '''For each (x_value, y_value) in cells, set those two fields of
+    command and try it on the gait.  Return a list with one
+    ALLOWABLE_* value per cell.'''
+    _, gait = get_gait(spec)
+    my_command = make_command(command)
+
+    result = []
+    for x_value, y_value in cells:
+        setattr(my_command, x_name, x_value)
+        setattr(my_command, y_name, y_value)
+
+        if gait.set_command(my_command) != _legtool.RippleGaitResult.kValid:
+            result.append(ALLOWABLE_INVALID)
+            continue
+
+        actual_command = gait.command()
+        if (getattr(actual_command, x_name) != x_value or
+                getattr(actual_command, y_name) != y_value):
+            result.append(ALLOWABLE_CLAMPED)
+        else:
+            result.append(ALLOWABLE_VALID)
+    return result
+
+
+def evaluate_margins(spec, command, x_name, y_name, cells, phase_step):
+    '''Like evaluate_commands, but return the
+    phase_table.cycle_margin of each cell.'''
+    config, _ = get_gait(spec)
+    my_command = make_command(command)
+
+    result = []
+    for x_value, y_value in cells:
+        setattr(my_command, x_name, x_value)
+        setattr(my_command, y_name, y_value)
+        result.append(phase_table.cycle_margin(config, my_command, phase_step))
+    return result
+
+
+class GaitPool(object):
+    '''A pool of worker processes, started the first time it is
+    used.'''
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or multiprocessing.cpu_count()
+        self.executor = None
+
+    def run(self, function, *args):
+        '''Run function(*args) in a worker, returning a future for
+        the event loop.  The function and its arguments must be
+        picklable.'''
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.max_workers)
+        return asyncio.wrap_future(self.executor.submit(function, *args))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
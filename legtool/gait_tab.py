@@ -15,7 +15,6 @@
 
 import functools
 import numpy
-import time
 import os
 import sys
 
@@ -29,7 +28,8 @@ SCRIPT_PATH=os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(SCRIPT_PATH, '../python/build-x86_64'))
 import _legtool
 
-import convexhull
+import gait_pool
+import phase_table
 import settings
 
 from common import BoolContext
@@ -65,6 +65,8 @@ class GaitGeometryDisplay(object):
 
         self.config = None
         self.state = None
+        self.table = None
+        self.table_index = None
 
         self.frame = self.FRAME_ROBOT
         self.projection = self.PROJECTION_XY
@@ -96,7 +98,9 @@ class GaitGeometryDisplay(object):
         self.axes_item.x_scale = scale
         self.axes_item.y_scale = scale
 
-        if self.config is not None and self.state is not None:
+        if self.config is not None and self.table is not None:
+            self.set_table_state(self.table, self.table_index)
+        elif self.config is not None and self.state is not None:
             self.set_state(self.state)
 
         self.axes_item.update()
@@ -104,6 +108,7 @@ class GaitGeometryDisplay(object):
     def set_gait_config(self, config):
         assert config is not None
         self.config = config
+        self.table = None
 
         for item in self.items:
             self.graphics_scene.removeItem(item)
@@ -139,6 +144,7 @@ class GaitGeometryDisplay(object):
 
         self.shoulders = {}
         self.legs = {}
+        self.leg_colors = {}
         shoulder_poly = QtGui.QPolygonF([
                 QtCore.QPointF(-10, 0),
                 QtCore.QPointF(0, 10),
@@ -161,76 +167,68 @@ class GaitGeometryDisplay(object):
             self.legs[leg_num] = this_leg
             self.items.append(this_leg)
 
-    def _project(self, point, frame):
-        target_frame = None
-        if self.frame == self.FRAME_ROBOT:
-            target_frame = self.state.robot_frame
-        elif self.frame == self.FRAME_WORLD:
-            target_frame = self.state.world_frame
-        elif self.frame == self.FRAME_BODY:
-            target_frame = self.state.body_frame
-
-        target_point = target_frame.map_from_frame(frame, point)
-
-        if self.projection == self.PROJECTION_XY:
-            return (target_point.x, target_point.y)
-        elif self.projection == self.PROJECTION_YZ:
-            return (target_point.y, target_point.z)
-        elif self.projection == self.PROJECTION_XZ:
-            return (target_point.x, target_point.z)
-
     def set_state(self, state):
+        '''Render a RippleState which is not part of a PhaseTable.'''
         assert self.config is not None
         self.state = state
+        self.table = None
+
+        positions_mm, ik_valid = phase_table.state_geometry(
+            self.config, state, [self.frame])
+        modes = numpy.array([int(leg.mode) for leg in state.legs])
+        support, _ = phase_table.support_polygon(
+            positions_mm[0], ik_valid, modes, self.projection)
+        self._render(positions_mm[0], ik_valid, modes, support)
+
+    def set_table_state(self, table, index):
+        '''Render the given state of a PhaseTable, using the geometry
+        it computes for all of its states.'''
+        assert self.config is not None
+        self.state = None
+        self.table = table
+        self.table_index = index
+
+        positions_mm, ik_valid = table.geometry(self.frame)
+        support, _ = table.support_polygons(
+            self.frame, self.projection)[index]
+        self._render(positions_mm[index], ik_valid[index],
+                     table.modes[index], support)
 
-        stance_points = []
+    def _render(self, positions_mm, ik_valid, modes, support):
+        leg_count = len(ik_valid)
+        axes = list(phase_table.PROJECTION_AXES[self.projection])
+        points = positions_mm[:, axes].tolist()
 
-        self.body.setPos(*self._project(_legtool.Point3D(), state.body_frame))
-        self.cog.setPos(*self._project(_legtool.Point3D(), state.cog_frame))
+        self.body.setPos(*points[0])
+        self.cog.setPos(*points[1])
 
         for leg_num, shoulder in self.shoulders.iteritems():
-            if leg_num >= len(state.legs):
+            if leg_num >= leg_count:
                 continue
-            shoulder_frame = _legtool.Frame()
-            self.state.make_shoulder(self.config.mechanical.leg_config[leg_num],
-                                     shoulder_frame)
-            shoulder.setPos(*self._project(_legtool.Point3D(), shoulder_frame))
+            shoulder.setPos(*points[2 + leg_num])
 
         for leg_num, leg_item in self.legs.iteritems():
-            if leg_num >= len(state.legs):
+            if leg_num >= leg_count:
                 continue
-            leg = state.legs[leg_num]
-
-            point = self._project(leg.point, leg.frame)
-            leg_item.setPos(*point)
+            leg_item.setPos(*points[2 + leg_count + leg_num])
 
-            shoulder_frame = _legtool.Frame()
-            self.state.make_shoulder(self.config.mechanical.leg_config[leg_num],
-                                     shoulder_frame)
-            shoulder_point = shoulder_frame.map_from_frame(
-                leg.frame, leg.point)
-
-            ik_result = leg.leg_ik.do_ik(_legtool.Point3D(shoulder_point.x,
-                                                          shoulder_point.y,
-                                                          shoulder_point.z))
-
-            if not ik_result.valid():
+            if not ik_valid[leg_num]:
                 color = QtCore.Qt.red
-            elif leg.mode == _legtool.LegMode.kStance:
+            elif modes[leg_num] == _legtool.LegMode.kStance:
                 color = QtCore.Qt.green
-                stance_points.append(point)
-            elif leg.mode == _legtool.LegMode.kSwing:
+            elif modes[leg_num] == _legtool.LegMode.kSwing:
                 color = QtCore.Qt.yellow
             else:
-                assert False, 'unknown leg mode %d' % leg.mode
+                assert False, 'unknown leg mode %d' % modes[leg_num]
 
-            leg_item.setBrush(QtGui.QBrush(color))
+            if self.leg_colors.get(leg_num) != color:
+                leg_item.setBrush(QtGui.QBrush(color))
+                self.leg_colors[leg_num] = color
 
-        if len(stance_points) >= 3:
+        if support is not None:
             self.support_poly.setVisible(True)
-            hull = convexhull.convexHull(stance_points)
-
-            poly = QtGui.QPolygonF([QtCore.QPointF(x, y) for x, y in hull])
+            poly = QtGui.QPolygonF([QtCore.QPointF(x, y)
+                                    for x, y in support.tolist()])
             self.support_poly.setPolygon(poly)
         else:
             self.support_poly.setVisible(False)
@@ -300,15 +298,7 @@ class GaitGraphDisplay(object):
         self.fit_in_view()
 
 class CommandWidget(object):
-    ATTR_NAMES = ['translate_x_mm_s',
-                  'translate_y_mm_s',
-                  'rotate_deg_s',
-                  'body_x_mm',
-                  'body_y_mm',
-                  'body_z_mm',
-                  'body_pitch_deg',
-                  'body_roll_deg',
-                  'body_yaw_deg',]
+    ATTR_NAMES = gait_pool.COMMAND_NAMES
 
     ATTR_SUFFIXES = ['mm/s',
                      'mm/s',
@@ -320,9 +310,16 @@ class CommandWidget(object):
                      'deg',
                      'deg',]
 
-    def __init__(self, ui, command, command_change_callback):
+    ALLOWABLE_COLORS = {
+        gait_pool.ALLOWABLE_VALID: (0, 255, 0),
+        gait_pool.ALLOWABLE_CLAMPED: (255, 255, 0),
+        gait_pool.ALLOWABLE_INVALID: (255, 0, 0),
+        }
+
+    def __init__(self, ui, command, command_change_callback, pool):
         self.ui = ui
         self.parent_command = command
+        self.pool = pool
         self.command_change_callback = command_change_callback
         self.scales = [ 400.0, 400.0, 50.0,
                         100.0, 100.0, 100.0,
@@ -330,8 +327,10 @@ class CommandWidget(object):
 
         self.update_lock = asyncio.Lock()
 
-        self.config = None
+        self.spec = None
         self.command = None
+        self.phase_step = None
+        self.margin_scale_mm = None
 
         self.graphics_scene = graphics_scene.GraphicsScene()
         self.graphics_scene.sceneMouseMoveEvent.connect(
@@ -355,25 +354,44 @@ class CommandWidget(object):
         self.axes_item = graphics_scene.AxesItem()
         self.graphics_scene.addItem(self.axes_item)
 
+        # The margin map shows the minimum static stability margin
+        # over a cycle for each command of the allowable map.
+        self.margin_scene = graphics_scene.GraphicsScene()
+        self.margin_scene.sceneMouseMoveEvent.connect(
+            self.handle_mouse_move)
+        self.margin_scene.sceneMousePressEvent.connect(
+            self.handle_mouse_press)
+        self.margin_view = self.ui.gaitMarginView
+        self.margin_view.setTransform(QtGui.QTransform().scale(1, -1))
+        self.margin_view.setScene(self.margin_scene)
+
+        self.margin_axes_item = graphics_scene.AxesItem()
+        self.margin_scene.addItem(self.margin_axes_item)
+
         self.grid_count = 10
-        self.usable_rects = {}
+        self.usable_rects = self._make_rects(self.graphics_scene)
+        self.margin_rects = self._make_rects(self.margin_scene)
+
+    def _make_rects(self, scene):
+        result = {}
         for x in range(-self.grid_count + 1, self.grid_count):
             for y in range(-self.grid_count + 1, self.grid_count):
-                self.usable_rects[(x, y)] = \
-                    self.graphics_scene.addRect(
+                result[(x, y)] = scene.addRect(
                     (x - 0.5) / self.grid_count,
                     (y - 0.5) / self.grid_count,
                     1.0 / self.grid_count, 1.0 / self.grid_count)
 
-        for rect in self.usable_rects.itervalues():
+        for rect in result.itervalues():
             rect.setPen(QtGui.QPen(QtCore.Qt.NoPen))
             rect.setZValue(-20)
+        return result
 
     def resize(self):
         self.fit_in_view()
 
     def fit_in_view(self):
         self.graphics_view.fitInView(QtCore.QRectF(-1, -1, 2, 2))
+        self.margin_view.fitInView(QtCore.QRectF(-1, -1, 2, 2))
 
     def read_settings(self, config):
         if 'gaitconfig' not in config:
@@ -406,15 +424,17 @@ class CommandWidget(object):
             self.ui.commandXScaleSpin.setValue(self.x_scale())
             self.ui.commandYScaleSpin.setValue(self.y_scale())
 
-            self.axes_item.x_scale = self.x_scale()
-            self.axes_item.y_scale = self.y_scale()
-            self.axes_item.x_suffix = self.ATTR_SUFFIXES[self.x_axis()]
-            self.axes_item.y_suffix = self.ATTR_SUFFIXES[self.y_axis()]
+            for axes_item in [self.axes_item, self.margin_axes_item]:
+                axes_item.x_scale = self.x_scale()
+                axes_item.y_scale = self.y_scale()
+                axes_item.x_suffix = self.ATTR_SUFFIXES[self.x_axis()]
+                axes_item.y_suffix = self.ATTR_SUFFIXES[self.y_axis()]
 
-            self.axes_item.update()
+                axes_item.update()
 
-            if self.config is not None:
-                self.update_allowable(self.config, self.command)
+            if self.spec is not None:
+                self.update_allowable(self.spec, self.command,
+                                      self.phase_step, self.margin_scale_mm)
 
     def handle_scale_change(self, value):
         if self.in_scale_changed.value:
@@ -428,12 +448,14 @@ class CommandWidget(object):
             self.scales[self.x_axis()] = self.ui.commandXScaleSpin.value()
             self.scales[self.y_axis()] = self.ui.commandYScaleSpin.value()
 
-            self.axes_item.x_scale = self.x_scale()
-            self.axes_item.y_scale = self.y_scale()
-            self.axes_item.update()
+            for axes_item in [self.axes_item, self.margin_axes_item]:
+                axes_item.x_scale = self.x_scale()
+                axes_item.y_scale = self.y_scale()
+                axes_item.update()
 
-            if self.config is not None:
-                self.update_allowable(self.config, self.command)
+            if self.spec is not None:
+                self.update_allowable(self.spec, self.command,
+                                      self.phase_step, self.margin_scale_mm)
 
     def x_axis(self):
         return self.ui.commandXCombo.currentIndex()
@@ -464,11 +486,18 @@ class CommandWidget(object):
     def handle_mouse_press(self, cursor):
         self.handle_mouse_move(cursor)
 
-    def update_allowable(self, config, command):
-        self.next_config = _legtool.RippleConfig(config)
+    def update_allowable(self, spec, command, phase_step, margin_scale_mm):
+        '''Recompute the maps of allowable commands and static margin
+        for the gait described by spec, a gait_pool spec.  Cycles are
+        sampled every phase_step, and margins of margin_scale_mm and
+        above are drawn fully green.'''
+        self.next_spec = spec
         self.next_command = _legtool.Command(command)
+        self.next_phase_step = phase_step
+        self.next_margin_scale_mm = margin_scale_mm
 
-        for (x, y), rect in self.usable_rects.iteritems():
+        for rect in (self.usable_rects.values() +
+                     self.margin_rects.values()):
             old_brush = rect.brush()
             old_color = old_brush.color()
             rect.setBrush(QtGui.QBrush(QtGui.QColor(
@@ -487,53 +516,85 @@ class CommandWidget(object):
         yield From(self.update_lock.acquire())
 
         try:
-            while self.next_config is not None:
+            while self.next_spec is not None:
                 yield From(self.do_update_allowable())
         finally:
             self.update_lock.release()
 
     @asyncio.coroutine
     def do_update_allowable(self):
-        self.config = self.next_config
+        self.spec = self.next_spec
         self.command = self.next_command
+        self.phase_step = self.next_phase_step
+        self.margin_scale_mm = self.next_margin_scale_mm
 
-        my_gait = _legtool.RippleGait(self.next_config)
-        my_command = _legtool.Command(self.next_command)
-
-        self.next_config = None
+        self.next_spec = None
         self.next_command = None
 
-        next_wait = time.time() + 0.5 * 0.001 * PLAYBACK_TIMEOUT_MS
-
-        for (x, y), rect in self.usable_rects.iteritems():
-            x_value = self.x_scale() * float(x) / self.grid_count
+        command = gait_pool.command_values(self.command)
+        x_name = self.ATTR_NAMES[self.x_axis()]
+        y_name = self.ATTR_NAMES[self.y_axis()]
+
+        # Each worker is handed one row of the grid at a time, and
+        # rows are painted as they finish.  The margin rows take a
+        # full gait cycle per cell, so they are queued after all the
+        # allowable rows.
+        rows = []
+        xs = range(-self.grid_count + 1, self.grid_count)
+        for y in range(-self.grid_count + 1, self.grid_count):
             y_value = self.y_scale() * float(y) / self.grid_count
-
-            setattr(my_command, self.ATTR_NAMES[self.x_axis()], x_value)
-            setattr(my_command, self.ATTR_NAMES[self.y_axis()], y_value)
-
-            color = (0, 255, 0)
-
-
-            result = my_gait.set_command(my_command)
-            if result == _legtool.RippleGaitResult.kValid:
-                actual_command = my_gait.command()
-                actual_x_value = getattr(
-                    actual_command, self.ATTR_NAMES[self.x_axis()])
-                actual_y_value = getattr(
-                    actual_command, self.ATTR_NAMES[self.y_axis()])
-                if actual_x_value != x_value or actual_y_value != y_value:
-                    color = (255, 255, 0)
-            else:
-                color = (255, 0, 0)
-
-            rect.setBrush(QtGui.QBrush(QtGui.QColor(*color)))
-
-            if time.time() > next_wait:
-                yield From(asyncio.sleep(0.5 * 0.001 * PLAYBACK_TIMEOUT_MS))
-                if self.next_config is not None:
+            values = [(self.x_scale() * float(x) / self.grid_count, y_value)
+                      for x in xs]
+            rows.append(([(x, y) for x in xs], values))
+
+        row_cells = {}
+        for cells, values in rows:
+            future = self.pool.run(gait_pool.evaluate_commands,
+                                   self.spec, command, x_name, y_name, values)
+            row_cells[future] = (cells, self._paint_allowable)
+        for cells, values in rows:
+            future = self.pool.run(gait_pool.evaluate_margins,
+                                   self.spec, command, x_name, y_name, values,
+                                   self.phase_step)
+            row_cells[future] = (cells, self._paint_margin)
+
+        pending = set(row_cells.keys())
+        try:
+            while pending:
+                done, pending = yield From(asyncio.wait(
+                        pending, return_when=asyncio.FIRST_COMPLETED))
+                for future in done:
+                    cells, paint = row_cells[future]
+                    for cell, result in zip(cells, future.result()):
+                        paint(cell, result)
+
+                if self.next_spec is not None:
                     return
-                next_wait = time.time() + 0.5 * 0.001 * PLAYBACK_TIMEOUT_MS
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _paint_allowable(self, cell, result):
+        self.usable_rects[cell].setBrush(QtGui.QBrush(
+                QtGui.QColor(*self.ALLOWABLE_COLORS[result])))
+
+    def _paint_margin(self, cell, result):
+        rect = self.margin_rects[cell]
+        if result is None:
+            # Not possible, or never in stance.
+            rect.setBrush(QtGui.QBrush())
+            rect.setToolTip('')
+            return
+
+        margin_mm, phase = result
+        if margin_mm < 0.0:
+            color = (255, 0, 0)
+        else:
+            # Shade from yellow at zero to green at the scale.
+            fraction = min(1.0, margin_mm / max(self.margin_scale_mm, 1.0))
+            color = (int(255 * (1.0 - fraction)), 255, 0)
+        rect.setBrush(QtGui.QBrush(QtGui.QColor(*color)))
+        rect.setToolTip('margin: %.1fmm at phase %.2f' % (margin_mm, phase))
 
 class GaitTab(object):
     (PLAYBACK_IDLE,
@@ -546,7 +607,6 @@ class GaitTab(object):
         self.ikconfig_tab = ikconfig_tab
         self.servo_tab = servo_tab
 
-        self.current_command = None
         self.next_state = None
 
         self.playback_mode = self.PLAYBACK_IDLE
@@ -560,10 +620,15 @@ class GaitTab(object):
 
         self.command = _legtool.Command()
 
+        self.gait_pool = gait_pool.GaitPool()
+
         self.command_widget = CommandWidget(
-            ui, self.command, self.handle_widget_set_command)
+            ui, self.command, self.handle_widget_set_command, self.gait_pool)
 
-        self.current_states = []
+        self.current_table = None
+        self.playback_table = None
+        self.playback_phase = 0.0
+        self.phase_tables = phase_table.PhaseTableCache()
         self.gait_graph_display = GaitGraphDisplay(self.ui)
         self.gait_geometry_display = GaitGeometryDisplay(self.ui)
 
@@ -957,6 +1022,7 @@ class GaitTab(object):
             self.ui.staticMarginSpin.value()
 
         self.ripple = _legtool.RippleGait(self.ripple_config)
+        self.playback_table = None
         self.gait_geometry_display.set_gait_config(self.ripple_config)
 
         self.handle_playback_config_change()
@@ -967,66 +1033,72 @@ class GaitTab(object):
                 self.ui.legOrderEdit.text()))
         self.handle_gait_config_change()
 
-    def get_start_state(self):
-        begin_index = self.ui.playbackBeginCombo.currentIndex()
-        this_ripple = _legtool.RippleGait(self.ripple_config)
+    def get_phase_table(self, begin_index=None):
+        '''Return the PhaseTable of the current gait and command,
+        starting at the selected playback begin state, or None if the
+        command is not possible.'''
+        if begin_index is None:
+            begin_index = self.ui.playbackBeginCombo.currentIndex()
+        count = self.ui.playbackPhaseSlider.maximum()
+        key = gait_pool.spec_key((self.gait_spec(),
+                                  gait_pool.command_values(self.command),
+                                  self.phase_step, count, begin_index))
+
+        def build():
+            if begin_index == 0: # Idle
+                begin_state = self.ripple.get_idle_state()
+            else:
+                # Start from wherever a cycle begun at idle is after
+                # one full phase.
+                idle_table = self.get_phase_table(0)
+                if idle_table is None:
+                    return None
+                begin_state = phase_table.cycle_start_state(idle_table)
 
-        if begin_index == 0: # Idle
-            begin_state = this_ripple.get_idle_state()
-        else:
-            begin_state = this_ripple.get_idle_state()
-            this_ripple.set_state(begin_state)
-            this_ripple.set_command(self.command)
-            for x in range(int(1.0 / self.phase_step)):
-                this_ripple.advance_phase(self.phase_step)
+            return phase_table.record_cycle(
+                self.ripple_config, begin_state, self.command,
+                self.phase_step, count)
 
-            begin_state = this_ripple.state()
-            # When setting a state, we are required to be exactly
-            # zero.  Verify that we are close enough to zero from a
-            # numerical perspective, then force it to be exactly zero.
-            assert abs(((begin_state.phase + 0.5) % 1.0) - 0.5) < 1e-4
-            begin_state.phase = 0.0
+        return self.phase_tables.get(key, build)
 
-        return begin_state
+    def get_start_state(self):
+        table = self.get_phase_table()
+        if table is None:
+            return self.ripple.get_idle_state()
+        return _legtool.RippleState(table.begin_state)
 
     def handle_playback_config_change(self):
-        # Re-run the playback recording the state through an entire
-        # phase.  Then make sure that the graphic state is current for
-        # the phase that is selected now.
-
-        begin_state = self.get_start_state()
-        self.ripple.set_state(begin_state)
-        result = self.ripple.set_command(self.command)
-        if result != _legtool.RippleGaitResult.kValid:
+        # Look up (or record) the playback through an entire phase.
+        # Then make sure that the graphic state is current for the
+        # phase that is selected now.
+
+        table = self.get_phase_table()
+        if table is None:
             # guess we can't change anything
             self.ui.gaitOptionsBrowser.setText('command not possible')
             return
 
-        self.current_states = (
-            [_legtool.RippleState(self.ripple.state())] +
-            [_legtool.RippleState(
-                    (self.ripple.advance_phase(self.phase_step),
-                     self.ripple)[1].state())
-             for x in range(self.ui.playbackPhaseSlider.maximum())])
+        self.ripple.set_state(_legtool.RippleState(table.begin_state))
+        self.ripple.set_command(self.command)
+
+        self.current_table = table
 
         self.handle_playback_phase_change()
 
-        options = self.ripple.options()
         text = 'cycle_time: %.2fs\nservo_speed: %.1fdps' % (
-            options.cycle_time_s,
-            options.servo_speed_dps)
+            table.cycle_time_s,
+            table.servo_speed_dps)
+        margins = table.static_margins()
+        if not numpy.isnan(margins).all():
+            text += '\nstatic_margin: %.1fmm min at %.2f' % (
+                numpy.nanmin(margins),
+                table.phase[numpy.nanargmin(margins)])
         self.ui.gaitOptionsBrowser.setText(text)
 
         graph = GaitGraph()
-        for leg_number in range(len(self.current_states[0].legs)):
+        for leg_number in range(table.modes.shape[1]):
             graph.leg[leg_number] = GaitGraphLeg()
-
-        for state in self.current_states:
-            for leg_number, leg_item in enumerate(state.legs):
-                graph_seq = graph.leg[leg_number].sequence
-                if (len(graph_seq) == 0 or
-                    graph_seq[-1][1] != leg_item.mode):
-                    graph_seq.append((state.phase, leg_item.mode))
+            graph.leg[leg_number].sequence = table.mode_changes(leg_number)
 
         self.gait_graph_display.set_gait_graph(graph)
 
@@ -1037,13 +1109,30 @@ class GaitTab(object):
 
     def update_phase(self, phase):
         # Update the current geometry rendering.
-        state = self.current_states[int(phase / self.phase_step)]
-        self.render_state(state)
+        if self.current_table is None:
+            return
+        self.render_table_state(self.current_table,
+                                int(phase / self.phase_step))
 
-    def render_state(self, state):
+    def render_table_state(self, table, index):
+        '''Render the entry index of a PhaseTable, and send its joint
+        command to the servos.'''
+        self.gait_graph_display.set_phase(table.phase[index] % 1.0)
+        self.gait_geometry_display.set_table_state(table, index)
+
+        if self.servo_tab.controller:
+            self.servo_tab.pose_stream.set_target(table.joint_command(index))
+
+    def render_state(self, state, table=None, table_index=None):
+        '''Render state and send it to the servos.  If table is given,
+        the geometry shown is that of its entry table_index instead,
+        which saves computing it from state.'''
         # Render the phase line in the gait graph.
         self.gait_graph_display.set_phase(state.phase % 1.0)
-        self.gait_geometry_display.set_state(state)
+        if table is None:
+            self.gait_geometry_display.set_state(state)
+        else:
+            self.gait_geometry_display.set_table_state(table, table_index)
 
         if self.servo_tab.controller:
             joint_command = self.ripple.make_joint_command(state)
@@ -1051,22 +1140,7 @@ class GaitTab(object):
             for joint in joint_command.joints:
                 command[joint.servo_number] = joint.angle_deg
 
-            self.next_command = command
-
-            if (self.current_command is not None and
-                not self.current_command.done()):
-                return
-
-            self.current_command = Task(self.set_next_pose())
-
-    @asyncio.coroutine
-    def set_next_pose(self):
-        count = 0
-        while self.next_command is not None:
-            count += 1
-            command, self.next_command = self.next_command, None
-
-            yield From(self.servo_tab.set_pose(command))
+            self.servo_tab.pose_stream.set_target(command)
 
     def handle_geometry_change(self):
         frame = [GaitGeometryDisplay.FRAME_ROBOT,
@@ -1094,7 +1168,18 @@ class GaitTab(object):
             self.update_allowable_commands()
 
     def update_allowable_commands(self):
-        self.command_widget.update_allowable(self.ripple_config, self.command)
+        self.command_widget.update_allowable(
+            self.gait_spec(), self.command, self.phase_step,
+            self.ripple_config.static_margin_mm)
+
+    def gait_spec(self):
+        '''Return a gait_pool spec for the current gait
+        configuration.'''
+        return gait_pool.make_spec(
+            self.ripple_config,
+            [self.ikconfig_tab.get_leg_ik_params(leg_number)
+             for leg_number in
+             range(len(self.ripple_config.mechanical.leg_config))])
 
     def handle_command_reset(self):
         with self.in_command_changed:
@@ -1128,6 +1213,10 @@ class GaitTab(object):
         # Otherwise, start the appropriate playback mode.
         self.ripple.set_state(self.get_start_state())
         self.ripple.set_command(self.command)
+        # While the command is unchanged, playback follows the
+        # recorded cycle, so its geometry can be rendered from there.
+        self.playback_table = self.get_phase_table()
+        self.playback_phase = 0.0
         self.playback_mode = state
         self.playback_timer.start(PLAYBACK_TIMEOUT_MS)
 
@@ -1149,7 +1238,15 @@ class GaitTab(object):
             self.ui.playbackSingleButton.setChecked(False)
             return
 
-        self.render_state(state)
+        if self.playback_table is None:
+            self.render_state(state)
+            return
+
+        # The servos are sent the live state, but the geometry shown
+        # is that of the nearest recorded step.
+        self.playback_phase += (state.phase - old_phase) % 1.0
+        self.render_state(state, self.playback_table,
+                          self.playback_table.index_at(self.playback_phase))
 
     def handle_widget_set_command(self):
         with self.in_command_changed:
@@ -1166,3 +1263,4 @@ class GaitTab(object):
             # Otherwise, just set the command on our gait and let
             # playback do its thing.
             self.ripple.set_command(self.command)
+            self.playback_table = None
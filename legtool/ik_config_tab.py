@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy
 import os
 import sys
 
@@ -28,6 +29,7 @@ from _legtool import Point3D
 from common import BoolContext
 import settings
 import graphics_scene
+import ik_grid
 
 class LegConfig(object):
     present = False
@@ -63,6 +65,43 @@ class LegConfig(object):
         return result
 
 
+def make_leg_ik(params):
+    '''Build an IK solver from the output of
+    IkConfigTab.get_leg_ik_params.'''
+    if params is None:
+        return None
+
+    def set_joint(joint, values):
+        joint.ident = values['ident']
+        joint.sign = values['sign']
+        joint.min_deg = values['min_deg']
+        joint.idle_deg = values['idle_deg']
+        joint.max_deg = values['max_deg']
+        if values['length_mm'] is not None:
+            joint.length_mm = values['length_mm']
+
+    if params['iktype'] == 'lizard':
+        result = _legtool.LizardIKConfig()
+        for joint, values in zip([result.coxa, result.femur, result.tibia],
+                                 params['joints']):
+            set_joint(joint, values)
+        return _legtool.LizardIK(result)
+
+    elif params['iktype'] == 'mammal':
+        result = _legtool.MammalIKConfig()
+        for joint, values in zip([result.shoulder, result.femur, result.tibia],
+                                 params['joints']):
+            set_joint(joint, values)
+
+        (result.femur_attachment_mm.x,
+         result.femur_attachment_mm.y,
+         result.femur_attachment_mm.z) = params['femur_attachment_mm']
+        result.invert = params['invert']
+        return _legtool.MammalIK(result)
+
+    raise RuntimeError('unknown ik type: ' + str(params['iktype']))
+
+
 class IkTester(object):
     (PLANE_XY,
      PLANE_XZ,
@@ -83,19 +122,10 @@ class IkTester(object):
         self.graphics_view.setTransform(QtGui.QTransform().scale(1, -1))
         self.graphics_view.setScene(self.graphics_scene)
 
-        self.usable_rects = {}
         self.grid_count = 20
-        for x in range(-self.grid_count, self.grid_count + 1):
-            for y in range(-self.grid_count, self.grid_count + 1):
-                self.usable_rects[(x, y)] = \
-                    self.graphics_scene.addRect(
-                    (x - 0.5) / self.grid_count,
-                    (y - 0.5) / self.grid_count,
-                    1.0 / self.grid_count, 1.0 / self.grid_count)
-
-        for rect in self.usable_rects.itervalues():
-            rect.setPen(QtGui.QPen(QtCore.Qt.NoPen))
-            rect.setZValue(-20)
+        self.usable_image = QtGui.QGraphicsPixmapItem()
+        self.usable_image.setZValue(-20)
+        self.graphics_scene.addItem(self.usable_image)
 
         self.axes = graphics_scene.AxesItem()
         self.graphics_scene.addItem(self.axes)
@@ -154,29 +184,23 @@ class IkTester(object):
 
         return point_mm
 
-    def find_worst_case_speed_mm_s(self, ik, point_mm, direction_mm):
-        step_mm = 0.01
-
-        nominal = ik.do_ik(point_mm)
-        if not nominal.valid():
-            return None
+    def coords_to_points(self, coords):
+        '''Like coord_to_point, but for an (N, 2) array of coordinates,
+        returning an (N, 3) array.'''
+        coords = numpy.asarray(coords, dtype=numpy.float64)
+        result = numpy.empty((len(coords), 3))
+        result[:] = [self.x_offset_mm, self.y_offset_mm, self.z_offset_mm]
 
-        result = None
-        normalized = direction_mm.scaled(1.0 / direction_mm.length())
-        point_step_mm = direction_mm.scaled(step_mm)
-
-        advanced = ik.do_ik(point_mm + point_step_mm)
-
-        for (a, b) in zip(nominal.joints, advanced.joints):
-            assert(a.ident == b.ident)
-
-            if a.angle_deg == b.angle_deg:
-                continue
+        if self.plane == self.PLANE_XY:
+            columns = (0, 1)
+        elif self.plane == self.PLANE_XZ:
+            columns = (0, 2)
+        elif self.plane == self.PLANE_YZ:
+            columns = (1, 2)
+        else:
+            raise RuntimeError('invalid plane:' + str(self.plane))
 
-            this_speed_mm_s = (ik.config().servo_speed_dps * step_mm /
-                               abs(a.angle_deg - b.angle_deg))
-            if result is None or this_speed_mm_s < result:
-                result = this_speed_mm_s
+        result[:, columns] += coords * self.length_scale
         return result
 
     def update_scene(self):
@@ -184,21 +208,25 @@ class IkTester(object):
 
         axis = self.speed_axis
 
-        for (x, y), rect in self.usable_rects.iteritems():
-            point_mm = self.coord_to_point((float(x) / self.grid_count,
-                                            float(y) / self.grid_count))
-            result = ik.do_ik(point_mm)
-            if not result.valid():
-                rect.setBrush(QtGui.QBrush(QtCore.Qt.red))
-            else:
-                speed = self.find_worst_case_speed_mm_s(
-                    ik, point_mm, axis)
-                if speed is None:
-                    rect.setBrush(QtGui.QBrush())
-                else:
-                    val = int(min(255, 255 * speed / self.speed_scale))
-                    color = QtGui.QColor(255 - val, 255, 255 - val)
-                    rect.setBrush(QtGui.QBrush(color))
+        size = 2 * self.grid_count + 1
+        # Row 0 of the image is the most negative y.
+        y, x = numpy.mgrid[-self.grid_count:self.grid_count + 1,
+                           -self.grid_count:self.grid_count + 1]
+        coords = numpy.column_stack(
+            [x.ravel(), y.ravel()]).astype(numpy.float64) / self.grid_count
+
+        nominal, speed = ik_grid.worst_case_speed_mm_s(
+            ik, self.coords_to_points(coords), (axis.x, axis.y, axis.z))
+        colors = ik_grid.speed_colors(nominal.valid, speed, self.speed_scale)
+
+        image = QtGui.QImage(colors.tobytes(), size, size,
+                             QtGui.QImage.Format_ARGB32).copy()
+        self.usable_image.setPixmap(QtGui.QPixmap.fromImage(image))
+
+        # Each pixel is centered on its grid point.
+        corner = -(self.grid_count + 0.5) / self.grid_count
+        self.usable_image.setPos(corner, corner)
+        self.usable_image.setScale(1.0 / self.grid_count)
 
     def handle_mouse_press(self, cursor):
         Task(self.servo_tab.set_power('drive'))
@@ -236,7 +264,7 @@ class IkTester(object):
                 forward.tibia.x, forward.tibia.y, forward.tibia.z)
         self.servo_tab.ui.resultsEdit.setText(message)
 
-        Task(self.servo_tab.set_pose(command))
+        self.servo_tab.pose_stream.set_target(command)
 
 
 class IkConfigTab(object):
@@ -325,6 +353,12 @@ class IkConfigTab(object):
 
     def get_leg_ik(self, leg_number):
         '''Return an IK solver for the given leg number.'''
+        return make_leg_ik(self.get_leg_ik_params(leg_number))
+
+    def get_leg_ik_params(self, leg_number):
+        '''Return the configuration of the IK solver for the given leg
+        number as plain python data, suitable for passing to
+        make_leg_ik in another process.'''
         idle_values = self.servo_tab.pose(
             self.ui.idleCombo.currentText())
         minimum_values = self.servo_tab.pose(
@@ -334,67 +368,42 @@ class IkConfigTab(object):
 
         leg = self.legs.get(leg_number, LegConfig())
 
-        def set_joints(joint1, ident1, joint2, ident2, joint3, ident3):
-            joint1.min_deg = minimum_values[ident1]
-            joint1.idle_deg = idle_values[ident1]
-            joint1.max_deg = maximum_values[ident1]
-            #result.coxa_mass_kg = self.ui.coxaMassSpin.value()
-            joint1.ident = ident1
-
-            joint2.min_deg = minimum_values[ident2]
-            joint2.idle_deg = idle_values[ident2]
-            joint2.max_deg = maximum_values[ident2]
-            #result.femur_mass_kg = self.ui.femurMassSpin.value()
-            joint2.ident = ident2
-
-            joint3.min_deg = minimum_values[ident3]
-            joint3.idle_deg = idle_values[ident3]
-            joint3.max_deg = maximum_values[ident3]
-            #result.tibia_mass_kg = self.ui.tibiaMassSpin.value()
-            joint3.ident = ident3
+        def joint(ident, sign, length_mm=None):
+            return {'ident': ident,
+                    'sign': sign,
+                    'min_deg': minimum_values[ident],
+                    'idle_deg': idle_values[ident],
+                    'max_deg': maximum_values[ident],
+                    'length_mm': length_mm}
 
         if self.ui.iktypeCombo.currentIndex() == 0:
-            # Lizard.
-            result = _legtool.LizardIKConfig()
-
-            set_joints(result.coxa, leg.coxa_ident,
-                       result.femur, leg.femur_ident,
-                       result.tibia, leg.tibia_ident)
-
-            result.coxa.length_mm = self.ui.coxaLengthSpin.value()
-            result.coxa.sign = leg.coxa_sign
-
-            result.femur.length_mm = self.ui.femurLengthSpin.value()
-            result.femur.sign = leg.femur_sign
-
-            result.tibia.length_mm = self.ui.tibiaLengthSpin.value()
-            result.tibia.sign = leg.tibia_sign
-
-            return _legtool.LizardIK(result)
-
+            return {
+                'iktype': 'lizard',
+                'joints': [
+                    joint(leg.coxa_ident, leg.coxa_sign,
+                          self.ui.coxaLengthSpin.value()),
+                    joint(leg.femur_ident, leg.femur_sign,
+                          self.ui.femurLengthSpin.value()),
+                    joint(leg.tibia_ident, leg.tibia_sign,
+                          self.ui.tibiaLengthSpin.value()),
+                    ],
+                }
         elif self.ui.iktypeCombo.currentIndex() == 1:
-            # Mammal.
-            result = _legtool.MammalIKConfig()
-
-            set_joints(result.shoulder, leg.coxa_ident,
-                       result.femur, leg.femur_ident,
-                       result.tibia, leg.tibia_ident)
-
-            result.femur_attachment_mm.y = self.ui.mammalFemurOutSpin.value()
-            result.femur_attachment_mm.x = self.ui.mammalFemurCwSpin.value()
-            result.femur_attachment_mm.z = self.ui.mammalFemurUpSpin.value()
-
-            result.shoulder.sign = leg.coxa_sign
-
-            result.femur.length_mm = self.ui.mammalFemurLengthSpin.value()
-            result.femur.sign = leg.femur_sign
-
-            result.tibia.length_mm = self.ui.mammalTibiaLengthSpin.value()
-            result.tibia.sign = leg.tibia_sign
-
-            result.invert = leg.invert
-
-            return _legtool.MammalIK(result)
+            return {
+                'iktype': 'mammal',
+                'joints': [
+                    joint(leg.coxa_ident, leg.coxa_sign),
+                    joint(leg.femur_ident, leg.femur_sign,
+                          self.ui.mammalFemurLengthSpin.value()),
+                    joint(leg.tibia_ident, leg.tibia_sign,
+                          self.ui.mammalTibiaLengthSpin.value()),
+                    ],
+                'femur_attachment_mm': (
+                    self.ui.mammalFemurCwSpin.value(),
+                    self.ui.mammalFemurOutSpin.value(),
+                    self.ui.mammalFemurUpSpin.value()),
+                'invert': leg.invert,
+                }
 
     def update_config_enable(self):
         enable = self.ui.legPresentCombo.currentIndex() == 0
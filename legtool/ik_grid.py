@@ -0,0 +1,117 @@
+# Copyright 2014 Josh Pieper, jjp@pobox.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Evaluate inverse kinematics over many points at once, returning
+the results as numpy arrays.'''
+
+import os
+import sys
+
+import numpy
+
+SCRIPT_PATH=os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(SCRIPT_PATH, '../python/build-x86_64'))
+import _legtool
+
+
+class IkResults(object):
+    '''The results of do_ik for N points.
+
+    valid - bool array of shape (N,)
+    idents - the servo identifier of each joint
+    angles_deg - float array of shape (N, len(idents)), NaN where
+                 the point is not valid
+    '''
+
+    def __init__(self, valid, idents, angles_deg):
+        self.valid = valid
+        self.idents = idents
+        self.angles_deg = angles_deg
+
+
+def do_ik(ik, points_mm):
+    '''Solve the IK for every row of an (N, 3) array of points.'''
+    points_mm = numpy.asarray(points_mm, dtype=numpy.float64)
+    count = len(points_mm)
+
+    valid = numpy.zeros(count, dtype=bool)
+    idents = None
+    rows = [None] * count
+    for i, (x, y, z) in enumerate(points_mm.tolist()):
+        result = ik.do_ik(_legtool.Point3D(x, y, z))
+        if not result.valid():
+            continue
+        valid[i] = True
+        joints = result.joints
+        if idents is None:
+            idents = [joint.ident for joint in joints]
+        rows[i] = [joint.angle_deg for joint in joints]
+
+    idents = idents or []
+    angles_deg = numpy.empty((count, len(idents)))
+    angles_deg.fill(numpy.nan)
+    for i in numpy.flatnonzero(valid):
+        angles_deg[i] = rows[i]
+    return IkResults(valid, idents, angles_deg)
+
+
+def worst_case_speed_mm_s(ik, points_mm, direction_mm, step_mm=0.01):
+    '''Return (nominal, speed_mm_s) for an (N, 3) array of points.
+
+    nominal is the IkResults at each point.  speed_mm_s is the fastest
+    the foot can move along direction_mm from each point, limited by
+    whichever servo has to turn the most, and is NaN where it cannot
+    be determined.'''
+    points_mm = numpy.asarray(points_mm, dtype=numpy.float64)
+    direction_mm = numpy.asarray(direction_mm, dtype=numpy.float64)
+
+    nominal = do_ik(ik, points_mm)
+    speed_mm_s = numpy.empty(len(points_mm))
+    speed_mm_s.fill(numpy.nan)
+    if not nominal.valid.any():
+        return nominal, speed_mm_s
+
+    # Only step from the points which are reachable at all.
+    indices = numpy.flatnonzero(nominal.valid)
+    advanced = do_ik(ik, points_mm[indices] + direction_mm * step_mm)
+
+    delta_deg = numpy.abs(nominal.angles_deg[indices] - advanced.angles_deg)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        speeds = numpy.where(
+            delta_deg > 0,
+            ik.config().servo_speed_dps * step_mm / delta_deg,
+            numpy.inf)
+    # Joints which do not move, or points whose step was not
+    # reachable, place no limit.
+    speeds[numpy.isnan(speeds)] = numpy.inf
+    worst = speeds.min(axis=1)
+    worst[numpy.isinf(worst)] = numpy.nan
+    speed_mm_s[indices] = worst
+    return nominal, speed_mm_s
+
+
+def speed_colors(valid, speed_mm_s, speed_scale):
+    '''Return the ARGB32 color of each point as shaded by IkTester.
+    Unreachable points are red, points with no defined speed are
+    transparent, and the rest shade from white to green as the speed
+    approaches speed_scale.'''
+    colors = numpy.zeros(valid.shape, dtype=numpy.uint32)
+    colors[~valid] = 0xffff0000
+
+    shaded = valid & ~numpy.isnan(speed_mm_s)
+    val = numpy.minimum(
+        255, 255 * speed_mm_s[shaded] / speed_scale).astype(numpy.uint32)
+    other = 255 - val
+    colors[shaded] = 0xff00ff00 | (other << 16) | other
+    return colors
@@ -64,6 +64,7 @@ class LegTool(QtGui.QMainWindow):
 
     def closeEvent(self, event):
         self.write_settings()
+        self.gait_tab.gait_pool.shutdown()
         event.accept()
 
     def read_settings(self):
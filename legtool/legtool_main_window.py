@@ -930,6 +930,8 @@ class Ui_LegToolMainWindow(object):
         self.commandYScaleSpin.setObjectName("commandYScaleSpin")
         self.gridLayout_8.addWidget(self.commandYScaleSpin, 1, 3, 1, 1)
         self.verticalLayout_8.addLayout(self.gridLayout_8)
+        self.horizontalLayout_7 = QtGui.QHBoxLayout()
+        self.horizontalLayout_7.setObjectName("horizontalLayout_7")
         self.gaitCommandView = QtGui.QGraphicsView(self.commandGroup)
         sizePolicy = QtGui.QSizePolicy(QtGui.QSizePolicy.Expanding, QtGui.QSizePolicy.Expanding)
         sizePolicy.setHorizontalStretch(0)
@@ -937,7 +939,16 @@ class Ui_LegToolMainWindow(object):
         sizePolicy.setHeightForWidth(self.gaitCommandView.sizePolicy().hasHeightForWidth())
         self.gaitCommandView.setSizePolicy(sizePolicy)
         self.gaitCommandView.setObjectName("gaitCommandView")
-        self.verticalLayout_8.addWidget(self.gaitCommandView)
+        self.horizontalLayout_7.addWidget(self.gaitCommandView)
+        self.gaitMarginView = QtGui.QGraphicsView(self.commandGroup)
+        sizePolicy = QtGui.QSizePolicy(QtGui.QSizePolicy.Expanding, QtGui.QSizePolicy.Expanding)
+        sizePolicy.setHorizontalStretch(0)
+        sizePolicy.setVerticalStretch(0)
+        sizePolicy.setHeightForWidth(self.gaitMarginView.sizePolicy().hasHeightForWidth())
+        self.gaitMarginView.setSizePolicy(sizePolicy)
+        self.gaitMarginView.setObjectName("gaitMarginView")
+        self.horizontalLayout_7.addWidget(self.gaitMarginView)
+        self.verticalLayout_8.addLayout(self.horizontalLayout_7)
         self.verticalLayout_9.addWidget(self.commandGroup)
         self.verticalLayout_9.setStretch(0, 1)
         self.verticalLayout_9.setStretch(1, 1)
@@ -0,0 +1,316 @@
+# Copyright 2014 Josh Pieper, jjp@pobox.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Recorded ripple gait cycles, and a cache of them.'''
+
+import collections
+import os
+import sys
+
+import numpy
+
+SCRIPT_PATH=os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(SCRIPT_PATH, '../python/build-x86_64'))
+import _legtool
+
+import convexhull
+
+# The RippleState frames that geometry is recorded in, indexed by
+# GaitGeometryDisplay.FRAME_*.
+FRAME_NAMES = ['robot_frame', 'world_frame', 'body_frame']
+FRAME_ROBOT = 0
+
+# The axes of each GaitGeometryDisplay.PROJECTION_*.
+PROJECTION_AXES = [(0, 1), (1, 2), (0, 2)]
+PROJECTION_XY = 0
+
+
+def state_geometry(config, state, frames=None):
+    '''Return (positions_mm, ik_valid) for one RippleState.
+
+    positions_mm - float array of shape (len(frames), items, 3),
+                   holding the body, the CoG, then each shoulder, then
+                   each leg, in each of the given FRAME_* (all of them
+                   if frames is None)
+    ik_valid - bool array with one entry per leg
+    '''
+    if frames is None:
+        frames = range(len(FRAME_NAMES))
+
+    origin = _legtool.Point3D()
+    sources = [(state.body_frame, origin), (state.cog_frame, origin)]
+
+    shoulder_frames = []
+    for leg_number in range(len(state.legs)):
+        shoulder_frame = _legtool.Frame()
+        state.make_shoulder(config.mechanical.leg_config[leg_number],
+                            shoulder_frame)
+        shoulder_frames.append(shoulder_frame)
+        sources.append((shoulder_frame, origin))
+
+    ik_valid = []
+    for leg, shoulder_frame in zip(state.legs, shoulder_frames):
+        sources.append((leg.frame, leg.point))
+
+        shoulder_point = shoulder_frame.map_from_frame(leg.frame, leg.point)
+        ik_result = leg.leg_ik.do_ik(_legtool.Point3D(shoulder_point.x,
+                                                      shoulder_point.y,
+                                                      shoulder_point.z))
+        ik_valid.append(ik_result.valid())
+
+    positions_mm = []
+    for frame in frames:
+        target_frame = getattr(state, FRAME_NAMES[frame])
+        points = [target_frame.map_from_frame(frame, point)
+                  for frame, point in sources]
+        positions_mm.append([(p.x, p.y, p.z) for p in points])
+
+    return numpy.array(positions_mm), numpy.array(ik_valid, dtype=bool)
+
+
+def support_polygon(positions_mm, ik_valid, modes, projection):
+    '''Return (polygon, margin) for one state.  positions_mm is one
+    frame of the output of state_geometry.
+
+    polygon - the projected support polygon as an (M, 2) array, or
+              None if fewer than 3 legs are in stance
+    margin - the stability margin of the projected CoG within the
+             stance legs, or None if no legs are in stance
+    '''
+    leg_count = len(ik_valid)
+    axes = list(PROJECTION_AXES[projection])
+    cog = positions_mm[1, axes]
+    legs = positions_mm[2 + leg_count:, axes]
+
+    stance = ik_valid & (modes == int(_legtool.LegMode.kStance))
+    hull, margin = convexhull.support_margin(legs[stance], cog)
+    if len(hull) < 3:
+        return None, margin
+    return hull, margin
+
+
+class PhaseTable(object):
+    '''The states of a gait sampled at a fixed phase step.
+
+    Only the first state, and the one a full cycle after it, are kept
+    as RippleState objects, rather than hundreds of states for each
+    cached table.  What is needed of the others is kept in arrays.
+    Those which only some tables use, the geometry and the joint
+    angles, are computed the first time they are asked for by running
+    the gait again from the first state.
+
+    begin_state - the first RippleState
+    cycle_state - the RippleState one full cycle after begin_state, or
+                  None if the table is shorter than a cycle
+    phase - float array of shape (N,)
+    modes - int array of shape (N, legs) of LegMode values
+    points_mm - float array of shape (N, legs, 3), with each leg's
+                position in its own frame
+    cycle_time_s, servo_speed_dps - the gait options for the command
+    '''
+
+    def __init__(self, gait, config, begin_state, command, phase_step, count):
+        '''gait is a RippleGait for config, which must accept command
+        from begin_state.'''
+        self.config = config
+        self.begin_state = _legtool.RippleState(begin_state)
+        self.command = _legtool.Command(command)
+        self.phase_step = phase_step
+        self.cycle_state = None
+        self._gait = gait
+        self._geometry = {}
+        self._joint_angles = None
+
+        cycle_index = int(1.0 / phase_step)
+        phase = []
+        modes = []
+        points_mm = []
+        for index, state in enumerate(self._states(count)):
+            if index == cycle_index:
+                self.cycle_state = _legtool.RippleState(state)
+            phase.append(state.phase)
+            modes.append([int(leg.mode) for leg in state.legs])
+            points_mm.append([(leg.point.x, leg.point.y, leg.point.z)
+                              for leg in state.legs])
+
+        self.phase = numpy.array(phase)
+        self.modes = numpy.array(modes, dtype=numpy.int8)
+        self.points_mm = numpy.array(points_mm)
+
+        options = gait.options()
+        self.cycle_time_s = options.cycle_time_s
+        self.servo_speed_dps = options.servo_speed_dps
+
+        self._support_polygons = {}
+
+    def __len__(self):
+        return len(self.phase)
+
+    def _states(self, count):
+        '''Run the gait from begin_state, yielding the first count + 1
+        states.  Each is only valid until the next is yielded.'''
+        gait = self._gait
+        gait.set_state(self.begin_state)
+        result = gait.set_command(self.command)
+        assert result == _legtool.RippleGaitResult.kValid
+        yield gait.state()
+        for x in range(count):
+            gait.advance_phase(self.phase_step)
+            yield gait.state()
+
+    def joint_angles(self):
+        '''Return (servo_numbers, angles_deg), where angles_deg is a
+        float array of shape (N, len(servo_numbers)) holding the joint
+        command of every state.'''
+        if self._joint_angles is None:
+            servo_numbers = None
+            angles_deg = []
+            for state in self._states(len(self) - 1):
+                joints = self._gait.make_joint_command(state).joints
+                if servo_numbers is None:
+                    servo_numbers = [joint.servo_number for joint in joints]
+                angles_deg.append([joint.angle_deg for joint in joints])
+            self._joint_angles = (servo_numbers, numpy.array(angles_deg))
+        return self._joint_angles
+
+    def joint_command(self, index):
+        '''Return the joint command of the state at index as a
+        dictionary of servo number to angle in degrees.'''
+        servo_numbers, angles_deg = self.joint_angles()
+        return dict(zip(servo_numbers, angles_deg[index].tolist()))
+
+    def geometry(self, frame):
+        '''Return (positions_mm, ik_valid) for every state as seen in
+        the given frame, as arrays of shape (N, items, 3) and (N, legs).
+        See state_geometry.  This is only computed the first time a
+        frame is asked for, as many tables are never rendered.'''
+        if frame not in self._geometry:
+            geometry = [state_geometry(self.config, state, [frame])
+                        for state in self._states(len(self) - 1)]
+            self._geometry[frame] = (
+                numpy.array([x[0][0] for x in geometry]),
+                numpy.array([x[1] for x in geometry]))
+        return self._geometry[frame]
+
+    def support_polygons(self, frame, projection):
+        '''Return a list of the support_polygon of every state as seen
+        in the given frame and projection.  These are computed for all
+        states the first time a view is asked for.'''
+        key = (frame, projection)
+        if key not in self._support_polygons:
+            positions_mm, ik_valid = self.geometry(frame)
+            self._support_polygons[key] = [
+                support_polygon(positions_mm[x], ik_valid[x], self.modes[x],
+                                projection)
+                for x in range(len(self))]
+        return self._support_polygons[key]
+
+    def static_margins(self):
+        '''Return a float array of the static stability margin of each
+        state, measured in the ground plane of the robot frame, with
+        NaN where no leg is in stance.'''
+        polygons = self.support_polygons(FRAME_ROBOT, PROJECTION_XY)
+        return numpy.array([numpy.nan if margin is None else margin
+                            for _, margin in polygons])
+
+    def index_at(self, elapsed_phase):
+        '''Return the index of the state nearest to elapsed_phase after
+        the first.  Beyond the end of the table, the last cycle is
+        repeated, as the gait is periodic once it has run for a
+        cycle.'''
+        index = int(round(elapsed_phase / self.phase_step))
+        last = len(self) - 1
+        if index <= last:
+            return index
+        period = min(last, int(round(1.0 / self.phase_step)))
+        return last - period + (index - last) % period
+
+    def mode_changes(self, leg_number):
+        '''Return a list of (phase, mode) for every step where the
+        given leg changes mode, starting with the first step.'''
+        modes = self.modes[:, leg_number]
+        indices = numpy.concatenate(
+            [[0], numpy.flatnonzero(modes[1:] != modes[:-1]) + 1])
+        return [(self.phase[x], int(modes[x])) for x in indices]
+
+
+def record_cycle(config, begin_state, command, phase_step, count):
+    '''Run a RippleGait from begin_state with command, returning a
+    PhaseTable of count + 1 states, or None if the command is not
+    possible.'''
+    gait = _legtool.RippleGait(config)
+    gait.set_state(begin_state)
+    if gait.set_command(command) != _legtool.RippleGaitResult.kValid:
+        return None
+
+    return PhaseTable(gait, config, begin_state, command, phase_step, count)
+
+
+def cycle_start_state(idle_table):
+    '''Return a copy of the state one full cycle into a table which
+    began at the idle state, ready to begin a new table from.'''
+    result = _legtool.RippleState(idle_table.cycle_state)
+    # When setting a state, we are required to be exactly zero.
+    # Verify that we are close enough to zero from a numerical
+    # perspective, then force it to be exactly zero.
+    assert abs(((result.phase + 0.5) % 1.0) - 0.5) < 1e-4
+    result.phase = 0.0
+    return result
+
+
+def cycle_margin(config, command, phase_step):
+    '''Return (margin_mm, phase) for the state with the smallest
+    static stability margin during one cycle of command, beginning
+    after a cycle from idle.  Returns None if the command is not
+    possible or no leg is ever in stance.'''
+    steps = int(1.0 / phase_step)
+    idle_state = _legtool.RippleGait(config).get_idle_state()
+    idle_table = record_cycle(config, idle_state, command, phase_step, steps)
+    if idle_table is None:
+        return None
+
+    table = record_cycle(config, cycle_start_state(idle_table),
+                         command, phase_step, steps)
+    if table is None:
+        return None
+
+    margins = table.static_margins()
+    if numpy.isnan(margins).all():
+        return None
+    index = numpy.nanargmin(margins)
+    return float(margins[index]), float(table.phase[index])
+
+
+class PhaseTableCache(object):
+    '''Keeps the most recently used PhaseTables, evicting the least
+    recently used once more than max_size are held.'''
+
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.tables = collections.OrderedDict()
+
+    def get(self, key, build):
+        '''Return the table for key, calling build() to create it if
+        it is not present.  Results of None are cached too.'''
+        if key in self.tables:
+            result = self.tables.pop(key)
+        else:
+            result = build()
+            while len(self.tables) >= self.max_size:
+                self.tables.popitem(last=False)
+        self.tables[key] = result
+        return result
+
+    def clear(self):
+        self.tables.clear()
@@ -16,6 +16,7 @@ import functools
 import traceback
 import os
 import sys
+import time
 
 import trollius as asyncio
 from trollius import Task, From, Return
@@ -36,6 +37,108 @@ def spawn(callback):
         Task(callback())
     return start
 
+class PoseStream(object):
+    '''Streams poses to the servos of a ServoTab.
+
+    Callers give the latest desired angles with set_target, as often
+    as they like.  Targets are coalesced, and sent at most rate_hz
+    times a second, with only those joints which have moved more than
+    deadband_deg since they were last sent.  The achieved rate and the
+    latency from a target being set to it being written are shown in
+    the status bar.'''
+
+    def __init__(self, servo_tab, rate_hz=50.0, deadband_deg=0.2):
+        self.servo_tab = servo_tab
+        self.rate_hz = rate_hz
+        self.deadband_deg = deadband_deg
+
+        self.target = {}
+        self.sent = {}
+        self.pending_since = None
+        self.task = None
+
+        self.label = QtGui.QLabel()
+        self.servo_tab.status.addPermanentWidget(self.label)
+
+        self.report_start = time.time()
+        self.report_sends = 0
+        self.report_latency_s = 0.0
+
+    def set_target(self, joints):
+        '''Request that the servos move to joints, a dictionary of
+        servo ident to angle in degrees.'''
+        if self.servo_tab.controller is None:
+            return
+
+        self.target.update(joints)
+        if self.pending_since is None:
+            self.pending_since = time.time()
+
+        if self.task is None or self.task.done():
+            self.task = Task(self._run())
+
+    def reset(self):
+        '''Forget what has been sent, so that the next pose is sent
+        in full.'''
+        self.sent = {}
+
+    def written(self, joints):
+        '''Note that joints were written to the servos other than
+        through this stream, so that later targets are compared
+        against them, and any pending target for them is dropped.'''
+        self.sent.update(joints)
+        self.target.update(joints)
+
+    def _changed(self):
+        return dict((ident, angle_deg)
+                    for ident, angle_deg in self.target.iteritems()
+                    if (ident not in self.sent or
+                        abs(angle_deg - self.sent[ident]) >
+                        self.deadband_deg))
+
+    @asyncio.coroutine
+    def _run(self):
+        while True:
+            changed = self._changed()
+            if not changed or self.servo_tab.controller is None:
+                self.pending_since = None
+                return
+
+            start = time.time()
+            requested = self.pending_since or start
+            self.pending_since = None
+
+            try:
+                yield From(self.servo_tab.set_pose(changed))
+            except Exception as e:
+                traceback.print_exc()
+                print "Error writing pose:", type(e), str(e)
+                return
+
+            now = time.time()
+            self.sent.update(changed)
+            self._report(now, now - requested)
+
+            delay = start + 1.0 / self.rate_hz - now
+            if delay > 0:
+                yield From(asyncio.sleep(delay))
+
+    def _report(self, now, latency_s):
+        self.report_sends += 1
+        self.report_latency_s += latency_s
+
+        elapsed = now - self.report_start
+        if elapsed < 1.0:
+            return
+
+        self.label.setText('pose: %.1fHz %.0fms' % (
+                self.report_sends / elapsed,
+                1000.0 * self.report_latency_s / self.report_sends))
+        self.report_start = now
+        self.report_sends = 0
+        self.report_latency_s = 0.0
+
+
 class ServoTab(object):
     def __init__(self, ui, status):
         self.ui = ui
@@ -85,6 +188,8 @@ class ServoTab(object):
         self.controller = None
         self.servo_update = BoolContext()
 
+        self.pose_stream = PoseStream(self)
+
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.handle_timer)
         self.timer.start(50)
@@ -118,6 +223,7 @@ class ServoTab(object):
                 future)
             yield From(future)
             self.controller = self.selector.controller()
+            self.pose_stream.reset()
             self.ui.statusText.setText('connected')
             self.update_connected(True)
         except Exception as e:
@@ -235,6 +341,9 @@ class ServoTab(object):
         self.controller.enable_power([], value, future)
         yield From(future)
 
+        # The servos may have been moved while not driven.
+        self.pose_stream.reset()
+
     def update_connected(self, value):
         self.ui.controlGroup.setEnabled(value)
         self.ui.posesGroup.setEnabled(value)
@@ -301,6 +410,7 @@ class ServoTab(object):
             print "Got exception writing pose:", e
             raise
         yield From(future)
+        self.pose_stream.written(write_dict)
 
     @asyncio.coroutine
     def set_pose(self, joints):
@@ -409,6 +519,7 @@ class ServoTab(object):
         future = asyncio.Future()
         self.controller.set_pose(values, future)
         yield From(future)
+        self.pose_stream.written(values)
         with self.servo_update:
             for ident, angle_deg in values.iteritems():
                 control = self.servo_controls[ident]
@@ -442,6 +553,11 @@ class ServoTab(object):
 
         self.servo_model = servo['model']
 
+        if 'pose_rate_hz' in servo:
+            self.pose_stream.rate_hz = servo['pose_rate_hz']
+        if 'pose_deadband_deg' in servo:
+            self.pose_stream.deadband_deg = servo['pose_deadband_deg']
+
         if 'names' in servo:
             self.servo_name_map = {}
             for name, value in servo['names'].iteritems():
@@ -467,6 +583,8 @@ class ServoTab(object):
         servo['port'] = self.ui.serialPortCombo.currentText()
         servo['count'] =  self.ui.servoCountSpin.value()
         servo['model'] = self.servo_model
+        servo['pose_rate_hz'] = self.pose_stream.rate_hz
+        servo['pose_deadband_deg'] = self.pose_stream.deadband_deg
 
         for key, value in self.servo_name_map.iteritems():
             names[str(key)] = value
@@ -0,0 +1,212 @@
+# Copyright 2015 Josh Pieper, jjp@pobox.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Allan variance of live data, computed one sample at a time.
+
+Unlike allan_variance.py, which needs the whole record up front, this
+keeps a fixed amount of state per channel and period, and only
+measures periods which are a power of two multiple of the sample
+period.  Each octave averages pairs of window averages from the octave
+below, so a channel needs one small accumulator per octave no matter
+how long it runs.
+'''
+
+import numbers
+import os
+
+# Enough octaves to cover years of data sampled at 1kHz.
+MAX_OCTAVES = 48
+
+# Samples further apart than this many sample periods are treated as a
+# dropout, and all partial windows are discarded.
+GAP_PERIODS = 5.0
+
+
+class _Octave(object):
+    __slots__ = ['last', 'pending', 'sum_squares', 'count']
+
+    def __init__(self):
+        self.last = None
+        self.pending = None
+        self.sum_squares = 0.0
+        self.count = 0
+
+
+class OctaveChannel(object):
+    '''Non-overlapping Allan variance of a single channel at periods of
+    2**k samples.'''
+
+    def __init__(self):
+        self.octaves = [_Octave()]
+
+    def add(self, value):
+        octave_index = 0
+        while True:
+            octave = self.octaves[octave_index]
+            if octave.last is not None:
+                delta = value - octave.last
+                octave.sum_squares += delta * delta
+                octave.count += 1
+            octave.last = value
+
+            # Pair up adjacent windows to form one window of the next
+            # octave.
+            if octave.pending is None:
+                octave.pending = value
+                return
+            value = 0.5 * (octave.pending + value)
+            octave.pending = None
+
+            octave_index += 1
+            if octave_index >= MAX_OCTAVES:
+                return
+            if octave_index == len(self.octaves):
+                self.octaves.append(_Octave())
+
+    def reset(self):
+        '''Forget any partial windows, keeping the accumulated
+        statistics.'''
+        for octave in self.octaves:
+            octave.last = None
+            octave.pending = None
+
+    def deviations(self):
+        '''Return a list of the Allan deviation of each octave which
+        has at least two differences.'''
+        result = []
+        for octave in self.octaves:
+            if octave.count < 2:
+                break
+            result.append((octave.sum_squares / (2.0 * octave.count)) ** 0.5)
+        return result
+
+
+def float_fields(value, prefix='', json=False):
+    '''Yield (path, value) for every floating point leaf of a decoded
+    record or JSON object, using the same dotted paths as tplot.  JSON
+    does not distinguish integers from floats, so within a JSON object
+    integers are reported as well.'''
+    if hasattr(value, '_fields'):
+        for name in value._fields:
+            for x in float_fields(getattr(value, name), prefix + name + '.',
+                                  json):
+                yield x
+    elif isinstance(value, dict):
+        for name in sorted(value.keys()):
+            for x in float_fields(value[name], prefix + name + '.', True):
+                yield x
+    elif isinstance(value, (list, tuple)):
+        for i, item in enumerate(value):
+            for x in float_fields(item, prefix + '%d.' % i, json):
+                yield x
+    elif isinstance(value, float):
+        yield prefix[:-1], value
+    elif (json and isinstance(value, numbers.Integral) and
+          not isinstance(value, bool)):
+        yield prefix[:-1], float(value)
+
+
+class StreamingAllanVariance(object):
+    '''Allan variance of every floating point field of one record.
+    Samples are assumed to arrive at a roughly constant rate, which is
+    estimated from their timestamps.'''
+
+    def __init__(self):
+        self.channels = {}
+        self.last_time_s = None
+        self.active_time_s = 0.0
+        self.intervals = 0
+
+    def sample_period_s(self):
+        if self.intervals == 0:
+            return None
+        return self.active_time_s / self.intervals
+
+    def add(self, timestamp_s, sample):
+        '''Add one sample, either a decoded record or a JSON object.
+        Fields with "timestamp" in their name are ignored.'''
+        if self.last_time_s is not None:
+            delta_s = timestamp_s - self.last_time_s
+            period_s = self.sample_period_s()
+            if period_s is not None and delta_s > GAP_PERIODS * period_s:
+                # Leave the gap out of the sample period estimate.
+                for channel in self.channels.values():
+                    channel.reset()
+            else:
+                self.active_time_s += delta_s
+                self.intervals += 1
+        self.last_time_s = timestamp_s
+
+        for name, value in float_fields(sample):
+            if 'timestamp' in name:
+                continue
+            channel = self.channels.get(name, None)
+            if channel is None:
+                channel = self.channels[name] = OctaveChannel()
+            channel.add(value)
+
+    def write_csv(self, fd):
+        '''Write the current curves in the format read by
+        plot_allan_variance.py.'''
+        period_s = self.sample_period_s()
+        names = sorted(self.channels.keys())
+        deviations = dict((x, self.channels[x].deviations()) for x in names)
+        rows = min([len(x) for x in deviations.values()] or [0])
+        if period_s is None:
+            rows = 0
+
+        fd.write('Time' + ''.join(', ' + x for x in names) + '\n')
+        for row in range(rows):
+            fd.write(repr(period_s * 2 ** row) +
+                     ''.join(', ' + repr(deviations[x][row]) for x in names) +
+                     '\n')
+
+    def save(self, filename):
+        '''Write the current curves to filename, replacing it
+        atomically so that a reader never sees a partial file.'''
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'w') as fd:
+            self.write_csv(fd)
+        os.rename(temp_filename, filename)
+
+
+class Monitor(object):
+    '''Keeps a StreamingAllanVariance for each of several records, and
+    periodically saves the curves of each to "<prefix><name>.csv".'''
+
+    def __init__(self, prefix, interval_s):
+        self.prefix = prefix
+        self.interval_s = interval_s
+        self.records = {}
+        self.next_save_s = None
+
+    def add(self, name, timestamp_s, sample):
+        record = self.records.get(name, None)
+        if record is None:
+            record = self.records[name] = StreamingAllanVariance()
+        record.add(timestamp_s, sample)
+
+    def poll(self, now_s):
+        '''Save all records if the save interval has elapsed since the
+        last save.'''
+        if self.next_save_s is None:
+            self.next_save_s = now_s + self.interval_s
+        if now_s < self.next_save_s:
+            return
+        self.next_save_s = now_s + self.interval_s
+        self.save()
+
+    def save(self):
+        for name, record in self.records.items():
+            record.save(self.prefix + name + '.csv')
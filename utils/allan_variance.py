@@ -18,17 +18,28 @@
 
 Calculate Allan Variance statistics for a record in a given .tlog
 file.
+
+By default, the overlapping Allan deviation of every floating point
+field is computed for all periods at once from the cumulative sum of
+each field, assuming the record is sampled at a constant rate.  The
+"windowed" method instead feeds each sample through a separate window
+per period, and reports the standard deviation of the difference
+between adjacent, non-overlapping window averages.
 '''
 
+import itertools
 import optparse
 import os
 import sys
 
+import numpy
+
 SCRIPT_PATH=os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(SCRIPT_PATH, '../python'))
 sys.path.append(os.path.join(SCRIPT_PATH, '../bazel-bin/utils'))
 
-import telemetry_log
+import tlog_columns
+import tlog_file
 
 
 class VarianceOld(object):
@@ -110,6 +121,51 @@ class Channel(object):
             w.add(timestamp_s, value)
 
 
+def window_periods(scale, first_s=0.001, last_s=1e7):
+    period_s = first_s
+    result = []
+    while period_s < last_s:
+        result.append(period_s)
+        period_s *= scale
+
+    return result
+
+
+def overlapping_allan_deviation(values, tau0_s, periods_s):
+    '''Compute the overlapping Allan deviation of a series of samples
+    taken every tau0_s.
+
+    Each requested period is rounded to a whole number of samples,
+    and periods which round to the same count, or which are longer
+    than a third of the data, are dropped.  Returns (taus, adev,
+    error) arrays, where error is the approximate one sigma
+    uncertainty of each deviation, adev / sqrt(2 * (N / m - 1)) for N
+    samples and m samples per period.'''
+    values = numpy.asarray(values, dtype=float)
+    count = len(values)
+
+    sizes = numpy.unique(numpy.round(
+            numpy.asarray(periods_s) / tau0_s).astype(int))
+    sizes = sizes[(sizes >= 1) & (sizes <= (count - 1) // 3)]
+
+    # The phase is the cumulative sum of the samples, so that each
+    # window average becomes a difference of two phase values.
+    phase = numpy.zeros(count + 1)
+    numpy.cumsum(values, out=phase[1:])
+    phase *= tau0_s
+
+    taus = sizes * tau0_s
+    adev = numpy.zeros(len(sizes))
+    for i, size in enumerate(sizes):
+        second_difference = (phase[2 * size:] - 2 * phase[size:-size] +
+                             phase[:-2 * size])
+        adev[i] = numpy.sqrt(
+            numpy.mean(second_difference ** 2) / (2 * taus[i] ** 2))
+
+    error = adev / numpy.sqrt(2.0 * (float(count) / sizes - 1.0))
+    return taus, adev, error
+
+
 def enumerate_fields(sample, predicate, prefix=''):
     if predicate('', sample):
         return ['']
@@ -168,13 +224,7 @@ class Record(object):
             break
 
     def window_periods(self, scale):
-        period_s = 0.001
-        result = []
-        while period_s < 1e7:
-            result.append(period_s)
-            period_s *= scale
-
-        return result
+        return window_periods(scale)
 
     def valid_periods_indices(self):
         result = []
@@ -192,21 +242,76 @@ class Record(object):
             channel.add(timestamp_s, value)
 
 
-def main():
-    usage, description = __doc__.split('\n\n', 1)
-    parser = optparse.OptionParser(usage=usage, description=description)
+def load_columns(options):
+    name = options.record.encode('latin1')
+    if options.jobs > 1:
+        arrays = tlog_columns.merge_arrays(tlog_file.decode_parallel(
+                options.input, tlog_columns.make_arrays, [name],
+                processes=options.jobs))
+    else:
+        br = tlog_file.FileReader(open(options.input, 'rb'))
+        arrays = tlog_columns.make_arrays(
+            itertools.islice(br.items([name]), options.limit))
+
+    if name not in arrays:
+        raise RuntimeError('no records found')
+    result = arrays[name]
+    if options.limit:
+        result = result[:options.limit]
+    return result
 
-    parser.add_option('--input', '-i', help='tlog file')
-    parser.add_option('--record', '-r', help='record to measure')
-    parser.add_option('--limit', '-l', type='int', default=None,
-                      help='maximum records to read')
-    parser.add_option('--scale', '-s', type='float', default=1.1)
 
-    options, args = parser.parse_args()
-    assert len(args) == 0, 'unexpected arguments'
+def run_overlapping(options):
+    data = load_columns(options)
 
-    assert options.input is not None
-    br = telemetry_log.BulkReader(open(options.input, 'rb'))
+    timestamp_field = None
+    channels = []
+    for field in data.dtype.names:
+        if 'timestamp' in field:
+            if timestamp_field is None:
+                timestamp_field = field
+            continue
+        if data.dtype[field] == numpy.float64:
+            channels.append(field)
+
+    if len(channels) == 0:
+        raise RuntimeError('no float channels found')
+    if timestamp_field is None:
+        raise RuntimeError('no timestamp field found')
+
+    tau0_s = float(numpy.median(numpy.diff(data[timestamp_field])))
+    periods = window_periods(options.scale)
+
+    results = {}
+    for name in channels:
+        results[name] = overlapping_allan_deviation(
+            data[name], tau0_s, periods)
+
+    taus = results[channels[0]][0]
+
+    # Do the header.
+    print('Time', end='')
+    for name in sorted(channels):
+        print(',', name, end='')
+        if options.confidence:
+            print(',', name + '_lo', ',', name + '_hi', end='')
+    print()
+
+    for period_index in range(len(taus)):
+        print(taus[period_index], end='')
+
+        for name in sorted(channels):
+            _, adev, error = results[name]
+            print(',', adev[period_index], end='')
+            if options.confidence:
+                print(',', adev[period_index] - error[period_index],
+                      ',', adev[period_index] + error[period_index], end='')
+
+        print()
+
+
+def run_windowed(options):
+    br = tlog_file.FileReader(open(options.input, 'rb'))
     record = None
 
     i = 0
@@ -238,5 +343,32 @@ def main():
         print()
 
 
+def main():
+    usage, description = __doc__.split('\n\n', 1)
+    parser = optparse.OptionParser(usage=usage, description=description)
+
+    parser.add_option('--input', '-i', help='tlog file')
+    parser.add_option('--record', '-r', help='record to measure')
+    parser.add_option('--limit', '-l', type='int', default=None,
+                      help='maximum records to read')
+    parser.add_option('--scale', '-s', type='float', default=1.1)
+    parser.add_option('--method', '-m', type='choice',
+                      choices=['overlapping', 'windowed'],
+                      default='overlapping')
+    parser.add_option('--confidence', '-c', action='store_true',
+                      help='add one sigma lower and upper bound columns')
+    parser.add_option('--jobs', '-j', type='int', default=1,
+                      help='decode using this many processes')
+
+    options, args = parser.parse_args()
+    assert len(args) == 0, 'unexpected arguments'
+
+    assert options.input is not None
+    if options.method == 'overlapping':
+        run_overlapping(options)
+    else:
+        run_windowed(options)
+
+
 if __name__ == '__main__':
     main()
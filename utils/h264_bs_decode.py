@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 """H264 bytestream decoder
 
 (H264 comes in bytestream and other (raw NAL? AU? rbsp?) formats.
@@ -17,42 +17,91 @@ Other refs:
 http://stackoverflow.com/questions/5528712/h-264-bytestream-parsing
 https://cardinalpeak.com/blog/the-h-264-sequence-parameter-set/
 
+Usage: h264_bs_decode.py [options] FILE|--udp
+
+By default this groups slices into frames, prints one line per frame
+and a summary of frame sizes, GOP lengths and bitrate.  --nals prints
+one line per NAL instead.  With --udp, RTP packets as sent by
+video-ui/vserver are received live, and network statistics are
+printed periodically.
 """
+import optparse
+import socket
+import struct
 import sys
-import binascii
+import time
+
+START_CODE = b'\x00\x00\x01'
+
+# How much of the file to read at once.  NALs are returned as views
+# into a window of this size, so only a NAL which spans two reads is
+# ever copied.
+READ_SIZE = 1 << 20
+
+
+def read_nals(fh, read_size=READ_SIZE):
+    """Yield (start_code, payload) for each NAL in the bytestream read
+    from fh.
+
+    Both are memoryviews into an immutable window over the file, so
+    they stay valid after the generator moves on, but hold a reference
+    to the whole window while they are alive.
+    """
+    data = b''
+    # Offset in data of the start code of the NAL currently being
+    # read, and the length of that start code.
+    nal_start = None
+    hdrlen = 0
+    # Offset in data where the search for the next start code resumes.
+    search = 0
+    skipped = 0
 
-def read_nals(fh):
-    buff = ''
-    nonfirst = 0
     while True:
-        block = fh.read(65536)
-        buff += block
+        block = fh.read(read_size)
+
+        # Drop everything before the pending NAL from the window.
+        keep = nal_start
+        if keep is None:
+            # Nothing has been found yet, but a start code may straddle
+            # the read boundary.
+            keep = max(0, len(data) - 3)
+            skipped += keep
+        data = data[keep:] + block
+        search = max(0, search - keep)
+        if nal_start is not None:
+            nal_start = 0
+        view = memoryview(data)
+
         while True:
-            next_start = buff.find('\x00\x00\x01', nonfirst)
-            if next_start == -1:
+            found = data.find(START_CODE, search)
+            if found == -1:
                 break
-            if next_start > 0 and buff[next_start - 1] == '\x00':
-                next_start -= 1
-            if not nonfirst:
-                if next_start != 0:
-                    print >>sys.stderr, 'skipping junk in front (%d): %r' % (
-                        next_start, buff[:next_start][:64])
-                    buff = buff[next_start:]
-                nonfirst = 2
-                continue
-
-            if buff.startswith('\x00\x00\x01'):
-                hdrlen = 3
-            elif buff.startswith('\x00\x00\x00\x01'):
-                hdrlen = 4
-            else:
-                assert False
-            #print next_start, hdrlen, repr(buff[:64])
-            yield buff[:hdrlen], buff[hdrlen:next_start]
-            buff = buff[next_start:]
-        if block == '':
+            code_start = found
+            if found > 0 and data[found - 1] == 0:
+                code_start -= 1
+            if nal_start is None:
+                if code_start or skipped:
+                    print('skipping junk in front (%d): %r' % (
+                        skipped + code_start, data[:code_start][:64]),
+                          file=sys.stderr)
+            elif code_start > nal_start + hdrlen:
+                yield (view[nal_start:nal_start + hdrlen],
+                       view[nal_start + hdrlen:code_start])
+            nal_start = code_start
+            hdrlen = found + len(START_CODE) - code_start
+            search = found + len(START_CODE)
+
+        if not block:
             break
 
+        # The last two bytes may be the start of a start code which
+        # finishes in the next block.
+        search = max(search, len(data) - 2)
+
+    if nal_start is not None and len(data) > nal_start + hdrlen:
+        yield (view[nal_start:nal_start + hdrlen],
+               view[nal_start + hdrlen:])
+
 # from Table 7.1, pg 85
 UNIT_TYPES = [
     'Unspec',     # 0
@@ -77,10 +126,702 @@ UNIT_TYPES = [
     'Slice-ext',  # 20
     'Slice-3D',
     'R_22', 'R-23',
-] + [ 'unspec%d' for d in xrange(24, 32) ]
+] + ['unspec%d' % d for d in range(24, 32)]
 assert len(UNIT_TYPES) == 32
 
-def main():
+
+# Slice types, Table 7-6.  Types 5-9 are the same as 0-4, but promise
+# that every slice of the picture has the same type.
+SLICE_P, SLICE_B, SLICE_I, SLICE_SP, SLICE_SI = range(5)
+SLICE_NAMES = 'PBI'  # SP and SI are reported as P and I
+SLICE_UNIT_TYPES = (1, 2, 5)   # the ones which start with a slice_header()
+PARTITION_UNIT_TYPES = (3, 4)  # slice data partitions B and C
+UNIT_SPS = 7
+UNIT_PPS = 8
+
+# Profiles whose SPS carries chroma and bit depth information, 7.3.2.1.1
+HIGH_PROFILES = (100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135)
+
+# Slice headers are short, so only this much of a slice is unescaped.
+SLICE_HEADER_BYTES = 256
+
+# The port video-ui/vclient.py receives video on.
+VIDEO_PORT = 13357
+
+# RTP clock rate for H264, RFC 6184.
+RTP_CLOCK_HZ = 90000.0
+
+# NAL unit types used only for RTP packetization, RFC 6184 5.2.
+UNIT_STAP_A = 24
+UNIT_FU_A = 28
+
+
+def unescape_rbsp(data):
+    """Remove emulation prevention bytes, 7.4.1."""
+    return bytes(data).replace(b'\x00\x00\x03', b'\x00\x00')
+
+
+class BitReader(object):
+    """Reads the fixed length and Exp-Golomb fields of 7.2 from an
+    RBSP."""
+
+    def __init__(self, data):
+        self.bits = len(data) * 8
+        self.value = int.from_bytes(data, 'big')
+        self.position = 0
+
+    def u(self, count):
+        if count == 0:
+            return 0
+        self.position += count
+        if self.position > self.bits:
+            raise EOFError('read past end of RBSP')
+        return (self.value >> (self.bits - self.position)) & ((1 << count) - 1)
+
+    def flag(self):
+        return self.u(1) == 1
+
+    def ue(self):
+        zeros = 0
+        while self.u(1) == 0:
+            zeros += 1
+            if zeros > 32:
+                raise ValueError('invalid Exp-Golomb code')
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self):
+        code = self.ue()
+        if code & 1:
+            return (code + 1) // 2
+        return -(code // 2)
+
+
+def _skip_scaling_list(reader, size):
+    last_scale = 8
+    next_scale = 8
+    for _ in range(size):
+        if next_scale != 0:
+            next_scale = (last_scale + reader.se() + 256) % 256
+        if next_scale != 0:
+            last_scale = next_scale
+
+
+class SequenceParameterSet(object):
+    """The fields of seq_parameter_set_data(), 7.3.2.1.1, which are
+    needed to parse slice headers."""
+
+    def __init__(self, rbsp):
+        r = BitReader(rbsp)
+        self.profile_idc = r.u(8)
+        r.u(8)  # constraint flags
+        self.level_idc = r.u(8)
+        self.id = r.ue()
+
+        self.chroma_format_idc = 1
+        self.separate_colour_plane = False
+        if self.profile_idc in HIGH_PROFILES:
+            self.chroma_format_idc = r.ue()
+            if self.chroma_format_idc == 3:
+                self.separate_colour_plane = r.flag()
+            r.ue()  # bit_depth_luma_minus8
+            r.ue()  # bit_depth_chroma_minus8
+            r.flag()  # qpprime_y_zero_transform_bypass_flag
+            if r.flag():  # seq_scaling_matrix_present_flag
+                for i in range(8 if self.chroma_format_idc != 3 else 12):
+                    if r.flag():
+                        _skip_scaling_list(r, 16 if i < 6 else 64)
+
+        self.log2_max_frame_num = r.ue() + 4
+        self.pic_order_cnt_type = r.ue()
+        self.log2_max_pic_order_cnt_lsb = 0
+        self.delta_pic_order_always_zero = False
+        if self.pic_order_cnt_type == 0:
+            self.log2_max_pic_order_cnt_lsb = r.ue() + 4
+        elif self.pic_order_cnt_type == 1:
+            self.delta_pic_order_always_zero = r.flag()
+            r.se()  # offset_for_non_ref_pic
+            r.se()  # offset_for_top_to_bottom_field
+            for _ in range(r.ue()):
+                r.se()  # offset_for_ref_frame
+
+        self.max_num_ref_frames = r.ue()
+        r.flag()  # gaps_in_frame_num_value_allowed_flag
+        self.width_mbs = r.ue() + 1
+        self.height_map_units = r.ue() + 1
+        self.frame_mbs_only = r.flag()
+
+    def chroma_array_type(self):
+        if self.separate_colour_plane:
+            return 0
+        return self.chroma_format_idc
+
+
+class PictureParameterSet(object):
+    """The fields of pic_parameter_set_rbsp(), 7.3.2.2, which are needed
+    to parse slice headers."""
+
+    def __init__(self, rbsp):
+        r = BitReader(rbsp)
+        self.id = r.ue()
+        self.sps_id = r.ue()
+        self.entropy_coding_mode = r.flag()
+        self.bottom_field_pic_order_in_frame_present = r.flag()
+        if r.ue() != 0:
+            raise NotImplementedError('slice groups are not supported')
+        self.num_ref_idx_l0_default = r.ue() + 1
+        self.num_ref_idx_l1_default = r.ue() + 1
+        self.weighted_pred = r.flag()
+        self.weighted_bipred_idc = r.u(2)
+        self.pic_init_qp = r.se() + 26
+        r.se()  # pic_init_qs_minus26
+        r.se()  # chroma_qp_index_offset
+        r.flag()  # deblocking_filter_control_present_flag
+        r.flag()  # constrained_intra_pred_flag
+        self.redundant_pic_cnt_present = r.flag()
+
+
+def _skip_ref_pic_list_modification(r):
+    if not r.flag():
+        return
+    while True:
+        idc = r.ue()
+        if idc == 3:
+            return
+        r.ue()  # abs_diff_pic_num_minus1 or long_term_pic_num
+
+
+def _skip_weights(r, count, chroma):
+    for _ in range(count):
+        if r.flag():  # luma_weight_flag
+            r.se()
+            r.se()
+        if chroma and r.flag():  # chroma_weight_flag
+            for _ in range(4):
+                r.se()
+
+
+class SliceHeader(object):
+    """slice_header(), 7.3.3, parsed as far as slice_qp_delta."""
+
+    def __init__(self, rbsp, unit_type, ref_idc, sps_map, pps_map):
+        r = BitReader(rbsp)
+        self.first_mb = r.ue()
+        self.slice_type = r.ue() % 5
+        self.pps_id = r.ue()
+        pps = pps_map[self.pps_id]
+        sps = sps_map[pps.sps_id]
+        idr = unit_type == 5
+
+        if sps.separate_colour_plane:
+            r.u(2)  # colour_plane_id
+        self.frame_num = r.u(sps.log2_max_frame_num)
+        self.field_pic = False
+        if not sps.frame_mbs_only:
+            self.field_pic = r.flag()
+            if self.field_pic:
+                r.flag()  # bottom_field_flag
+        self.idr_pic_id = r.ue() if idr else None
+
+        bottom_present = (pps.bottom_field_pic_order_in_frame_present and
+                          not self.field_pic)
+        if sps.pic_order_cnt_type == 0:
+            r.u(sps.log2_max_pic_order_cnt_lsb)
+            if bottom_present:
+                r.se()
+        if (sps.pic_order_cnt_type == 1 and
+                not sps.delta_pic_order_always_zero):
+            r.se()
+            if bottom_present:
+                r.se()
+        if pps.redundant_pic_cnt_present:
+            r.ue()
+
+        b_slice = self.slice_type == SLICE_B
+        p_slice = self.slice_type in (SLICE_P, SLICE_SP)
+        if b_slice:
+            r.flag()  # direct_spatial_mv_pred_flag
+        num_l0 = pps.num_ref_idx_l0_default
+        num_l1 = pps.num_ref_idx_l1_default
+        if p_slice or b_slice:
+            if r.flag():  # num_ref_idx_active_override_flag
+                num_l0 = r.ue() + 1
+                if b_slice:
+                    num_l1 = r.ue() + 1
+
+        if self.slice_type not in (SLICE_I, SLICE_SI):
+            _skip_ref_pic_list_modification(r)
+        if b_slice:
+            _skip_ref_pic_list_modification(r)
+
+        if ((pps.weighted_pred and p_slice) or
+                (pps.weighted_bipred_idc == 1 and b_slice)):
+            chroma = sps.chroma_array_type() != 0
+            r.ue()  # luma_log2_weight_denom
+            if chroma:
+                r.ue()  # chroma_log2_weight_denom
+            _skip_weights(r, num_l0, chroma)
+            if b_slice:
+                _skip_weights(r, num_l1, chroma)
+
+        if ref_idc != 0:
+            # dec_ref_pic_marking(), 7.3.3.3
+            if idr:
+                r.flag()  # no_output_of_prior_pics_flag
+                r.flag()  # long_term_reference_flag
+            elif r.flag():  # adaptive_ref_pic_marking_mode_flag
+                while True:
+                    operation = r.ue()
+                    if operation == 0:
+                        break
+                    if operation in (1, 3):
+                        r.ue()
+                    if operation == 2:
+                        r.ue()
+                    if operation in (3, 6):
+                        r.ue()
+                    if operation == 4:
+                        r.ue()
+
+        if pps.entropy_coding_mode and self.slice_type not in (
+                SLICE_I, SLICE_SI):
+            r.ue()  # cabac_init_idc
+        self.qp_delta = r.se()
+        self.qp = pps.pic_init_qp + self.qp_delta
+
+
+class Frame(object):
+    """All the slices of one picture, and the non-VCL NALs which were
+    sent just before them."""
+
+    def __init__(self, index, frame_num, idr):
+        self.index = index
+        self.frame_num = frame_num
+        self.idr = idr
+        self.size = 0
+        self.slices = 0
+        self.slice_types = set()
+        self.qps = []
+
+    def type_str(self):
+        if self.slice_types <= set([SLICE_I, SLICE_SI]):
+            return 'I'
+        if SLICE_B in self.slice_types:
+            return 'B'
+        return 'P'
+
+    def __str__(self):
+        qp = ('%.1f' % (sum(self.qps) / len(self.qps))) if self.qps else '?'
+        return '%6d: frame_num %3d %s%s %2d slices, %6d bytes, QP %s' % (
+            self.index, self.frame_num, self.type_str(),
+            '(IDR)' if self.idr else '     ', self.slices, self.size, qp)
+
+
+class FrameParser(object):
+    """Groups NALs into frames.  Call add_nal() for each NAL; it
+    returns a Frame each time one is completed."""
+
+    def __init__(self):
+        self.sps_map = {}
+        self.pps_map = {}
+        self.frame = None
+        self.pending_size = 0
+        self.frames = 0
+        self.errors = 0
+
+    def add_nal(self, size, payload):
+        """size is the length of the NAL including its start code, and
+        payload excludes the start code."""
+        b1 = payload[0]
+        ref_idc = (b1 >> 5) & 3
+        unit_type = b1 & 31
+
+        try:
+            if unit_type == UNIT_SPS:
+                sps = SequenceParameterSet(unescape_rbsp(payload[1:]))
+                self.sps_map[sps.id] = sps
+            elif unit_type == UNIT_PPS:
+                pps = PictureParameterSet(unescape_rbsp(payload[1:]))
+                self.pps_map[pps.id] = pps
+            elif unit_type in SLICE_UNIT_TYPES:
+                header = SliceHeader(
+                    unescape_rbsp(payload[1:SLICE_HEADER_BYTES]),
+                    unit_type, ref_idc, self.sps_map, self.pps_map)
+                return self._add_slice(size, unit_type, header)
+        except (KeyError, EOFError, ValueError, NotImplementedError):
+            # A slice whose parameter sets have not been seen yet, or
+            # which is damaged.  Its size still counts.
+            self.errors += 1
+
+        if unit_type in SLICE_UNIT_TYPES + PARTITION_UNIT_TYPES:
+            if self.frame is not None:
+                self.frame.size += size
+            return None
+
+        # Non-VCL NALs are sent ahead of the frame they belong to.
+        completed = self.flush()
+        self.pending_size += size
+        return completed
+
+    def _add_slice(self, size, unit_type, header):
+        completed = None
+        if (self.frame is None or header.first_mb == 0 or
+                header.frame_num != self.frame.frame_num):
+            completed = self.flush()
+            self.frame = Frame(self.frames, header.frame_num, unit_type == 5)
+            self.frames += 1
+            self.frame.size = self.pending_size
+            self.pending_size = 0
+
+        self.frame.size += size
+        self.frame.slices += 1
+        self.frame.slice_types.add(header.slice_type)
+        self.frame.qps.append(header.qp)
+        return completed
+
+    def flush(self):
+        """Return the frame in progress, if any, as complete."""
+        result = self.frame
+        self.frame = None
+        return result
+
+
+class FrameStatistics(object):
+    """Summarizes frame sizes, GOP lengths and bitrate.  With no
+    timestamps in a bytestream, frames are assumed to arrive at a fixed
+    rate."""
+
+    def __init__(self, fps):
+        self.fps = fps
+        self.counts = {}
+        self.sizes = {}
+        self.gop_lengths = []
+        self.since_i = None
+        self.second_bytes = []
+
+    def add(self, frame, time_s=None):
+        """time_s, if given, is the arrival time of the frame, otherwise
+        it is computed from the frame rate."""
+        kind = frame.type_str()
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        self.sizes[kind] = self.sizes.get(kind, 0) + frame.size
+
+        if kind == 'I':
+            if self.since_i is not None:
+                self.gop_lengths.append(self.since_i)
+            self.since_i = 0
+        if self.since_i is not None:
+            self.since_i += 1
+
+        if time_s is None:
+            time_s = frame.index / self.fps
+        second = int(time_s)
+        while len(self.second_bytes) <= second:
+            self.second_bytes.append(0)
+        self.second_bytes[second] += frame.size
+
+    def mean_size(self, kind):
+        if not self.counts.get(kind, 0):
+            return None
+        return self.sizes[kind] / self.counts[kind]
+
+    def report(self, fd):
+        total = sum(self.counts.values())
+        print('frames: %d (%s)' % (total, ', '.join(
+            '%s %d' % (kind, self.counts[kind])
+            for kind in sorted(self.counts.keys()))), file=fd)
+        for kind in sorted(self.counts.keys()):
+            print('  %s frames: mean %.0f bytes' % (
+                kind, self.mean_size(kind)), file=fd)
+        i_size = self.mean_size('I')
+        p_size = self.mean_size('P')
+        if i_size and p_size:
+            print('I/P size ratio: %.2f' % (i_size / p_size), file=fd)
+        if self.gop_lengths:
+            print('GOP length: %d..%d frames (mean %.1f)' % (
+                min(self.gop_lengths), max(self.gop_lengths),
+                sum(self.gop_lengths) / len(self.gop_lengths)), file=fd)
+        else:
+            print('GOP length: unknown, fewer than two I frames', file=fd)
+
+        print('bitrate:', file=fd)
+        for second, size in enumerate(self.second_bytes):
+            print('  %5ds: %8.1f kbit/s' % (second, size * 8 / 1000.0),
+                  file=fd)
+
+
+class RtpPacket(object):
+    """The fixed RTP header, RFC 3550 5.1, and the payload it
+    carries."""
+
+    _HEADER = struct.Struct('>BBHII')
+
+    def __init__(self, data):
+        if len(data) < self._HEADER.size:
+            raise ValueError('short RTP packet')
+        b0, b1, self.sequence, self.timestamp, self.ssrc = (
+            self._HEADER.unpack_from(data))
+        if (b0 >> 6) != 2:
+            raise ValueError('not RTP version 2')
+        self.marker = (b1 & 0x80) != 0
+        self.payload_type = b1 & 0x7f
+
+        start = self._HEADER.size + 4 * (b0 & 0x0f)
+        if b0 & 0x10:
+            # Header extension, 5.3.1
+            if len(data) < start + 4:
+                raise ValueError('short RTP extension')
+            start += 4 + 4 * struct.unpack_from('>H', data, start + 2)[0]
+        end = len(data)
+        if b0 & 0x20:
+            end -= data[-1]
+        if start > end:
+            raise ValueError('RTP header longer than packet')
+        self.payload = memoryview(data)[start:end]
+
+
+class H264Depacketizer(object):
+    """Reassembles NALs from RTP payloads carrying single NAL units,
+    STAP-A aggregates or FU-A fragments, RFC 6184.  A fragmented NAL
+    which lost any of its packets is discarded."""
+
+    def __init__(self):
+        self.fragments = None
+        self.last_sequence = None
+        self.discarded = 0
+
+    def add(self, packet):
+        """Return a list of the NALs completed by this packet, in
+        order.  A fragmented NAL interrupted by a missing or reordered
+        packet is discarded."""
+        in_sequence = (self.last_sequence is not None and
+                       packet.sequence == (self.last_sequence + 1) & 0xffff)
+        self.last_sequence = packet.sequence
+
+        payload = packet.payload
+        if len(payload) == 0:
+            return []
+        unit_type = payload[0] & 31
+
+        if unit_type == UNIT_FU_A:
+            if len(payload) < 2:
+                return []
+            start = (payload[1] & 0x80) != 0
+            end = (payload[1] & 0x40) != 0
+            if start:
+                if self.fragments is not None:
+                    self.discarded += 1
+                header = (payload[0] & 0xe0) | (payload[1] & 0x1f)
+                self.fragments = [bytes([header])]
+            elif self.fragments is None:
+                return []
+            elif not in_sequence:
+                self.fragments = None
+                self.discarded += 1
+                return []
+            self.fragments.append(bytes(payload[2:]))
+            if not end:
+                return []
+            result = b''.join(self.fragments)
+            self.fragments = None
+            return [result]
+
+        if self.fragments is not None:
+            # The end of the fragmented NAL never arrived.
+            self.fragments = None
+            self.discarded += 1
+
+        if unit_type == UNIT_STAP_A:
+            result = []
+            offset = 1
+            while offset + 2 <= len(payload):
+                size = (payload[offset] << 8) | payload[offset + 1]
+                offset += 2
+                if size == 0 or offset + size > len(payload):
+                    break
+                result.append(bytes(payload[offset:offset + size]))
+                offset += size
+            return result
+
+        if 1 <= unit_type <= 23:
+            return [bytes(payload)]
+
+        # STAP-B, MTAP and FU-B are not used in non-interleaved mode.
+        return []
+
+
+class RtpStatistics(object):
+    """Packet loss, reordering and jitter of one RTP stream, following
+    RFC 3550 A.1, A.3 and A.8, and the time each frame took to arrive.
+
+    Frame completion latency is measured from the first to the last
+    packet of a frame, as there is no shared clock with the sender."""
+
+    def __init__(self):
+        self.base_sequence = None
+        self.max_sequence = None
+        self.received = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.seen = set()
+
+        self.timestamp = None
+        self.transit = None
+        self.jitter = 0.0
+
+        self.frame_timestamp = None
+        self.frame_first_s = None
+        self.frame_transit = None
+        self.frame_jitter = 0.0
+        self.frame_latencies = []
+
+    def extend(self, sequence):
+        """Return the sequence number extended to 32 bits, given the
+        highest one seen so far."""
+        if self.max_sequence is None:
+            return sequence
+        delta = (sequence - self.max_sequence) & 0xffff
+        if delta >= 0x8000:
+            delta -= 0x10000
+        return self.max_sequence + delta
+
+    def extend_timestamp(self, timestamp):
+        """Return the RTP timestamp unwrapped past 32 bits, given the
+        previous one.  Timestamps start at a random offset, so they may
+        wrap at any time."""
+        if self.timestamp is None:
+            self.timestamp = timestamp
+            return timestamp
+        delta = (timestamp - self.timestamp) & 0xffffffff
+        if delta >= 0x80000000:
+            delta -= 0x100000000
+        self.timestamp += delta
+        return self.timestamp
+
+    def add(self, packet, arrival_s):
+        """Return True if the packet should be processed, False if it is
+        a duplicate."""
+        sequence = self.extend(packet.sequence)
+        if sequence in self.seen:
+            self.duplicates += 1
+            return False
+        self.seen.add(sequence)
+        if len(self.seen) > 4096:
+            horizon = sequence - 2048
+            self.seen = set(x for x in self.seen if x > horizon)
+
+        if self.base_sequence is None:
+            self.base_sequence = self.max_sequence = sequence
+        elif sequence > self.max_sequence:
+            self.max_sequence = sequence
+        else:
+            self.reordered += 1
+        self.received += 1
+
+        arrival = arrival_s * RTP_CLOCK_HZ
+        transit = arrival - self.extend_timestamp(packet.timestamp)
+        if self.transit is not None:
+            self.jitter += (abs(transit - self.transit) - self.jitter) / 16.0
+        self.transit = transit
+
+        if packet.timestamp != self.frame_timestamp:
+            self.frame_timestamp = packet.timestamp
+            self.frame_first_s = arrival_s
+            if self.frame_transit is not None:
+                self.frame_jitter += (
+                    abs(transit - self.frame_transit) - self.frame_jitter) / 16.0
+            self.frame_transit = transit
+        if packet.marker and self.frame_first_s is not None:
+            self.frame_latencies.append(arrival_s - self.frame_first_s)
+            self.frame_first_s = None
+        return True
+
+    def expected(self):
+        if self.base_sequence is None:
+            return 0
+        return self.max_sequence - self.base_sequence + 1
+
+    def lost(self):
+        return self.expected() - self.received
+
+    def report(self):
+        """Return a one line summary, and reset the frame latencies."""
+        expected = self.expected()
+        latencies = self.frame_latencies
+        self.frame_latencies = []
+        latency = ('%.1f/%.1fms' % (
+            1000.0 * sum(latencies) / len(latencies),
+            1000.0 * max(latencies))) if latencies else '-'
+        return ('packets %d lost %d (%.2f%%) reordered %d dup %d '
+                'jitter %.2fms frame jitter %.2fms '
+                'completion mean/max %s') % (
+            self.received, self.lost(),
+            100.0 * self.lost() / expected if expected else 0.0,
+            self.reordered, self.duplicates,
+            1000.0 * self.jitter / RTP_CLOCK_HZ,
+            1000.0 * self.frame_jitter / RTP_CLOCK_HZ, latency)
+
+
+def analyze_udp(options):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('', options.port))
+    sock.settimeout(options.interval)
+
+    rtp = RtpStatistics()
+    depacketizer = H264Depacketizer()
+    parser = FrameParser()
+    stats = FrameStatistics(options.fps)
+    start_s = time.time()
+    next_report_s = start_s + options.interval
+    report_bytes = 0
+    report_frames = 0
+
+    def handle(frame, now):
+        if frame is None:
+            return 0
+        if not options.quiet:
+            print(frame)
+        stats.add(frame, now - start_s)
+        return 1
+
+    print('listening on UDP port %d' % options.port)
+    try:
+        while True:
+            try:
+                data = sock.recv(65536)
+            except socket.timeout:
+                data = None
+            now = time.time()
+
+            if data is not None:
+                try:
+                    packet = RtpPacket(data)
+                except ValueError:
+                    continue
+                if rtp.add(packet, now):
+                    report_bytes += len(data)
+                    for nal in depacketizer.add(packet):
+                        report_frames += handle(
+                            parser.add_nal(len(nal), nal), now)
+
+            if now >= next_report_s:
+                print('%7.1fs: %s, %d frames, %.1f kbit/s, '
+                      '%d NALs discarded' % (
+                          now - start_s, rtp.report(), report_frames,
+                          report_bytes * 8 / 1000.0 / options.interval,
+                          depacketizer.discarded))
+                report_bytes = 0
+                report_frames = 0
+                next_report_s = now + options.interval
+    except KeyboardInterrupt:
+        pass
+
+    handle(parser.flush(), time.time())
+    print(rtp.report())
+    stats.report(sys.stdout)
+
+
+def print_nals(fh):
     slice_group = None
     slice_lens = []
     slice_types = set()
@@ -88,31 +829,21 @@ def main():
         if not slice_lens:
             return
         total_len = sum(slice_lens)
-        print '%16s: %d NALs, len %d..%d bytes (total %d, avg %.1f)' % (
+        print('%16s: %d NALs, len %d..%d bytes (total %d, avg %.1f)' % (
             '+'.join(sorted(slice_types)), len(slice_lens),
             min(slice_lens), max(slice_lens), total_len,
-            total_len * 1.0 / len(slice_lens))
+            total_len * 1.0 / len(slice_lens)))
         slice_lens[:] = []
         slice_types.clear()
 
-    for nal_hdr, nal_bin in read_nals(open(sys.argv[1], 'rb')):
+    for nal_hdr, nal_bin in read_nals(fh):
         # decode NAL
-        b1 = ord(nal_bin[0])
+        b1 = nal_bin[0]
         assert (b1 & 0x80) == 0
         nal_len = len(nal_hdr) + len(nal_bin)
         ref_idc = (b1 >> 5) & 3
         unit_type = b1 & 31
         type_str = '%s[%d]' % (UNIT_TYPES[unit_type], ref_idc)
-        # to decode more, you need to start doing bit ops and Exp-Golomb
-        # numbers. I am too lazy for that.
-
-        # The good thing to decode is type 1, 'Slice':
-        #  it is slice_layer_without_partitioning_rbsp(), 7.3.2.8
-        #  it starts with slice_header(), 7.3.3/7.4.3
-        #  the header contains:
-        #     frame_num -- groups slices for one picture together
-        #     slice_type (P/B/I/SP/SI)
-        #
 
         # print NAL
         s_group = (1 if unit_type in [1, 2, 3, 4] else
@@ -125,8 +856,61 @@ def main():
             slice_group = s_group
             continue
         flush_slices()
-        print '%16s: len %d bytes' % (type_str, nal_len)
+        print('%16s: len %d bytes' % (type_str, nal_len))
     flush_slices()
 
+
+def print_frames(fh, options):
+    parser = FrameParser()
+    stats = FrameStatistics(options.fps)
+
+    def handle(frame):
+        if frame is None:
+            return
+        if not options.quiet:
+            print(frame)
+        stats.add(frame)
+
+    for nal_hdr, nal_bin in read_nals(fh):
+        handle(parser.add_nal(len(nal_hdr) + len(nal_bin), nal_bin))
+    handle(parser.flush())
+
+    if parser.errors:
+        print('%d NALs could not be parsed' % parser.errors)
+    stats.report(sys.stdout)
+
+
+def main():
+    usage, description = __doc__.split('Usage: ', 1)[1].split('\n\n', 1)
+    parser = optparse.OptionParser(usage=usage, description=description)
+    parser.add_option('--nals', action='store_true',
+                      help='print NALs rather than frames')
+    parser.add_option('--fps', type='float', default=30.0,
+                      help='frame rate used to compute bitrate')
+    parser.add_option('--quiet', '-q', action='store_true',
+                      help='only print the summary')
+    parser.add_option('--udp', action='store_true',
+                      help='receive RTP from the network instead of a file')
+    parser.add_option('--port', '-p', type='int', default=VIDEO_PORT,
+                      help='UDP port to receive RTP on')
+    parser.add_option('--interval', type='float', default=1.0,
+                      help='seconds between network reports')
+
+    options, args = parser.parse_args()
+    if options.udp:
+        if args:
+            parser.error('no input file may be given with --udp')
+        analyze_udp(options)
+        return
+    if len(args) != 1:
+        parser.error('exactly one input file is required')
+
+    with open(args[0], 'rb') as fh:
+        if options.nals:
+            print_nals(fh)
+        else:
+            print_frames(fh, options)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,183 @@
+# Copyright 2015 Josh Pieper, jjp@pobox.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Convert decoded telemetry records into NumPy structured arrays.
+
+Each scalar leaf of a record becomes one column, named by its dotted
+field path.  Array elements are named by their index, so the paths are
+the same ones accepted by tplot's _get_data, e.g. "servo.3.voltage".
+Only boolean, integer and floating point leaves are exported.
+
+Decoded JSON objects, such as the replies of the remote debug server,
+are accepted as well.  JSON does not distinguish integers from
+floating point values, so within them all numbers become float64.
+'''
+
+import numbers
+
+import numpy
+
+
+def _leaf_dtype(value, json=False):
+    if isinstance(value, bool):
+        return numpy.bool_
+    if isinstance(value, numbers.Integral) and not json:
+        return numpy.int64
+    if isinstance(value, numbers.Real):
+        return numpy.float64
+    return None
+
+
+def enumerate_columns(sample, prefix='', json=False):
+    '''Return a list of (path, dtype) for every numeric leaf of
+    sample.'''
+    if hasattr(sample, '_fields'):
+        result = []
+        for name in sample._fields:
+            result += enumerate_columns(getattr(sample, name),
+                                        prefix + name + '.', json)
+        return result
+    if isinstance(sample, dict):
+        result = []
+        for name in sorted(sample.keys()):
+            result += enumerate_columns(sample[name],
+                                        prefix + name + '.', True)
+        return result
+    if isinstance(sample, (list, tuple)):
+        result = []
+        for i, value in enumerate(sample):
+            result += enumerate_columns(value, prefix + '%d.' % i, json)
+        return result
+
+    dtype = _leaf_dtype(sample, json)
+    if dtype is None:
+        return []
+    return [(prefix[:-1], dtype)]
+
+
+def _make_getter(path):
+    steps = [int(x) if x.isdigit() else x for x in path.split('.')]
+
+    def get(value):
+        for step in steps:
+            if isinstance(step, int):
+                if not isinstance(value, (list, tuple)) or step >= len(value):
+                    return None
+                value = value[step]
+            elif isinstance(value, dict):
+                value = value.get(step, None)
+            else:
+                value = getattr(value, step, None)
+            if value is None:
+                return None
+        return value
+
+    return get
+
+
+class ColumnBuilder(object):
+    '''Accumulates decoded records of a single type and produces a
+    structured array with one column per numeric field path.  The set
+    of columns is fixed by the first record added.  If later records
+    lack a field, for instance because an array is shorter, floating
+    point columns get NaN and others get zero.'''
+
+    def __init__(self, sample):
+        self.columns = enumerate_columns(sample)
+        self.dtype = numpy.dtype(self.columns)
+        self._getters = [_make_getter(path) for path, _ in self.columns]
+        self._missing = [numpy.nan if dtype == numpy.float64 else 0
+                         for _, dtype in self.columns]
+        self._rows = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, value):
+        row = []
+        for getter, missing in zip(self._getters, self._missing):
+            item = getter(value)
+            row.append(missing if item is None else item)
+        self._rows.append(tuple(row))
+
+    def array(self):
+        return numpy.array(self._rows, dtype=self.dtype)
+
+    def clear(self):
+        '''Discard the records added so far, keeping the columns.'''
+        self._rows = []
+
+
+def make_arrays(items):
+    '''Given an iterable of (name, value), return a dictionary mapping
+    each record name to a structured array.'''
+    builders = {}
+    for name, value in items:
+        builder = builders.get(name, None)
+        if builder is None:
+            builder = builders[name] = ColumnBuilder(value)
+        builder.add(value)
+    return dict((name, builder.array()) for name, builder in builders.items())
+
+
+def _key(name):
+    if isinstance(name, bytes) and not isinstance(name, str):
+        return name.decode('latin1')
+    return name
+
+
+def save(filename, arrays):
+    '''Save a dictionary of structured arrays.  A .npz file holds one
+    array per record name, a .npy file may only hold a single
+    record.'''
+    if filename.endswith('.npy'):
+        if len(arrays) != 1:
+            raise RuntimeError('.npy output requires exactly one record, '
+                               'got %d' % len(arrays))
+        numpy.save(filename, list(arrays.values())[0])
+    else:
+        numpy.savez(filename,
+                    **dict((_key(name), array)
+                           for name, array in arrays.items()))
+
+
+def concatenate(arrays):
+    '''Join structured arrays for one record, for instance ones built
+    from different pieces of a log.  The result has the columns of
+    the first array, and columns missing from later ones are filled in
+    the same way as ColumnBuilder does.'''
+    dtype = arrays[0].dtype
+    result = numpy.empty(sum(len(x) for x in arrays), dtype=dtype)
+    offset = 0
+    for array in arrays:
+        this_slice = slice(offset, offset + len(array))
+        for name in dtype.names:
+            if name in array.dtype.names:
+                result[name][this_slice] = array[name]
+            elif dtype[name] == numpy.float64:
+                result[name][this_slice] = numpy.nan
+            else:
+                result[name][this_slice] = 0
+        offset += len(array)
+    return result
+
+
+def merge_arrays(pieces):
+    '''Given an iterable of dictionaries as returned by make_arrays,
+    in order, return a single dictionary of concatenated arrays.'''
+    result = {}
+    for piece in pieces:
+        for name, array in piece.items():
+            result.setdefault(name, []).append(array)
+    return dict((name, concatenate(arrays)) for name, arrays in result.items())
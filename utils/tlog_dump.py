@@ -14,6 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import itertools
 import optparse
 import os
@@ -23,7 +24,18 @@ import time
 SCRIPT_PATH=os.path.dirname(os.path.realpath(__file__))
 sys.path.append(os.path.join(SCRIPT_PATH, '../python'))
 
-import telemetry_log
+import tlog_file
+
+def format_item(item, readable_timestamps):
+    if readable_timestamps:
+        ts_str = time.strftime('%F %T', time.gmtime(item.timestamp)) + \
+                 ('%.6f' % (item.timestamp % 1.0))[1:]
+        item = item._replace(timestamp=ts_str)
+    return str(item)
+
+def format_items(readable_timestamps, items):
+    return [(name, format_item(item, readable_timestamps))
+            for name, item in items]
 
 def main():
     parser = optparse.OptionParser()
@@ -35,35 +47,69 @@ def main():
                       help='sort record by type')
     parser.add_option('-t', '--timestamps', action='store_true',
                       help='Make timestamps readable')
+    parser.add_option('--start', type='float', default=None,
+                      help='only records at or after this timestamp')
+    parser.add_option('--end', type='float', default=None,
+                      help='only records at or before this timestamp')
+    parser.add_option('--numpy', default=None, metavar='FILE',
+                      help='save columns as structured arrays to a ' +
+                      '.npz (one array per record) or .npy file')
+    parser.add_option('-j', '--jobs', type='int', default=1,
+                      help='decode using this many processes')
 
     options, args = parser.parse_args()
 
     if options.input is None:
         options.input = args[0]
 
+    names = options.name or None
+
+    if options.numpy:
+        import tlog_columns
+        if options.jobs > 1:
+            arrays = tlog_columns.merge_arrays(tlog_file.decode_parallel(
+                    options.input, tlog_columns.make_arrays,
+                    names, options.start, options.end, options.jobs))
+        else:
+            br = tlog_file.FileReader(open(options.input, 'rb'))
+            arrays = tlog_columns.make_arrays(
+                br.items(names, options.start, options.end))
+        tlog_columns.save(options.numpy, arrays)
+        return
+
     if options.output == '-':
         out = sys.stdout
     else:
         out = open(options.output, 'w')
 
-    br = telemetry_log.BulkReader(open(options.input))
-    pred = lambda x: True
-    if options.name:
-        pred = lambda x: x in options.name
+    if options.jobs > 1:
+        # Records are formatted in the workers, since the decoded
+        # records themselves can not be sent back between processes.
+        lines = itertools.chain(*tlog_file.decode_parallel(
+                options.input,
+                functools.partial(format_items, options.timestamps),
+                names, options.start, options.end, options.jobs))
+        if options.sort:
+            lines = sorted(lines, key=lambda x: x[0])
+        for _, line in lines:
+            print >>out, line
+        return
+
+    # If the log has an index, only the blocks for the selected names
+    # and time range are read.
+    br = tlog_file.FileReader(open(options.input, 'rb'))
 
     if options.sort:
         data = itertools.chain(
-            *(data for (_, data) in sorted(br.get(pred).iteritems()))
+            *(data for (_, data) in sorted(
+                    br.get(names, options.start, options.end).iteritems()))
         )
     else:
-        data = (data for (_, data) in br.items(pred))
+        data = (data for (_, data) in
+                br.items(names, options.start, options.end))
 
     for item in data:
-        if options.timestamps:
-            ts_str = time.strftime('%F %T', time.gmtime(item.timestamp)) + \
-                     ('%.6f' % (item.timestamp % 1.0))[1:]
-            item = item._replace(timestamp=ts_str)
-        print >>out, item
+        print >>out, format_item(item, options.timestamps)
 
 if __name__ == '__main__':
     main()
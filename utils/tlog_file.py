@@ -0,0 +1,855 @@
+#!/usr/bin/env python
+
+# Copyright 2015 Josh Pieper, jjp@pobox.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''%prog [options] FILE...
+
+Inspect the block structure of TLOG0002 files, and optionally
+(re)build the trailing seek index for logs which were written without
+one.
+
+A TLOG0002 file consists of the 8 byte header "TLOG0002" followed by
+blocks of the form:
+
+  uint16 block_type
+  uint32 size
+  uint8[size] payload
+
+Schema blocks (type 1) contain uint32 identifier, uint32 flags, a
+length prefixed record name, and the schema.  Data blocks (type 2)
+contain uint32 identifier, uint16 flags and the serialized record.
+If bit 0 of the flags is set, the record is preceded by a float64
+host receive time, in seconds since the epoch.
+
+Compressed blocks (type 4) hold several data blocks of one record.
+They contain uint32 identifier, uint8 codec and uint32 count, followed
+by the compressed concatenation of count entries, each a uint32 size
+and the payload of a data block.  Readers expand them into the data
+blocks they contain.
+
+An index block (type 3), if present, is the last block in the file.
+It maps each record identifier to the offset of the block holding
+each of its records, grouped into chunks of CHUNK_SIZE records with
+the first and last timestamp of each chunk.  Its payload ends with a fixed size
+trailer holding the offset of the index block itself, so readers can
+locate it by looking at the end of the file.
+'''
+
+import collections
+import contextlib
+import math
+import zlib
+import mmap
+import optparse
+import os
+import struct
+import sys
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+SCRIPT_PATH=os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(SCRIPT_PATH, '../python'))
+
+
+HEADER = b'TLOG0002'
+
+BLOCK_SCHEMA = 1
+BLOCK_DATA = 2
+BLOCK_INDEX = 3
+BLOCK_COMPRESSED = 4
+
+CODEC_ZLIB = 0
+CODEC_LZ4 = 1
+# The codecs which can be written, by name.  lz4 is only offered when
+# its module is installed.
+CODECS = {'zlib': CODEC_ZLIB}
+if lz4_frame is not None:
+    CODECS['lz4'] = CODEC_LZ4
+
+DATA_FLAG_HOST_TIMESTAMP = 0x0001
+
+INDEX_VERSION = 1
+INDEX_MAGIC = b'TLOGIDX1'
+
+# The number of data blocks from a single record which are summarized
+# by one index chunk.
+CHUNK_SIZE = 256
+
+_BLOCK_HEADER = struct.Struct('<HI')
+_SCHEMA_HEADER = struct.Struct('<II')
+_DATA_HEADER = struct.Struct('<IH')
+_COMPRESSED_HEADER = struct.Struct('<IBI')
+_HOST_TIMESTAMP = struct.Struct('<d')
+_INDEX_HEADER = struct.Struct('<II')
+_INDEX_RECORD = struct.Struct('<IQI')
+_INDEX_CHUNK = struct.Struct('<IIdd')
+_INDEX_TRAILER = struct.Struct('<Q8s')
+_UINT32 = struct.Struct('<I')
+
+
+Chunk = collections.namedtuple(
+    'Chunk', ['start', 'count', 'first_timestamp', 'last_timestamp'])
+
+
+def make_pstring(data):
+    return _UINT32.pack(len(data)) + data
+
+
+def parse_schema_block(payload):
+    '''Return (identifier, name, schema) for a schema block payload.'''
+    identifier, _ = _SCHEMA_HEADER.unpack_from(payload, 0)
+    offset = _SCHEMA_HEADER.size
+    name_size, = _UINT32.unpack_from(payload, offset)
+    offset += _UINT32.size
+    name = bytes(payload[offset:offset + name_size])
+    offset += name_size
+    return identifier, name, payload[offset:]
+
+
+def make_data_block(identifier, data, host_timestamp=None):
+    '''Return the payload of a data block, optionally recording the
+    time the host received it.'''
+    if host_timestamp is None:
+        return _DATA_HEADER.pack(identifier, 0) + data
+    return (_DATA_HEADER.pack(identifier, DATA_FLAG_HOST_TIMESTAMP) +
+            _HOST_TIMESTAMP.pack(host_timestamp) + data)
+
+
+def split_data_block(payload):
+    '''Return (identifier, host_timestamp, data) for a data block
+    payload, where host_timestamp is None if it was not recorded.'''
+    identifier, flags = _DATA_HEADER.unpack_from(payload, 0)
+    offset = _DATA_HEADER.size
+    host_timestamp = None
+    if flags & DATA_FLAG_HOST_TIMESTAMP:
+        host_timestamp, = _HOST_TIMESTAMP.unpack_from(payload, offset)
+        offset += _HOST_TIMESTAMP.size
+    return identifier, host_timestamp, payload[offset:]
+
+
+def parse_data_block(payload):
+    '''Return (identifier, flags, data) for a data block payload.  Any
+    host timestamp is removed from data.'''
+    identifier, flags = _DATA_HEADER.unpack_from(payload, 0)
+    return identifier, flags, split_data_block(payload)[2]
+
+
+def _lz4():
+    if lz4_frame is None:
+        raise RuntimeError('lz4 compressed blocks require the lz4 module')
+    return lz4_frame
+
+
+def compress(codec, data):
+    if codec == CODEC_ZLIB:
+        # The fastest level, so that the writer keeps up on small
+        # computers.
+        return zlib.compress(data, 1)
+    if codec == CODEC_LZ4:
+        return _lz4().compress(data)
+    raise RuntimeError('unknown compression codec %d' % codec)
+
+
+def decompress(codec, data):
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    if codec == CODEC_LZ4:
+        return _lz4().decompress(data)
+    raise RuntimeError('unknown compression codec %d' % codec)
+
+
+def make_compressed_block(identifier, codec, payloads):
+    '''Return the payload of a compressed block holding the given data
+    block payloads, all of which must be for identifier.'''
+    parts = []
+    for payload in payloads:
+        parts.append(_UINT32.pack(len(payload)))
+        parts.append(payload)
+    return (_COMPRESSED_HEADER.pack(identifier, codec, len(payloads)) +
+            compress(codec, b''.join(parts)))
+
+
+def compressed_identifier(payload):
+    '''Return the identifier of the record in a compressed block,
+    without decompressing it.'''
+    return _COMPRESSED_HEADER.unpack_from(payload, 0)[0]
+
+
+def expand_compressed_block(payload):
+    '''Return a list of the data block payloads in a compressed
+    block.'''
+    _, codec, count = _COMPRESSED_HEADER.unpack_from(payload, 0)
+    data = decompress(codec, bytes(payload[_COMPRESSED_HEADER.size:]))
+    view = _make_view(data)
+    result = []
+    offset = 0
+    for _ in range(count):
+        size, = _UINT32.unpack_from(data, offset)
+        offset += _UINT32.size
+        result.append(view[offset:offset + size])
+        offset += size
+    return result
+
+
+def data_payloads(block_type, payload):
+    '''Return a list of the data block payloads in a block, which is
+    empty if it is neither a data nor a compressed block.'''
+    if block_type == BLOCK_DATA:
+        return [payload]
+    if block_type == BLOCK_COMPRESSED:
+        return expand_compressed_block(payload)
+    return []
+
+
+def read_block(fd, offset):
+    '''Return (block_type, payload) for the block at the given offset,
+    or None if the block is truncated.'''
+    fd.seek(offset)
+    header = fd.read(_BLOCK_HEADER.size)
+    if len(header) < _BLOCK_HEADER.size:
+        return None
+    block_type, size = _BLOCK_HEADER.unpack(header)
+    payload = fd.read(size)
+    if len(payload) < size:
+        return None
+    return block_type, payload
+
+
+def read_blocks(fd, offset=None):
+    '''Iterate over (offset, block_type, payload) for every complete
+    block in the file.  Logs recorded in the field are frequently cut
+    short, so a truncated final block just ends the iteration.'''
+    if offset is None:
+        fd.seek(0)
+        if fd.read(len(HEADER)) != HEADER:
+            raise RuntimeError('not a TLOG0002 file')
+        offset = len(HEADER)
+
+    while True:
+        result = read_block(fd, offset)
+        if result is None:
+            return
+        block_type, payload = result
+        yield offset, block_type, payload
+        offset += _BLOCK_HEADER.size + len(payload)
+
+
+def make_decoder(name, schema):
+    '''Return a function which turns serialized data for the given
+    record into a python object.'''
+    import telemetry_archive
+    return telemetry_archive.ReadArchive(schema, name).deserialize
+
+
+def find_timestamp(value):
+    '''Return the first field named "timestamp" in a decoded record,
+    searching child structures depth first, or None if there is
+    none.'''
+    if hasattr(value, 'timestamp'):
+        return value.timestamp
+    if not hasattr(value, '_fields'):
+        return None
+    for child in value._fields:
+        result = find_timestamp(getattr(value, child))
+        if result is not None:
+            return result
+    return None
+
+
+class TimestampDecoder(object):
+    '''Extracts record timestamps from serialized data blocks.  If no
+    decoder is available for a record, timestamps are reported as
+    unknown.'''
+
+    def __init__(self):
+        self.decoders = {}
+
+    def add_schema(self, identifier, name, schema):
+        try:
+            self.decoders[identifier] = make_decoder(name, schema)
+        except Exception:
+            self.decoders[identifier] = None
+
+    def __call__(self, identifier, data):
+        decoder = self.decoders.get(identifier, None)
+        if decoder is None:
+            return None
+        try:
+            return find_timestamp(decoder(data))
+        except Exception:
+            return None
+
+
+class IndexRecord(object):
+    def __init__(self, identifier, name, schema_offset):
+        self.identifier = identifier
+        self.name = name
+        self.schema_offset = schema_offset
+        self.offsets = []
+        self.chunks = []
+
+    def chunks_between(self, start=None, end=None):
+        '''Return the chunks which may contain data between the given
+        timestamps.  Chunks with unknown timestamps are always
+        returned.'''
+        # NaN compares false with everything, so unknown timestamps
+        # fall through both tests.
+        result = []
+        for chunk in self.chunks:
+            if start is not None and chunk.last_timestamp < start:
+                continue
+            if end is not None and chunk.first_timestamp > end:
+                continue
+            result.append(chunk)
+        return result
+
+    def offsets_between(self, start=None, end=None):
+        result = []
+        for chunk in self.chunks_between(start, end):
+            result.extend(self.offsets[chunk.start:chunk.start + chunk.count])
+        return result
+
+
+class Index(object):
+    def __init__(self):
+        self.records = collections.OrderedDict()
+
+    def names(self):
+        '''Return a dictionary mapping record names to identifiers.'''
+        return dict((x.name, x.identifier) for x in self.records.values())
+
+    def find(self, name):
+        for record in self.records.values():
+            if record.name == name:
+                return record
+        return None
+
+    def serialize(self, index_offset):
+        '''Return the payload of an index block which will be written
+        at index_offset.'''
+        result = [_INDEX_HEADER.pack(INDEX_VERSION, len(self.records))]
+        for record in self.records.values():
+            result.append(_INDEX_RECORD.pack(
+                    record.identifier, record.schema_offset,
+                    len(record.name)))
+            result.append(record.name)
+            result.append(_UINT32.pack(len(record.offsets)))
+            result.append(struct.pack('<%dQ' % len(record.offsets),
+                                      *record.offsets))
+            result.append(_UINT32.pack(len(record.chunks)))
+            for chunk in record.chunks:
+                result.append(_INDEX_CHUNK.pack(*chunk))
+        result.append(_INDEX_TRAILER.pack(index_offset, INDEX_MAGIC))
+        return b''.join(result)
+
+    @staticmethod
+    def deserialize(payload):
+        version, record_count = _INDEX_HEADER.unpack_from(payload, 0)
+        if version != INDEX_VERSION:
+            raise RuntimeError('unsupported index version %d' % version)
+        offset = _INDEX_HEADER.size
+
+        result = Index()
+        for _ in range(record_count):
+            identifier, schema_offset, name_size = \
+                _INDEX_RECORD.unpack_from(payload, offset)
+            offset += _INDEX_RECORD.size
+            name = bytes(payload[offset:offset + name_size])
+            offset += name_size
+
+            record = IndexRecord(identifier, name, schema_offset)
+
+            offset_count, = _UINT32.unpack_from(payload, offset)
+            offset += _UINT32.size
+            record.offsets = list(struct.unpack_from(
+                    '<%dQ' % offset_count, payload, offset))
+            offset += 8 * offset_count
+
+            chunk_count, = _UINT32.unpack_from(payload, offset)
+            offset += _UINT32.size
+            for _ in range(chunk_count):
+                record.chunks.append(
+                    Chunk(*_INDEX_CHUNK.unpack_from(payload, offset)))
+                offset += _INDEX_CHUNK.size
+
+            result.records[identifier] = record
+
+        return result
+
+
+class IndexBuilder(object):
+    '''Accumulates an Index as blocks are written or scanned.
+
+    Only the first and last data block of each chunk are decoded to
+    find timestamps, so building the index costs little more than
+    writing the log.'''
+
+    def __init__(self, timestamp_func=None):
+        self.timestamp_func = timestamp_func
+        self.index = Index()
+        self._last_data = {}
+
+    def add_schema(self, offset, identifier, name):
+        self.index.records[identifier] = IndexRecord(identifier, name, offset)
+
+    def add_data(self, offset, identifier, data, host_timestamp=None):
+        '''If the record has no timestamp of its own, host_timestamp is
+        used instead.'''
+        record = self.index.records.get(identifier, None)
+        if record is None:
+            return
+
+        position = len(record.offsets)
+        record.offsets.append(offset)
+
+        if position % CHUNK_SIZE == 0:
+            self._finish_chunk(record)
+            record.chunks.append(
+                Chunk(position, 0,
+                      self._timestamp(identifier, data, host_timestamp),
+                      0.0))
+
+        chunk = record.chunks[-1]
+        record.chunks[-1] = chunk._replace(count=chunk.count + 1)
+        self._last_data[identifier] = (data, host_timestamp)
+
+    def finish(self):
+        for record in self.index.records.values():
+            self._finish_chunk(record)
+        return self.index
+
+    def _finish_chunk(self, record):
+        last = self._last_data.pop(record.identifier, None)
+        if last is None or len(record.chunks) == 0:
+            return
+        chunk = record.chunks[-1]
+        record.chunks[-1] = chunk._replace(
+            last_timestamp=self._timestamp(record.identifier, *last))
+
+    def _timestamp(self, identifier, data, host_timestamp=None):
+        result = None
+        if self.timestamp_func is not None:
+            result = self.timestamp_func(identifier, data)
+        if result is None:
+            result = host_timestamp
+        if result is None:
+            return float('nan')
+        return float(result)
+
+
+def map_file(fd):
+    '''Return a read-only memory map of the entire file.'''
+    return mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _make_view(data):
+    if bytes is str:
+        # Python 2's mmap does not support the new buffer protocol,
+        # and its memoryview is not accepted by most functions, so
+        # slicing will just make copies.
+        return data
+    return memoryview(data)
+
+
+def walk_blocks(data, offset=None):
+    '''Iterate over (offset, block_type, payload) for every complete
+    block in a buffer holding an entire file, such as a memory map.
+    The payload is a slice of the buffer, not a copy.'''
+    view = _make_view(data)
+    size = len(data)
+    if offset is None:
+        if data[0:len(HEADER)] != HEADER:
+            raise RuntimeError('not a TLOG0002 file')
+        offset = len(HEADER)
+
+    header_size = _BLOCK_HEADER.size
+    unpack_from = _BLOCK_HEADER.unpack_from
+    while offset + header_size <= size:
+        block_type, block_size = unpack_from(data, offset)
+        start = offset + header_size
+        end = start + block_size
+        if end > size:
+            return
+        yield offset, block_type, view[start:end]
+        offset = end
+
+
+def block_at(data, offset):
+    '''Return (block_type, payload) for the block at the given offset
+    of a buffer, where payload is a slice of the buffer.'''
+    block_type, block_size = _BLOCK_HEADER.unpack_from(data, offset)
+    start = offset + _BLOCK_HEADER.size
+    return block_type, _make_view(data)[start:start + block_size]
+
+
+def find_index(data):
+    '''Return the Index stored at the end of a buffer holding an
+    entire file, or None if it has no index.'''
+    size = len(data)
+    if size < len(HEADER) + _BLOCK_HEADER.size + _INDEX_TRAILER.size:
+        return None
+
+    index_offset, magic = _INDEX_TRAILER.unpack_from(
+        data, size - _INDEX_TRAILER.size)
+    if magic != INDEX_MAGIC or index_offset + _BLOCK_HEADER.size > size:
+        return None
+
+    block_type, block_size = _BLOCK_HEADER.unpack_from(data, index_offset)
+    if block_type != BLOCK_INDEX:
+        return None
+    if index_offset + _BLOCK_HEADER.size + block_size != size:
+        return None
+
+    return Index.deserialize(block_at(data, index_offset)[1])
+
+
+def read_index(fd):
+    '''Return the Index stored at the end of the file, or None if the
+    file has no index.'''
+    fd.seek(0, os.SEEK_END)
+    if fd.tell() == 0:
+        return None
+    data = map_file(fd)
+    try:
+        return find_index(data)
+    finally:
+        data.close()
+
+
+def build_index(fd):
+    '''Scan every block of an existing file and return (index,
+    end_offset), where end_offset is the end of the last block which
+    is not an index block.'''
+    timestamp_func = TimestampDecoder()
+    builder = IndexBuilder(timestamp_func)
+    end_offset = len(HEADER)
+
+    for offset, block_type, payload in read_blocks(fd):
+        if block_type == BLOCK_SCHEMA:
+            identifier, name, schema = parse_schema_block(payload)
+            timestamp_func.add_schema(identifier, name, schema)
+            builder.add_schema(offset, identifier, name)
+        elif block_type in (BLOCK_DATA, BLOCK_COMPRESSED):
+            for data_payload in data_payloads(block_type, payload):
+                identifier, host_timestamp, data = split_data_block(
+                    data_payload)
+                builder.add_data(offset, identifier, data, host_timestamp)
+        elif block_type == BLOCK_INDEX:
+            continue
+        end_offset = offset + _BLOCK_HEADER.size + len(payload)
+
+    return builder.finish(), end_offset
+
+
+def write_index(fd, offset, index):
+    '''Write an index block at the given offset.'''
+    payload = index.serialize(offset)
+    fd.seek(offset)
+    fd.write(_BLOCK_HEADER.pack(BLOCK_INDEX, len(payload)) + payload)
+
+
+def rebuild_index(filename):
+    '''Replace any index in the given file with a freshly built one.
+    Anything after the last complete block, including a stale index,
+    is discarded.'''
+    with open(filename, 'r+b') as fd:
+        index, end_offset = build_index(fd)
+        fd.truncate(end_offset)
+        write_index(fd, end_offset, index)
+        return index
+
+
+def _in_range(value, start, end, host_timestamp=None):
+    if start is None and end is None:
+        return True
+    timestamp = find_timestamp(value)
+    if timestamp is None:
+        timestamp = host_timestamp
+    if timestamp is None:
+        return True
+    if start is not None and timestamp < start:
+        return False
+    if end is not None and timestamp > end:
+        return False
+    return True
+
+
+class FileReader(object):
+    '''Read decoded records from a TLOG0002 file.
+
+    The file is memory mapped and walked in place, and decoders are
+    handed slices of the map rather than copies.  If the file has an
+    index, only the blocks for the requested records and time range
+    are visited, otherwise the whole file is scanned.'''
+
+    def __init__(self, fd):
+        self.fd = fd
+        fd.seek(0, os.SEEK_END)
+        if fd.tell() < len(HEADER):
+            raise RuntimeError('not a TLOG0002 file')
+        self.data = map_file(fd)
+        if self.data[0:len(HEADER)] != HEADER:
+            raise RuntimeError('not a TLOG0002 file')
+        self.index = find_index(self.data)
+        self._schemas = None
+        self._decoders = {}
+
+    def close(self):
+        self.data.close()
+        self.fd.close()
+
+    def schemas(self):
+        '''Return a dictionary mapping identifiers to (name,
+        schema).'''
+        if self._schemas is not None:
+            return self._schemas
+
+        self._schemas = {}
+        if self.index is not None:
+            for record in self.index.records.values():
+                block_type, payload = block_at(self.data, record.schema_offset)
+                assert block_type == BLOCK_SCHEMA
+                identifier, name, schema = parse_schema_block(payload)
+                self._schemas[identifier] = (name, bytes(schema))
+        else:
+            for _, block_type, payload in walk_blocks(self.data):
+                if block_type == BLOCK_SCHEMA:
+                    identifier, name, schema = parse_schema_block(payload)
+                    self._schemas[identifier] = (name, bytes(schema))
+        return self._schemas
+
+    def records(self):
+        '''Return a list of all record names.'''
+        return [name for name, _ in self.schemas().values()]
+
+    def _decoder(self, identifier):
+        if identifier not in self._decoders:
+            name, schema = self.schemas()[identifier]
+            self._decoders[identifier] = make_decoder(name, schema)
+        return self._decoders[identifier]
+
+    def _identifiers(self, names):
+        return set(identifier
+                   for identifier, (name, _) in self.schemas().items()
+                   if names is None or name in names)
+
+    def _data_blocks(self, identifiers, start, end):
+        if self.index is not None:
+            # Every record in a compressed block shares its offset.
+            offsets = set()
+            for identifier in identifiers:
+                record = self.index.records.get(identifier, None)
+                if record is not None:
+                    offsets.update(record.offsets_between(start, end))
+            blocks = (block_at(self.data, offset)
+                      for offset in sorted(offsets))
+        else:
+            blocks = ((block_type, payload)
+                      for _, block_type, payload in walk_blocks(self.data))
+
+        for block_type, payload in blocks:
+            if block_type == BLOCK_DATA:
+                yield payload
+            elif (block_type == BLOCK_COMPRESSED and
+                  compressed_identifier(payload) in identifiers):
+                for data_payload in expand_compressed_block(payload):
+                    yield data_payload
+
+    def timed_data_blocks(self, names=None, start=None, end=None):
+        '''Iterate over (identifier, host_timestamp, data) for the
+        undecoded data blocks of the given records, where data is a
+        slice of the memory map and host_timestamp is None if it was
+        not recorded.'''
+        identifiers = self._identifiers(names)
+
+        for payload in self._data_blocks(identifiers, start, end):
+            identifier, host_timestamp, data = split_data_block(payload)
+            if identifier not in identifiers:
+                continue
+            yield identifier, host_timestamp, data
+
+    def data_blocks(self, names=None, start=None, end=None):
+        '''Iterate over (identifier, data) for the undecoded data
+        blocks of the given records, where data is a slice of the
+        memory map.'''
+        for identifier, _, data in self.timed_data_blocks(names, start, end):
+            yield identifier, data
+
+    def timed_items(self, names=None, start=None, end=None):
+        '''Like items, but iterate over (name, host_timestamp,
+        value).  Records without a timestamp of their own are filtered
+        by their host timestamp.'''
+        schemas = self.schemas()
+
+        for identifier, host_timestamp, data in self.timed_data_blocks(
+                names, start, end):
+            value = self._decoder(identifier)(data)
+            if not _in_range(value, start, end, host_timestamp):
+                continue
+            yield schemas[identifier][0], host_timestamp, value
+
+    def items(self, names=None, start=None, end=None):
+        '''Iterate over (name, value) for every record whose name is
+        in names, or all records if names is None, in file order.  If
+        start or end are given, only records with timestamps in that
+        range are returned.'''
+        for name, _, value in self.timed_items(names, start, end):
+            yield name, value
+
+    def get(self, names=None, start=None, end=None):
+        '''Return a dictionary mapping record names to a list of all
+        their values.'''
+        result = {}
+        for name, value in self.items(names, start, end):
+            result.setdefault(name, []).append(value)
+        return result
+
+
+def split_file(data, count):
+    '''Return a list of (start, end) offsets which divide a buffer
+    holding an entire file into about count pieces of similar size,
+    each beginning and ending on a block boundary.'''
+    size = len(data)
+    step = max(1, (size - len(HEADER)) // max(1, count))
+
+    result = []
+    start = len(HEADER)
+    next_split = start + step
+    offset = start
+    unpack_from = _BLOCK_HEADER.unpack_from
+    while offset + _BLOCK_HEADER.size <= size:
+        _, block_size = unpack_from(data, offset)
+        end = offset + _BLOCK_HEADER.size + block_size
+        if end > size:
+            break
+        offset = end
+        if offset >= next_split:
+            result.append((start, offset))
+            start = offset
+            next_split = start + step
+    if offset > start:
+        result.append((start, offset))
+    return result
+
+
+def _decode_range(args):
+    filename, start, end, schemas, time_start, time_end, func = args
+
+    with open(filename, 'rb') as fd:
+        data = map_file(fd)
+
+    with contextlib.closing(data):
+        # The items refer to slices of the map, so they must be
+        # finished with before it can be closed.
+        with contextlib.closing(_range_items(
+                data, start, end, schemas, time_start, time_end)) as items:
+            return func(items)
+
+
+def _range_items(data, start, end, schemas, time_start, time_end):
+    decoders = dict((identifier, make_decoder(name, schema))
+                    for identifier, (name, schema) in schemas.items())
+
+    for offset, block_type, payload in walk_blocks(data, start):
+        if offset >= end:
+            break
+        if (block_type == BLOCK_COMPRESSED and
+                compressed_identifier(payload) not in decoders):
+            continue
+        for data_payload in data_payloads(block_type, payload):
+            identifier, host_timestamp, record_data = split_data_block(
+                data_payload)
+            decoder = decoders.get(identifier, None)
+            if decoder is None:
+                continue
+            value = decoder(record_data)
+            if not _in_range(value, time_start, time_end, host_timestamp):
+                continue
+            yield schemas[identifier][0], value
+
+
+def decode_parallel(filename, func, names=None, start=None, end=None,
+                    processes=None):
+    '''Decode a file using a pool of worker processes.
+
+    The file is split at block boundaries into pieces, and each worker
+    is given the schemas for the requested records.  func is called in
+    the worker with an iterator over the (name, value) pairs of one
+    piece, in file order, and must return something which can be
+    pickled.  Decoded records themselves usually can not be, so func
+    should reduce them to plain data, and must be defined at module
+    level.  The results of func for each piece are returned in file
+    order.'''
+    import multiprocessing
+
+    with open(filename, 'rb') as fd, \
+            contextlib.closing(FileReader(fd)) as reader:
+        schemas = dict((identifier, value)
+                       for identifier, value in reader.schemas().items()
+                       if names is None or value[0] in names)
+        processes = processes or multiprocessing.cpu_count()
+        # Use more pieces than processes so that the workers stay
+        # busy even when the records are unevenly distributed.
+        pieces = split_file(reader.data, 4 * processes)
+
+    args = [(filename, piece_start, piece_end, schemas, start, end, func)
+            for piece_start, piece_end in pieces]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap(_decode_range, args):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main():
+    usage, description = __doc__.split('\n\n', 1)
+    parser = optparse.OptionParser(usage=usage, description=description)
+
+    parser.add_option('--rebuild-index', '-r', action='store_true',
+                      help='(re)write the trailing index block')
+
+    options, args = parser.parse_args()
+
+    for filename in args:
+        if options.rebuild_index:
+            index = rebuild_index(filename)
+        else:
+            with open(filename, 'rb') as fd:
+                index = read_index(fd)
+            if index is None:
+                print('%s: no index' % filename)
+                continue
+
+        print('%s:' % filename)
+        for record in index.records.values():
+            first = [x.first_timestamp for x in record.chunks
+                     if not math.isnan(x.first_timestamp)]
+            last = [x.last_timestamp for x in record.chunks
+                    if not math.isnan(x.last_timestamp)]
+            print('  %s: %d records in %d chunks, %s - %s' % (
+                    record.name.decode('latin1'),
+                    len(record.offsets), len(record.chunks),
+                    '%.6f' % min(first) if first else '?',
+                    '%.6f' % max(last) if last else '?'))
+
+
+if __name__ == '__main__':
+    main()
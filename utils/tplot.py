@@ -20,6 +20,7 @@ import sys
 import time
 
 import matplotlib
+import numpy
 
 matplotlib.use('Qt4Agg')
 matplotlib.rcParams['backend.qt4'] = 'PySide'
@@ -41,6 +42,11 @@ import mjlib.telemetry.file_reader as file_reader
 
 AXES = ['Left', 'Right', '3', '4']
 
+LOAD_PROGRESS_INTERVAL_S = 0.25
+
+DECIMATION_FACTOR = 4
+DECIMATION_MIN_POINTS = 1000
+
 LEGEND_LOC = {
     'Left': 2,
     'Right': 1,
@@ -67,12 +73,51 @@ class Log(object):
     def __init__(self, filename):
         self.reader = file_reader.FileReader(filename)
         self.records = self.reader.records()
-        self.all = None
+        self.all = {}
+        self.count = 0
+        self.complete = False
 
-    def get_all(self):
-        if self.all is not None:
-            return
-        self.all = self.reader.get()
+    def load(self, progress=None, stop=None):
+        '''Decode every record in the log, appending to self.all as we
+        go so that a caller in another thread can look at what has been
+        loaded so far.  progress, if given, is called with the number
+        of items loaded every LOAD_PROGRESS_INTERVAL_S.  If stop
+        returns true, loading is abandoned.'''
+        next_progress = time.time() + LOAD_PROGRESS_INTERVAL_S
+        for name, item in self.reader.items():
+            self.all.setdefault(name, []).append(item)
+            self.count += 1
+
+            if (self.count % 1000) == 0:
+                if stop and stop():
+                    return
+                now = time.time()
+                if progress and now > next_progress:
+                    progress(self.count)
+                    next_progress = now + LOAD_PROGRESS_INTERVAL_S
+
+        self.complete = True
+        if progress:
+            progress(self.count)
+
+
+class LogLoader(QtCore.QThread):
+    '''Loads a Log in the background, emitting "progress" with the
+    number of items loaded so far.'''
+
+    progress = QtCore.Signal(int)
+
+    def __init__(self, log, parent=None):
+        super(LogLoader, self).__init__(parent)
+        self.log = log
+        self._stop = False
+
+    def stop(self):
+        self._stop = True
+        self.wait()
+
+    def run(self):
+        self.log.load(progress=self.progress.emit, stop=lambda: self._stop)
 
 
 def _walk_item(item):
@@ -123,24 +168,177 @@ def _make_timestamp_getter(all_data):
     return find_child('', sample)
 
 
-def _bisect(array, item, key):
-    if len(array) == 0:
-        return None
-    if item < key(array[0]):
-        return None
+class TimestampIndex(object):
+    '''The timestamps of all loaded items of one record, kept in a
+    NumPy array so that the item current at a given time can be found
+    without walking the records themselves.'''
+
+    def __init__(self):
+        self.getter = None
+        self.count = 0
+        self._times = numpy.zeros(1024)
+
+    def times(self):
+        return self._times[:self.count]
+
+    def update(self, all_data):
+        '''Add the timestamps of any items loaded since the last
+        update.  Return an array of just the new timestamps.'''
+        if self.getter is None:
+            if len(all_data) == 0:
+                return self.times()[:0]
+            self.getter = _make_timestamp_getter(all_data)
+            if self.getter is None:
+                return self.times()[:0]
+
+        new_count = len(all_data)
+        if new_count <= self.count:
+            return self.times()[:0]
+
+        if new_count > len(self._times):
+            capacity = len(self._times)
+            while capacity < new_count:
+                capacity *= 2
+            times = numpy.zeros(capacity)
+            times[:self.count] = self._times[:self.count]
+            self._times = times
+
+        old_count = self.count
+        self._times[old_count:new_count] = [
+            self.getter(x) for x in all_data[old_count:new_count]]
+        self.count = new_count
+        return self._times[old_count:new_count]
+
+    def find(self, time):
+        '''Return the index of the last item at or before time, or None
+        if there is none.'''
+        if self.getter is None or self.count == 0:
+            return None
+        index = int(numpy.searchsorted(self.times(), time, side='right')) - 1
+        if index < 0:
+            return None
+        return index
 
-    lower = 0
-    upper = len(array)
 
-    while abs(lower - upper) > 1:
-        mid = (lower + upper) // 2
-        value = key(array[mid])
-        if item < value:
-            upper = mid
-        else:
-            lower = mid
+class _GrowingArray(object):
+    '''A 1D float array which can be appended to in amortized
+    constant time per element.'''
+
+    def __init__(self):
+        self._data = numpy.empty(256)
+        self.size = 0
+
+    def extend(self, values):
+        new_size = self.size + len(values)
+        if new_size > len(self._data):
+            data = numpy.empty(max(new_size, 2 * len(self._data)))
+            data[:self.size] = self._data[:self.size]
+            self._data = data
+        self._data[self.size:new_size] = values
+        self.size = new_size
+
+    def values(self):
+        return self._data[:self.size]
 
-    return lower
+
+class DecimatedSeries(object):
+    '''A pyramid of min/max preserving decimations of one plotted
+    series.  Each level divides the full resolution samples into
+    buckets of DECIMATION_FACTOR times the previous level's and keeps
+    only the minimum and maximum sample of each bucket, in their
+    original order, so that spikes remain visible at any zoom.  Series
+    whose x values are not sorted are never decimated.
+
+    Samples are added with extend, which only decimates the buckets
+    completed by the new samples.'''
+
+    def __init__(self):
+        self._x = _GrowingArray()
+        self._y = _GrowingArray()
+        self._sorted = True
+        # One [bucket, x, y] for each level past the first, where x
+        # and y hold the decimation of every complete bucket.
+        self._decimated = []
+        self.levels = [(self._x.values(), self._y.values())]
+
+    def __len__(self):
+        return self._x.size
+
+    def extend(self, xdata, ydata):
+        '''Append samples to the series.  None values are treated as
+        missing.'''
+        def to_array(data):
+            return numpy.array([numpy.nan if v is None else v for v in data],
+                               dtype=float)
+
+        old_size = self._x.size
+        self._x.extend(to_array(xdata))
+        self._y.extend(to_array(ydata))
+        x = self._x.values()
+        y = self._y.values()
+
+        if self._sorted:
+            # Include the last old sample, so that the new samples
+            # are compared against it.
+            if not numpy.all(numpy.diff(x[max(0, old_size - 1):]) >= 0):
+                self._sorted = False
+                self._decimated = []
+
+        if self._sorted:
+            for level in self._decimated:
+                bucket, level_x, level_y = level
+                done = level_x.size // 2 * bucket
+                new_x, new_y = self._decimate(x[done:], y[done:], bucket)
+                level_x.extend(new_x)
+                level_y.extend(new_y)
+
+            bucket = DECIMATION_FACTOR ** (len(self._decimated) + 1)
+            while len(x) // bucket >= DECIMATION_MIN_POINTS:
+                level_x = _GrowingArray()
+                level_y = _GrowingArray()
+                new_x, new_y = self._decimate(x, y, bucket)
+                level_x.extend(new_x)
+                level_y.extend(new_y)
+                self._decimated.append([bucket, level_x, level_y])
+                bucket *= DECIMATION_FACTOR
+
+        self.levels = [(x, y)]
+        for bucket, level_x, level_y in self._decimated:
+            # Any partial bucket at the end is kept at full
+            # resolution.
+            done = level_x.size // 2 * bucket
+            self.levels.append(
+                (numpy.concatenate([level_x.values(), x[done:]]),
+                 numpy.concatenate([level_y.values(), y[done:]])))
+
+    @staticmethod
+    def _decimate(x, y, bucket):
+        '''Return the min/max decimation of each complete bucket of
+        x and y.'''
+        count = len(y) // bucket
+        buckets = y[:count * bucket].reshape(count, bucket)
+        nan = numpy.isnan(buckets)
+        low = numpy.argmin(numpy.where(nan, numpy.inf, buckets), axis=1)
+        high = numpy.argmax(numpy.where(nan, -numpy.inf, buckets), axis=1)
+
+        base = numpy.arange(count) * bucket
+        indices = numpy.empty(2 * count, dtype=int)
+        indices[0::2] = base + numpy.minimum(low, high)
+        indices[1::2] = base + numpy.maximum(low, high)
+        return x[indices], y[indices]
+
+    def select(self, xmin, xmax, max_points):
+        '''Return (x, y) for the finest level which has no more than
+        max_points between xmin and xmax.'''
+        for level, (x, y) in enumerate(self.levels):
+            if len(self.levels) == 1:
+                return x, y
+            # Include one point on either side, so that the line
+            # continues to the edges of the axis.
+            start = max(0, numpy.searchsorted(x, xmin, side='left') - 1)
+            end = min(len(x), numpy.searchsorted(x, xmax, side='right') + 1)
+            if end - start <= max_points or level + 1 == len(self.levels):
+                return x[start:end], y[start:end]
 
 
 def _clear_tree_widget(item):
@@ -230,6 +428,8 @@ class Tplot(QtGui.QMainWindow):
 
         self.left_axis = self.figure.add_subplot(111)
         self.left_axis.tplot_name = 'Left'
+        self.left_axis.callbacks.connect(
+            'xlim_changed', self.handle_xlim_changed)
 
         self.axes = {
             'Left' : self.left_axis,
@@ -245,6 +445,7 @@ class Tplot(QtGui.QMainWindow):
         self.canvas.setFocus()
 
         self.log = None
+        self.loader = None
         self.COLORS = 'rgbcmyk'
         self.next_color = 0
 
@@ -254,6 +455,13 @@ class Tplot(QtGui.QMainWindow):
         self.time_start = None
         self.time_end = None
         self.time_current = None
+        self.timestamp_indices = {}
+
+        self.load_progress = QtGui.QProgressBar()
+        self.load_progress.setRange(0, 0)
+        self.load_progress.setMaximumWidth(150)
+        self.load_progress.setVisible(False)
+        self.statusBar().addPermanentWidget(self.load_progress)
 
         self.ui.recordCombo.currentIndexChanged.connect(
             self.handle_record_combo)
@@ -281,6 +489,12 @@ class Tplot(QtGui.QMainWindow):
         self.ui.fastForwardButton.clicked.connect(
             self.handle_fast_forward_button)
 
+    def closeEvent(self, event):
+        if self.loader is not None:
+            self.loader.stop()
+            self.loader = None
+        super(Tplot, self).closeEvent(event)
+
     def open(self, filename):
         try:
             maybe_log = Log(filename)
@@ -290,6 +504,10 @@ class Tplot(QtGui.QMainWindow):
             raise
             return
 
+        if self.loader is not None:
+            self.loader.stop()
+            self.loader = None
+
         # OK, we're good, clear out our UI.
         self.ui.treeWidget.clear()
         self.tree_items = []
@@ -309,6 +527,31 @@ class Tplot(QtGui.QMainWindow):
             schema = self.log.records[name]
             _add_schema_struct_to_tree_view(item, schema)
 
+        self.time_start = None
+        self.time_end = None
+        self.time_current = None
+        self.timestamp_indices = {}
+
+        # The schema is all shown now, the data itself fills in as it
+        # is decoded.
+        self.loader = LogLoader(self.log)
+        self.loader.progress.connect(self.handle_load_progress)
+        self.loader.finished.connect(self.handle_load_finished)
+        self.load_progress.setVisible(True)
+        self.loader.start()
+
+    def handle_load_progress(self, count):
+        self.statusBar().showMessage('loaded %d items' % count)
+
+        self.update_timeline()
+        self.update_plot_data()
+
+    def handle_load_finished(self):
+        self.load_progress.setVisible(False)
+        if self.log.complete:
+            self.statusBar().showMessage(
+                'loaded %d items' % self.log.count, 5000)
+
     def handle_record_combo(self):
         record = self.ui.recordCombo.currentText()
         self.ui.xCombo.clear()
@@ -359,14 +602,9 @@ class Tplot(QtGui.QMainWindow):
         self._add_plot(record, xname, yname)
 
     def _add_plot(self, record, xname, yname):
-        self.log.get_all()
-
-        data = self.log.all[record]
-        xdata = [_get_data(x.data, xname) for x in data]
-        ydata = [_get_data(x.data, yname) for x in data]
-
-        line = matplotlib.lines.Line2D(xdata, ydata)
+        line = matplotlib.lines.Line2D([], [])
         line.tplot_record_name = record
+        line.tplot_series = DecimatedSeries()
         if 'timestamp' in [x.name for x in self.log.records[record].fields]:
             line.tplot_has_timestamp = True
         line.tplot_xname = xname
@@ -379,8 +617,7 @@ class Tplot(QtGui.QMainWindow):
         axis = self.get_current_axis()
 
         axis.add_line(line)
-        axis.relim()
-        axis.autoscale_view()
+        self._update_line_data(line)
         axis.legend(loc=LEGEND_LOC[axis.tplot_name])
 
         self.ui.plotsCombo.addItem(label, line)
@@ -388,6 +625,53 @@ class Tplot(QtGui.QMainWindow):
 
         self.canvas.draw()
 
+    def _update_line_data(self, line):
+        '''Extend a plotted line with any items which have been loaded
+        since it was last updated.  Return True if anything changed.'''
+        data = self.log.all.get(line.tplot_record_name, [])
+        old_count = len(line.tplot_series)
+        new_count = len(data)
+        if new_count == old_count:
+            return False
+
+        new_data = data[old_count:new_count]
+        line.tplot_series.extend(
+            [_get_data(x.data, line.tplot_xname) for x in new_data],
+            [_get_data(x.data, line.tplot_yname) for x in new_data])
+
+        # Autoscale against the coarsest level covering everything,
+        # which has the same extents as the full data.
+        line.set_data(*line.tplot_series.levels[-1])
+        line.axes.relim()
+        line.axes.autoscale_view()
+        self._select_line_detail(line)
+        return True
+
+    def _select_line_detail(self, line):
+        xmin, xmax = line.axes.get_xlim()
+        max_points = max(100, int(2 * line.axes.bbox.width))
+        line.set_data(*line.tplot_series.select(xmin, xmax, max_points))
+
+    def handle_xlim_changed(self, axis):
+        # Twinned axes share their x limits, but only the axis which
+        # was changed gets the callback.
+        for axis in self.get_all_axes():
+            for line in axis.lines:
+                if hasattr(line, 'tplot_series'):
+                    self._select_line_detail(line)
+
+    def update_plot_data(self):
+        updated = False
+        for axis in self.get_all_axes():
+            for line in axis.lines:
+                if not hasattr(line, 'tplot_record_name'):
+                    continue
+                if self._update_line_data(line):
+                    updated = True
+
+        if updated:
+            self.canvas.draw()
+
     def make_label(self, record, xname, yname):
         if xname == 'timestamp':
             return '%s.%s' % (record, yname)
@@ -402,6 +686,7 @@ class Tplot(QtGui.QMainWindow):
         result = self.left_axis.twinx()
         self.axes[requested] = result
         result.tplot_name = requested
+        result.callbacks.connect('xlim_changed', self.handle_xlim_changed)
 
         return result
 
@@ -440,25 +725,24 @@ class Tplot(QtGui.QMainWindow):
 
 
     def update_timeline(self):
-        if self.time_start is not None:
+        if self.log is None:
             return
 
-        self.log.get_all()
+        first_update = self.time_start is None
 
         # Look through all the records for those which have a
-        # "timestamp" field.  Find the minimum and maximum of each.
+        # "timestamp" field, and extend their timestamp index with
+        # anything loaded since the last update.  Find the minimum and
+        # maximum of each.
         for record_name, schema in self.log.records.items():
             if record_name not in self.log.all:
                 continue
-            timestamp_getter = _make_timestamp_getter(self.log.all[record_name])
-            if timestamp_getter is None:
-                continue
-
-            these_times = [timestamp_getter(x) for x in self.log.all[record_name]]
+            these_times = self.timestamp_index(record_name).update(
+                self.log.all[record_name])
             if len(these_times) == 0:
                 continue
-            this_min = min(these_times)
-            this_max = max(these_times)
+            this_min = float(these_times.min())
+            this_max = float(these_times.max())
 
             if this_min < 0 or this_max < 0:
                 continue
@@ -468,8 +752,16 @@ class Tplot(QtGui.QMainWindow):
             if self.time_end is None or this_max > self.time_end:
                 self.time_end = this_max
 
-        self.time_current = self.time_start
-        self.update_time(self.time_current, update_slider=False)
+        if first_update:
+            self.time_current = self.time_start
+        self.update_time(self.time_current, update_slider=not first_update)
+
+    def timestamp_index(self, record_name):
+        result = self.timestamp_indices.get(record_name, None)
+        if result is None:
+            result = TimestampIndex()
+            self.timestamp_indices[record_name] = result
+        return result
 
     def handle_mouse(self, event):
         if not event.inaxes:
@@ -493,7 +785,7 @@ class Tplot(QtGui.QMainWindow):
             value.set_navigate(True)
 
     def update_time(self, new_time, update_slider=True):
-        if new_time is None:
+        if new_time is None or self.time_start is None:
             return
         new_time = max(self.time_start, min(self.time_end, new_time))
         self.time_current = new_time
@@ -515,8 +807,9 @@ class Tplot(QtGui.QMainWindow):
             with self._updating_slider:
                 elapsed = new_time - self.time_start
                 total_time = self.time_end - self.time_start
-                self.ui.timeSlider.setValue(
-                    int(1000 * elapsed / total_time))
+                if total_time > 0:
+                    self.ui.timeSlider.setValue(
+                        int(1000 * elapsed / total_time))
 
     def handle_time_slider(self):
         if self._updating_slider.active():
@@ -532,16 +825,19 @@ class Tplot(QtGui.QMainWindow):
 
     def update_tree_view(self, time):
         for item in self.tree_items:
+            # Collapsed records are filled in when they are expanded.
+            if not item.isExpanded():
+                continue
             name = item.text(0)
             if name not in self.log.all:
                 continue
             all_data = self.log.all[name]
 
-            timestamp_getter = _make_timestamp_getter(all_data)
-            if timestamp_getter is None:
+            index = self.timestamp_index(name)
+            if index.getter is None:
                 continue
 
-            this_data_index = _bisect(all_data, time, key=timestamp_getter)
+            this_data_index = index.find(time)
             if this_data_index is None:
                 _clear_tree_widget(item)
             else:
@@ -558,9 +854,9 @@ class Tplot(QtGui.QMainWindow):
                 if not hasattr(line, 'tplot_has_timestamp'):
                     continue
 
-                all_data = self.log.all[line.tplot_record_name]
-                timestamp_getter = _make_timestamp_getter(all_data)
-                this_index = _bisect(all_data, new_time, timestamp_getter)
+                all_data = self.log.all.get(line.tplot_record_name, [])
+                this_index = self.timestamp_index(
+                    line.tplot_record_name).find(new_time)
                 if this_index is None:
                     continue
 
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright 2015 Josh Pieper, jjp@pobox.com.
 #
@@ -16,10 +16,241 @@
 
 import blessings
 import json
+import numpy
 import optparse
+import os
+import queue
 import socket
+import sys
 import threading
 import time
+import zipfile
+
+import allan_streaming
+import tlog_columns
+
+
+class Recorder(object):
+    '''Accumulates replies as columns, one structured array for each
+    record name, with the host time each reply was received in a
+    host_timestamp column.  Replies may be added from one thread while
+    another saves.
+
+    So that a long recording neither grows without limit in memory nor
+    is lost if the process dies, the columns are written out every
+    interval_s to numbered piece files named after filename.  save
+    merges the pieces into filename and removes them, streaming each
+    record's columns from one piece at a time.'''
+
+    def __init__(self, filename, interval_s):
+        self.filename = filename
+        self.interval_s = interval_s
+        self.builders = {}
+        self.pieces = []
+        self.counts = {}
+        self.next_flush_s = None
+        self.lock = threading.Lock()
+
+    def add(self, host_timestamp, name, value):
+        if not isinstance(value, dict):
+            value = {'value': value}
+        sample = dict(value)
+        sample['host_timestamp'] = host_timestamp
+
+        with self.lock:
+            builder = self.builders.get(name, None)
+            if builder is None:
+                builder = self.builders[name] = tlog_columns.ColumnBuilder(
+                    sample)
+            builder.add(sample)
+
+            if self.next_flush_s is None:
+                self.next_flush_s = host_timestamp + self.interval_s
+            if host_timestamp >= self.next_flush_s:
+                self.next_flush_s = host_timestamp + self.interval_s
+                self._flush()
+
+    def _flush(self):
+        arrays = dict((name, builder.array())
+                      for name, builder in self.builders.items()
+                      if len(builder))
+        if not arrays:
+            return
+        piece = '%s.%04d.npz' % (self.filename, len(self.pieces))
+        tlog_columns.save(piece, arrays)
+        self.pieces.append(piece)
+        for name, array in arrays.items():
+            self.counts[name] = self.counts.get(name, 0) + len(array)
+        for builder in self.builders.values():
+            builder.clear()
+
+    def save(self):
+        with self.lock:
+            self._flush()
+            if self.filename.endswith('.npy'):
+                if len(self.builders) != 1:
+                    raise RuntimeError('.npy output requires exactly one '
+                                       'record, got %d' % len(self.builders))
+                with open(self.filename, 'wb') as fd:
+                    self._write_record(fd, list(self.builders.keys())[0])
+            else:
+                # The same layout as numpy.savez.
+                with zipfile.ZipFile(self.filename, 'w',
+                                     allowZip64=True) as output:
+                    for name in sorted(self.builders.keys()):
+                        with output.open(name + '.npy', 'w',
+                                         force_zip64=True) as fd:
+                            self._write_record(fd, name)
+            for piece in self.pieces:
+                os.remove(piece)
+            self.pieces = []
+            self.counts = {}
+
+    def _write_record(self, fd, name):
+        '''Write every recorded row of name to fd in the .npy format.'''
+        numpy.lib.format.write_array_header_2_0(fd, {
+                'descr': numpy.lib.format.dtype_to_descr(
+                    self.builders[name].dtype),
+                'fortran_order': False,
+                'shape': (self.counts.get(name, 0),),
+                })
+        for piece in self.pieces:
+            with numpy.load(piece) as data:
+                if name in data.files:
+                    fd.write(data[name].tobytes())
+
+
+def flatten(value, prefix=''):
+    '''Yield (path, leaf) for every leaf of a decoded JSON value.'''
+    if isinstance(value, dict):
+        for key in sorted(value.keys()):
+            for x in flatten(value[key], prefix + key + '.'):
+                yield x
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            for x in flatten(item, prefix + '%d.' % i):
+                yield x
+    else:
+        yield prefix[:-1], value
+
+
+class FieldStats(object):
+    __slots__ = ['value', 'minimum', 'maximum', 'count', 'rate_count',
+                 'rate']
+
+    def __init__(self):
+        self.value = None
+        self.minimum = None
+        self.maximum = None
+        self.count = 0
+        self.rate_count = 0
+        self.rate = 0.0
+
+    def add(self, value):
+        self.value = value
+        self.count += 1
+        self.rate_count += 1
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            if self.minimum is None or value < self.minimum:
+                self.minimum = value
+            if self.maximum is None or value > self.maximum:
+                self.maximum = value
+
+
+def _format_number(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return '%.6g' % value
+    return str(value)
+
+
+class Dashboard(object):
+    '''Shows the latest value of every field in place, with its update
+    rate, minimum and maximum.
+
+    Replies are added from the decode thread, and only update
+    statistics.  The screen is redrawn from the main thread at a fixed
+    rate, and only cells whose text changed are written, so the cost of
+    drawing does not grow with the update rate.'''
+
+    COLUMNS = [('value', 16), ('rate', 8), ('min', 12), ('max', 12)]
+    RATE_PERIOD_S = 1.0
+
+    def __init__(self, term):
+        self.term = term
+        self.lock = threading.Lock()
+        self.fields = {}
+        self.layout_changed = True
+        self.drawn = {}
+        self.size = None
+        self.rate_time = time.time()
+
+    def add(self, name, value):
+        with self.lock:
+            for path, leaf in flatten(value, name + '.'):
+                stats = self.fields.get(path, None)
+                if stats is None:
+                    stats = self.fields[path] = FieldStats()
+                    self.layout_changed = True
+                stats.add(leaf)
+
+    def _update_rates(self, now):
+        elapsed = now - self.rate_time
+        if elapsed < self.RATE_PERIOD_S:
+            return
+        for stats in self.fields.values():
+            stats.rate = stats.rate_count / elapsed
+            stats.rate_count = 0
+        self.rate_time = now
+
+    def _cells(self, stats):
+        return [_format_number(stats.value),
+                '%.1f' % stats.rate,
+                _format_number(stats.minimum),
+                _format_number(stats.maximum)]
+
+    def draw(self):
+        term = self.term
+        output = []
+        with self.lock:
+            self._update_rates(time.time())
+            names = sorted(self.fields.keys())
+            size = (term.height, term.width)
+            if size != self.size:
+                self.size = size
+                self.layout_changed = True
+            if self.layout_changed:
+                self.layout_changed = False
+                self.drawn = {}
+                output.append(term.clear)
+
+            name_width = max([len(x) for x in names] + [4]) + 2
+            widths = [width for _, width in self.COLUMNS]
+            rows = []
+            for name in names[:max(0, term.height - 2)]:
+                rows.append(self._cells(self.fields[name]))
+
+        if not self.drawn:
+            header = 'name'.ljust(name_width) + ''.join(
+                title.rjust(width) for title, width in self.COLUMNS)
+            output.append(term.move(0, 0) + term.bold + header + term.normal)
+            for row, name in enumerate(names[:len(rows)]):
+                output.append(term.move(row + 1, 0) + name)
+
+        for row, cells in enumerate(rows):
+            x = name_width
+            for column, (text, width) in enumerate(zip(cells, widths)):
+                key = (row, column)
+                if self.drawn.get(key, None) != text:
+                    self.drawn[key] = text
+                    output.append(
+                        term.move(row + 1, x) + text[:width].rjust(width))
+                x += width
+
+        if output:
+            sys.stdout.write(''.join(output))
+            sys.stdout.flush()
 
 
 class Viewer(object):
@@ -34,31 +265,92 @@ class Viewer(object):
             self.target = (host, int(port))
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.received = queue.Queue()
+
+        self.recorder = None
+        if options.record:
+            self.recorder = Recorder(options.record, options.record_interval)
+
+        self.dashboard = None
+        if options.dashboard:
+            self.dashboard = Dashboard(blessings.Terminal())
+
+        self.allan = None
+        # The curves are updated from the decode thread, but also
+        # saved from the main thread on exit.
+        self.allan_lock = threading.Lock()
+        if options.allan:
+            self.allan = allan_streaming.Monitor(
+                options.allan_prefix, options.allan_interval)
 
     def poll_task(self):
-        name_str = '[' + ','.join(['"%s"' % x for x in self.args]) + ']'
+        names = list(self.args)
+        if self.options.subscribe:
+            # The server pushes updates itself, and drops subscriptions
+            # which are not renewed, so this just keeps them alive.
+            message = json.dumps({'command': 'subscribe', 'names': names,
+                                  'rate_hz': self.options.rate})
+            interval = self.options.keepalive
+        else:
+            message = json.dumps({'command': 'get', 'names': names})
+            interval = self.options.interval
         while True:
-            self.sock.sendto(
-                '{"command":"get","names":%s}' % name_str, self.target)
-            time.sleep(self.options.interval)
+            self.sock.sendto(message.encode('utf8'), self.target)
+            time.sleep(interval)
+
+    def unsubscribe(self):
+        self.sock.sendto(
+            json.dumps({'command': 'unsubscribe',
+                        'names': list(self.args)}).encode('utf8'),
+            self.target)
 
     def read_task(self):
+        # Only timestamp and queue packets here, so that decoding
+        # never delays reading the socket.
         while True:
             data = self.sock.recv(15000)
+            self.received.put((time.time(), data))
+
+    def decode_task(self):
+        while True:
+            now, data = self.received.get()
 
-            j = json.loads(data)
+            try:
+                j = json.loads(data.decode('utf8'))
+            except ValueError:
+                j = {}
             if not 'type' in j:
-                print 'unexpected message:', data
+                print('unexpected message:', data)
                 continue
 
             if j['type'] == 'reply':
-                self.handle_reply(j, data)
+                self.handle_reply(now, j, data)
+
+    def handle_reply(self, now, msg, data):
+        '''now is the time the reply was received.'''
+        if self.allan:
+            # Replies carry no sample time of their own, so use the
+            # time they were received.
+            with self.allan_lock:
+                for name, value in msg['reply'].items():
+                    self.allan.add(name, now, value)
+                self.allan.poll(now)
+
+        if self.recorder:
+            for name, value in msg['reply'].items():
+                self.recorder.add(now, name, value)
 
-    def handle_reply(self, msg, data):
+        if self.dashboard:
+            for name, value in msg['reply'].items():
+                self.dashboard.add(name, value)
+            return
+
+        if self.options.quiet:
+            return
         if self.options.raw:
-            print data
+            print(data.decode('utf8'))
         else:
-            print msg['reply']
+            print(msg['reply'])
 
 
 def main():
@@ -66,6 +358,30 @@ def main():
     parser.add_option('--target', '-t', default='localhost')
     parser.add_option('--interval', '-i', type='float', default=0.2)
     parser.add_option('--raw', '-r', action='store_true')
+    parser.add_option('--quiet', '-q', action='store_true',
+                      help='do not print replies')
+    parser.add_option('--dashboard', '-d', action='store_true',
+                      help='show the latest value of each field in place')
+    parser.add_option('--refresh', type='float', default=10.0,
+                      help='dashboard redraws per second')
+    parser.add_option('--record', metavar='FILE',
+                      help='save every reply to a .npz file, or a .npy file '
+                      'if only one name is requested')
+    parser.add_option('--record-interval', type='float', default=10.0,
+                      help='seconds between writes of recorded pieces')
+    parser.add_option('--subscribe', '-s', action='store_true',
+                      help='have the server push updates instead of polling')
+    parser.add_option('--rate', type='float', default=10.0,
+                      help='maximum updates per second of each name '
+                      'when subscribed')
+    parser.add_option('--keepalive', type='float', default=1.0,
+                      help='seconds between subscription renewals')
+    parser.add_option('--allan', action='store_true',
+                      help='compute the Allan deviation of each record live')
+    parser.add_option('--allan-prefix', default='allan-',
+                      help='curves are saved to PREFIX<name>.csv')
+    parser.add_option('--allan-interval', type='float', default=10.0,
+                      help='seconds between saves of the Allan curves')
 
     options, args = parser.parse_args()
 
@@ -77,8 +393,29 @@ def main():
     rt = threading.Thread(target=viewer.read_task)
     rt.daemon = True
     rt.start()
-    while True:
-        time.sleep(1)
+    dt = threading.Thread(target=viewer.decode_task)
+    dt.daemon = True
+    dt.start()
+    try:
+        if viewer.dashboard:
+            term = viewer.dashboard.term
+            with term.fullscreen(), term.hidden_cursor():
+                while True:
+                    viewer.dashboard.draw()
+                    time.sleep(1.0 / options.refresh)
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if options.subscribe:
+            viewer.unsubscribe()
+        if viewer.recorder:
+            viewer.recorder.save()
+        if viewer.allan:
+            with viewer.allan_lock:
+                viewer.allan.save()
 
 if __name__ == '__main__':
     main()
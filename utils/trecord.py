@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+# Copyright 2015 Josh Pieper, jjp@pobox.com.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''%prog [options] DEVICE[=PREFIX]...
+
+Record tlog style telemetry from several serial devices at once into
+a single tlog file.  Each record is named "PREFIX_name", where PREFIX
+defaults to the base name of the device, and every data block carries
+the host time it was received at, so that records from devices with
+unrelated clocks can be compared.
+'''
+
+import asyncio
+import optparse
+import os
+import time
+
+import tlog_file
+import tserial
+
+
+class Device(object):
+    '''One serial device, whose records are written with a name
+    prefix.'''
+
+    def __init__(self, spec, options):
+        if '=' in spec:
+            self.path, self.prefix = spec.split('=', 1)
+        else:
+            self.path, self.prefix = spec, os.path.basename(spec)
+        self.options = options
+        self.serial = None
+        self.schemas = []
+        self.parser = tserial.EmitParser()
+        self.records = 0
+
+    def record_name(self, name):
+        return self.prefix + '_' + name
+
+    def open(self):
+        '''Open the port and fetch the schemas of all records to be
+        recorded.  This blocks, so is run on an executor thread.'''
+        self.serial = tserial.Serial(self.path, self.options.baudrate)
+        for name in self.serial.list():
+            if (self.options.name and
+                    self.record_name(name) not in self.options.name):
+                continue
+            self.schemas.append((name, self.serial.schema(name)))
+
+    def start(self, loop, handler, done):
+        '''Start all records emitting, and call handler(name, data,
+        host_timestamp) for each one received.  If the port fails, done
+        is given the exception.'''
+        for name, _ in self.schemas:
+            self.serial.rate(name, self.options.rate)
+
+        port = self.serial.port
+        port.timeout = 0
+        loop.add_reader(port.fileno(), self._read, loop, handler, done)
+
+    def _read(self, loop, handler, done):
+        try:
+            data = self.serial.port.read(tserial.READ_SIZE)
+        except Exception as e:
+            loop.remove_reader(self.serial.port.fileno())
+            if not done.done():
+                done.set_exception(e)
+            return
+
+        now = time.time()
+        for name, payload in self.parser.feed(data):
+            handler(self.record_name(name), payload, now)
+            self.records += 1
+
+
+async def record(devices, output, options):
+    loop = asyncio.get_event_loop()
+
+    print('opening devices')
+    await asyncio.gather(*[loop.run_in_executor(None, device.open)
+                           for device in devices])
+
+    for device in devices:
+        for name, schema in device.schemas:
+            output.write_schema(device.record_name(name), schema)
+            print('got schema for %s len %d' % (
+                device.record_name(name), len(schema)))
+
+    print('starting to record')
+    done = loop.create_future()
+    for device in devices:
+        device.start(loop, output.write_data, done)
+
+    while not done.done():
+        await asyncio.wait([done], timeout=options.flush_interval)
+        output.poll()
+        print(' '.join('%s: %d' % (device.prefix, device.records)
+                       for device in devices) + '\r', end='', flush=True)
+    done.result()
+
+
+def main():
+    usage, description = __doc__.split('\n\n', 1)
+    parser = optparse.OptionParser(usage=usage, description=description)
+
+    parser.add_option('--baudrate', '-b', type='int', default=115200)
+    parser.add_option('--name', '-n', action='append', default=[],
+                      help='record only this PREFIX_name, may be repeated')
+    parser.add_option('--rate', '-r', type='int', default=1,
+                      help='1 is every update, otherwise ms')
+    parser.add_option('--output', '-o', help='output tlog file')
+    parser.add_option('--index', action='store_true',
+                      help='write a seek index when the output is closed')
+    parser.add_option('--flush-interval', type='float', default=0.5,
+                      help='maximum seconds data is buffered before '
+                      'being written')
+    parser.add_option('--compress', type='choice',
+                      choices=sorted(tlog_file.CODECS.keys()),
+                      help='write compressed blocks using this codec')
+
+    options, args = parser.parse_args()
+    if not args:
+        parser.error('at least one device is required')
+    if not options.output:
+        parser.error('an output file is required')
+
+    devices = [Device(spec, options) for spec in args]
+    prefixes = [device.prefix for device in devices]
+    if len(set(prefixes)) != len(prefixes):
+        parser.error('device prefixes must be unique')
+
+    output = tserial.LogWriter(options.output, write_index=options.index,
+                               flush_interval_s=options.flush_interval,
+                               compress=options.compress)
+    try:
+        asyncio.run(record(devices, output, options))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        output.close()
+
+
+if __name__ == '__main__':
+    main()
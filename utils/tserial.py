@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright 2015 Josh Pieper, jjp@pobox.com.
 #
@@ -21,29 +21,103 @@ telemetry.  Optionally log the data to disk in a tlog file.
 '''
 
 import optparse
+import queue
 import serial
 import struct
+import threading
+import time
+
+import allan_streaming
+import tlog_file
+
+# Size of each read from the serial port while capturing.  Reads return
+# early after READ_TIMEOUT_S if less data is available.
+READ_SIZE = 65536
+READ_TIMEOUT_S = 0.01
+
+# Lines longer than this while looking for an "emit" are discarded.
+MAX_LINE = 4096
+
+# When compressing, data blocks of a record are collected until they
+# hold this many bytes, or the writer is flushed.
+COMPRESS_SIZE = 65536
+
+
+class EmitParser(object):
+    '''Incrementally splits a byte stream into the frames emitted by
+    "tel rate", each of which is a line "emit <name>", a 4 byte little
+    endian size, and that many bytes of data.  Anything else between
+    frames is ignored.'''
+
+    _STATE_LINE, _STATE_SIZE, _STATE_DATA = range(3)
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.pos = 0
+        self.state = self._STATE_LINE
+        self.name = None
+        self.size = 0
+
+    def feed(self, data):
+        '''Add received data, and return a list of (name, data) for
+        each frame it completed.'''
+        self.buf += data
+        result = []
+        while True:
+            if self.state == self._STATE_LINE:
+                end = self.buf.find(b'\n', self.pos)
+                if end < 0:
+                    if len(self.buf) - self.pos > MAX_LINE:
+                        self.pos = len(self.buf)
+                    break
+                line = self.buf[self.pos:end]
+                self.pos = end + 1
+                if line.startswith(b'emit '):
+                    self.name = line[5:].strip().decode('latin1')
+                    self.state = self._STATE_SIZE
+            elif self.state == self._STATE_SIZE:
+                if len(self.buf) - self.pos < 4:
+                    break
+                self.size = struct.unpack_from('<I', self.buf, self.pos)[0]
+                self.pos += 4
+                self.state = self._STATE_DATA
+            else:
+                if len(self.buf) - self.pos < self.size:
+                    break
+                result.append(
+                    (self.name, bytes(self.buf[self.pos:self.pos + self.size])))
+                self.pos += self.size
+                self.state = self._STATE_LINE
+
+        # Drop consumed data once it is a large part of the buffer, so
+        # that the remainder is not moved for every small read.
+        if self.pos > 65536 and self.pos * 2 > len(self.buf):
+            del self.buf[:self.pos]
+            self.pos = 0
+        return result
+
 
 class Serial(object):
-    def __init__(self, options):
-        self.options = options
-        self.port = serial.Serial(port=options.serial,
-                                  baudrate=options.baudrate)
+    def __init__(self, port, baudrate):
+        self.port = serial.Serial(port=port, baudrate=baudrate)
 
         # Try to stop anything that might be spewing.
         self.stop()
 
         # Try to dump anything that is still in the receive queue.
-        self.port.setTimeout(0.1)
+        self.port.timeout = 0.1
         result = self.port.read(8192)
-        print 'ignored %d bytes on start' % len(result)
+        print('ignored %d bytes on start' % len(result))
 
     def stop(self):
-        self.port.write('\ntel stop\n')
+        self.command('tel stop')
+
+    def command(self, text):
+        self.port.write(('\n%s\n' % text).encode('latin1'))
 
     def readline(self):
         while True:
-            line = self.port.readline()
+            line = self.port.readline().decode('latin1')
             if line.startswith('unknown'):
                 continue
             if line.strip() == '':
@@ -52,7 +126,7 @@ class Serial(object):
 
     def list(self):
         result = []
-        self.port.write('\ntel list\n')
+        self.command('tel list')
         while True:
             line = self.readline()
             if line.startswith("OK"):
@@ -62,7 +136,7 @@ class Serial(object):
         return result
 
     def schema(self, name):
-        self.port.write('\ntel schema %s\n' % name)
+        self.command('tel schema %s' % name)
         line = self.readline()
         assert line.startswith('schema ' + name), 'got unexpected schema response: ' + line
         size_str = self.port.read(4)
@@ -73,36 +147,85 @@ class Serial(object):
         return data
 
     def rate(self, name, rate):
-        self.port.write('\ntel rate %s %d\n' % (name, rate))
+        self.command('tel rate %s %d' % (name, rate))
+
+    def start_capture(self):
+        '''Start a thread which reads everything from the port in large
+        blocks.  After this, only read_data may be used.'''
+        self.port.timeout = READ_TIMEOUT_S
+        self.queue = queue.Queue()
+        self.parser = EmitParser()
+        self.reader = threading.Thread(target=self._read_task)
+        self.reader.daemon = True
+        self.reader.start()
+
+    def _read_task(self):
+        try:
+            while True:
+                data = self.port.read(READ_SIZE)
+                if data:
+                    self.queue.put(data)
+        except Exception as e:
+            self.queue.put(e)
+
+    def read_data(self, timeout):
+        '''Return a list of (name, data) for every frame received so
+        far, waiting up to timeout seconds for at least one block of
+        data.'''
+        try:
+            item = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return []
 
-    def read_next_data(self):
-        # Read until we get an "emit" line.
-        self.port.setTimeout(None)
-        line = ''
+        result = []
         while True:
-            line = self.readline()
-            if line.startswith('emit '):
-                break
+            if isinstance(item, Exception):
+                raise item
+            result += self.parser.feed(item)
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return result
 
-        name = line.split(' ')[1].strip()
-        size_str = self.port.read(4)
-        assert len(size_str) == 4
-        size = struct.unpack('<I', size_str)[0]
 
-        data = self.port.read(size)
-        return name, data
+class LogWriter(object):
+    '''Writes a TLOG0002 file.  Blocks are buffered and written
+    together, at most flush_interval_s after the first of them, or
+    sooner if flush_size bytes are pending.
 
+    If compress names a codec from tlog_file.CODECS, data blocks of
+    each record are grouped into compressed blocks.'''
 
-class LogWriter(object):
-    def __init__(self, name):
+    def __init__(self, name, write_index=False, flush_interval_s=0.5,
+                 flush_size=1 << 20, compress=None):
         self.fd = open(name, 'wb')
-        self.fd.write('TLOG0002')
+        self.fd.write(tlog_file.HEADER)
 
         self.fd.flush()
 
+        self.flush_interval_s = flush_interval_s
+        self.flush_size = flush_size
+        self.pending = []
+        self.pending_size = 0
+        self.flush_time = None
+
+        self.codec = None
+        if compress:
+            self.codec = tlog_file.CODECS[compress]
+        self.groups = {}
+        self.group_sizes = {}
+
+        self.offset = len(tlog_file.HEADER)
         self.next_identifier = 1
         self.names = {}
 
+        self.timestamp_decoder = None
+        self.index_builder = None
+        if write_index:
+            self.timestamp_decoder = tlog_file.TimestampDecoder()
+            self.index_builder = tlog_file.IndexBuilder(
+                self.timestamp_decoder)
+
     BLOCK_SCHEMA = 1
     BLOCK_DATA = 2
 
@@ -110,33 +233,99 @@ class LogWriter(object):
         return struct.pack('<I', len(data)) + data
 
     def _make_schema_block(self, identifier, name, schema):
-        result = ''
+        result = b''
         result += struct.pack('<II', identifier, 0)
-        result += self.make_pstring(name)
+        result += self.make_pstring(name.encode('latin1'))
         result += schema
         return result
 
-    def _make_data_block(self, identifier, data):
-        result = struct.pack('<IH', identifier, 0) + data
-        return result
-
     def write_schema(self, name, schema):
         identifier = self.next_identifier
         self.next_identifier += 1
 
         self.names[name] = identifier
 
+        if self.index_builder:
+            encoded_name = name.encode('latin1')
+            self.timestamp_decoder.add_schema(identifier, encoded_name, schema)
+            self.index_builder.add_schema(self.offset, identifier, encoded_name)
+
         self.write_block(self.BLOCK_SCHEMA,
                          self._make_schema_block(identifier, name, schema))
 
-    def write_data(self, name, data):
+    def write_data(self, name, data, host_timestamp=None):
+        '''If host_timestamp is given, it is recorded as the time the
+        host received the data.'''
         identifier = self.names[name]
-        self.write_block(self.BLOCK_DATA,
-                         self._make_data_block(identifier, data))
+        payload = tlog_file.make_data_block(identifier, data, host_timestamp)
+
+        if self.codec is None:
+            if self.index_builder:
+                self.index_builder.add_data(
+                    self.offset, identifier, data, host_timestamp)
+            self.write_block(self.BLOCK_DATA, payload)
+        else:
+            self.groups.setdefault(identifier, []).append(
+                (payload, data, host_timestamp))
+            size = self.group_sizes.get(identifier, 0) + len(payload)
+            self.group_sizes[identifier] = size
+            if self.flush_time is None:
+                self.flush_time = time.time() + self.flush_interval_s
+            if size >= COMPRESS_SIZE:
+                self._write_group(identifier)
+
+        self.poll()
+
+    def _write_group(self, identifier):
+        entries = self.groups.pop(identifier)
+        del self.group_sizes[identifier]
+
+        if self.index_builder:
+            for _, data, host_timestamp in entries:
+                self.index_builder.add_data(
+                    self.offset, identifier, data, host_timestamp)
+        self.write_block(tlog_file.BLOCK_COMPRESSED,
+                         tlog_file.make_compressed_block(
+                             identifier, self.codec,
+                             [payload for payload, _, _ in entries]))
 
     def write_block(self, block_id, data):
-        self.fd.write(struct.pack('<HI', block_id, len(data)) + data)
-        self.fd.flush()
+        self.pending.append(struct.pack('<HI', block_id, len(data)))
+        self.pending.append(data)
+        self.pending_size += 6 + len(data)
+        self.offset += 6 + len(data)
+
+        if self.flush_time is None:
+            self.flush_time = time.time() + self.flush_interval_s
+        if self.pending_size >= self.flush_size:
+            self._write_pending()
+
+    def poll(self):
+        '''Flush if the oldest pending block has waited long enough.
+        This should be called periodically when no data is arriving.'''
+        if self.flush_time is not None and time.time() >= self.flush_time:
+            self.flush()
+
+    def flush(self):
+        for identifier in list(self.groups.keys()):
+            self._write_group(identifier)
+        self._write_pending()
+        self.flush_time = None
+
+    def _write_pending(self):
+        if self.pending:
+            self.fd.write(b''.join(self.pending))
+            self.fd.flush()
+        self.pending = []
+        self.pending_size = 0
+
+    def close(self):
+        self.flush()
+        if self.index_builder:
+            tlog_file.write_index(
+                self.fd, self.offset, self.index_builder.finish())
+            self.index_builder = None
+        self.fd.close()
 
 
 def main():
@@ -150,50 +339,91 @@ def main():
     parser.add_option('--rate', '-r', type='int', default=1,
                       help='1 is every update, otherwise ms')
     parser.add_option('--output', '-o', help='output tlog file')
+    parser.add_option('--index', action='store_true',
+                      help='write a seek index when the output is closed')
+    parser.add_option('--flush-interval', type='float', default=0.5,
+                      help='maximum seconds data is buffered before '
+                      'being written')
+    parser.add_option('--compress', type='choice',
+                      choices=sorted(tlog_file.CODECS.keys()),
+                      help='write compressed blocks using this codec')
+    parser.add_option('--allan', action='append', default=[],
+                      metavar='NAME',
+                      help='compute the Allan deviation of this record live')
+    parser.add_option('--allan-prefix', default='allan-',
+                      help='curves are saved to PREFIX<name>.csv')
+    parser.add_option('--allan-interval', type='float', default=10.0,
+                      help='seconds between saves of the Allan curves')
 
     options, args = parser.parse_args()
 
-    ser = Serial(options)
+    ser = Serial(options.serial, options.baudrate)
     if options.list:
-        print '\n'.join(ser.list())
+        print('\n'.join(ser.list()))
         return
 
     if len(options.name) == 0:
         # If no names are specified, get everything.
-        print 'getting names'
+        print('getting names')
         options.name = ser.list()
 
     output = None
     if options.output:
-        output = LogWriter(options.output)
+        output = LogWriter(options.output, write_index=options.index,
+                           flush_interval_s=options.flush_interval,
+                           compress=options.compress)
 
-    print 'getting schemas'
+    allan = None
+    decoders = {}
+    if options.allan:
+        allan = allan_streaming.Monitor(
+            options.allan_prefix, options.allan_interval)
+
+    print('getting schemas')
     # Get the schema for all the requested things.
     for name in options.name:
         schema = ser.schema(name)
         if output:
             output.write_schema(name, schema)
-        print 'got schema for %s len %d' % (name, len(schema))
+        if name in options.allan:
+            decoders[name] = tlog_file.make_decoder(
+                name.encode('latin1'), schema)
+        print('got schema for %s len %d' % (name, len(schema)))
 
-    print 'setting rates'
+    print('setting rates')
     # Now start everything being sent out.
     for name in options.name:
         ser.rate(name, options.rate)
 
-    print 'starting to record'
+    print('starting to record')
 
     # Now, we just continue reading, looking for more data to come
     # out.
+    ser.start_capture()
     try:
         records = 0
         while True:
-            name, data = ser.read_next_data()
+            frames = ser.read_data(options.flush_interval)
+            for name, data in frames:
+                if output:
+                    output.write_data(name, data)
+                if name in decoders:
+                    now = time.time()
+                    value = decoders[name](data)
+                    timestamp = tlog_file.find_timestamp(value)
+                    allan.add(name, now if timestamp is None else timestamp,
+                              value)
+                    allan.poll(now)
             if output:
-                output.write_data(name, data)
-            records += 1
-            print 'count: %d\r' % records,
+                output.poll()
+            if frames:
+                records += len(frames)
+                print('count: %d\r' % records, end='', flush=True)
     finally:
-        pass
+        if output:
+            output.close()
+        if allan:
+            allan.save()
         #ser.stop()
 
 